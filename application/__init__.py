@@ -3,7 +3,9 @@ import os
 
 # Persistent Storage
 from flask_sqlalchemy import SQLAlchemy
-import joblib
+from application.model_store import load_model
+from application.registry import current_artifact
+from application.storage import configure_storage
 
 app = Flask(__name__)
 
@@ -13,10 +15,22 @@ if "TESTING" in os.environ:
 elif "DEVELOPMENT" in os.environ:
     app.config.from_envvar("DEVELOPMENT")
     print("Using config for DEVELOPMENT")
+elif "PRODUCTION" in os.environ:
+    app.config.from_envvar("PRODUCTION")
+    print("Using config for PRODUCTION")
 
 db = SQLAlchemy(app)
-model_path = "./application/static/ai_model_2.joblib"
-ai_model = joblib.load(model_path)
+# PRAGMAs and connection pool of the SQLite database, set by SQLITE_PROFILE
+configure_storage(app, db)
+model_path = app.config.get("MODEL_PATH", "./application/static/ai_model_2.joblib")
+model_version = os.path.splitext(os.path.basename(model_path))[0]
+# With a MODEL_REGISTRY_DIR, start from its current version. New versions are swapped in by application.inference
+if app.config.get("MODEL_REGISTRY_DIR"):
+    registry_version, registry_path = current_artifact(app.config["MODEL_REGISTRY_DIR"])
+    if registry_version is not None:
+        model_version, model_path = registry_version, registry_path
+# With MODEL_MMAP, the forest is memory-mapped from a sidecar of the model, so that worker processes share it
+ai_model = load_model(model_path, mmap=app.config.get("MODEL_MMAP", False))
 
 NEIGHBORHOODS = sorted(
     [
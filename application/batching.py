@@ -0,0 +1,149 @@
+from collections import Counter
+from concurrent.futures import Future, TimeoutError
+import queue
+import threading
+import time
+
+
+class MicroBatcher:
+    """
+    Coalesces single-row predictions arriving from concurrent requests into batched calls to the model.
+
+    The first request to arrive opens a window of max_wait_ms. Every request arriving within that window
+    (up to max_batch_size rows) joins the batch, which is then predicted with a single call to predict_fn.
+    Each caller gets back its own result through a Future.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait_ms=2.0):
+        """
+        Args:
+            predict_fn (Callable): Function that takes a list of rows and returns a list of predictions
+            max_batch_size (int, optional): Maximum number of rows in a batch. Defaults to 64.
+            max_wait_ms (float, optional): How long to wait for more rows after the first row of a batch arrives. Defaults to 2.0.
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        # Counters used to tune the batch size and window
+        self.batch_sizes = Counter()
+        self.requests = 0
+        self.batches = 0
+        self.queue_delay_total = 0.0
+        self.queue_delay_max = 0.0
+        self.timeouts = 0
+
+    def submit(self, row):
+        """Queue a row to be predicted in the next batch
+
+        Args:
+            row (dict): Validated listing
+
+        Returns:
+            Future: Resolves to the prediction for the row
+        """
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((row, future, time.perf_counter()))
+        return future
+
+    def predict(self, row, timeout=None):
+        """Predict a single row, blocking until its batch has been predicted
+
+        Raises:
+            TimeoutError: The prediction took longer than timeout seconds. A row that was not predicted yet is dropped
+        """
+        future = self.submit(row)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise
+
+    def batch_size_histogram(self):
+        """Cumulative counts of batches by size, with power of two bounds up to max_batch_size
+
+        Returns:
+            dict: {"buckets": [(upper bound, batches of at most that size)], "sum": rows, "count": batches}, the
+                last bound being infinity
+        """
+        bounds = []
+        bound = 1
+        while bound < self.max_batch_size:
+            bounds.append(bound)
+            bound *= 2
+        bounds += [self.max_batch_size, float("inf")]
+        with self._lock:
+            sizes = dict(self.batch_sizes)
+            requests, batches = self.requests, self.batches
+        buckets = [(bound, sum(count for size, count in sizes.items() if size <= bound)) for bound in bounds]
+        return {"buckets": buckets, "sum": requests, "count": batches}
+
+    def stats(self):
+        """Snapshot of the batch-size distribution and queueing delay (in seconds)"""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+                "queue_delay_total": self.queue_delay_total,
+                "queue_delay_max": self.queue_delay_max,
+                "timeouts": self.timeouts,
+                "queue_delay_mean": self.queue_delay_total / self.requests
+                if self.requests
+                else 0.0,
+            }
+
+    def _ensure_worker(self):
+        # Started lazily, so that forking servers start the thread in each worker rather than the parent
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="prediction-microbatcher", daemon=True
+                )
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:  # Window is over, but still take whatever is already waiting
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Rows whose caller timed out and cancelled them are not predicted
+            batch = [item for item in self._collect() if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            with self._lock:
+                self.requests += len(batch)
+                self.batches += 1
+                self.batch_sizes[len(batch)] += 1
+                for _, _, enqueued in batch:
+                    delay = started - enqueued
+                    self.queue_delay_total += delay
+                    self.queue_delay_max = max(self.queue_delay_max, delay)
+            try:
+                results = self.predict_fn([row for row, _, _ in batch])
+            except Exception as error:
+                for _, future, _ in batch:
+                    future.set_exception(error)
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
@@ -0,0 +1,97 @@
+from collections import OrderedDict
+import threading
+import time
+
+MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe, bounded least-recently-used cache with an optional time-to-live.
+
+    Every entry belongs to a generation (for example, the model that computed it). Looking up or storing an
+    entry with a different generation from the current one clears the cache, so that entries computed by an
+    old model are never served once a new model is loaded.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        """
+        Args:
+            maxsize (int, optional): Maximum number of entries. A size of 0 disables the cache. Defaults to 1024.
+            ttl (float, optional): Number of seconds an entry stays valid for, or None to keep entries until evicted. Defaults to None.
+        """
+        self.maxsize = max(0, int(maxsize))
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, generation=None, default=MISSING):
+        """Look up a key, marking it as recently used
+
+        Returns:
+            Any: Cached value, or default (MISSING unless given) if the key is not cached or has expired
+        """
+        with self._lock:
+            self._check_generation(generation)
+            item = self._data.get(key, MISSING)
+            if item is not MISSING:
+                value, expires = item
+                if expires is not None and expires <= time.monotonic():
+                    del self._data[key]
+                    self.expirations += 1
+                else:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return default
+
+    def set(self, key, value, generation=None):
+        """Store a value, evicting the least recently used entry if the cache is full"""
+        if self.maxsize == 0:
+            return
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._check_generation(generation)
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Snapshot of the cache counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+    def _check_generation(self, generation):
+        # Must be called with the lock held
+        if generation is not self._generation:
+            if self._data:
+                self.invalidations += 1
+            self._data.clear()
+            self._generation = generation
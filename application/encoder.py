@@ -0,0 +1,217 @@
+from sklearn.compose import ColumnTransformer
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import (
+    FunctionTransformer,
+    MinMaxScaler,
+    OneHotEncoder,
+    PowerTransformer,
+    RobustScaler,
+    StandardScaler,
+)
+from sklearn.experimental import enable_iterative_imputer  # noqa: F401
+from sklearn.impute import IterativeImputer
+import numpy as np
+import pandas as pd
+
+# Transformers that act on each column independently (once there are no missing values to impute),
+# so a value's encoding does not depend on the rest of its row and can be looked up from a table.
+COLUMNWISE_TRANSFORMERS = (
+    PowerTransformer,
+    StandardScaler,
+    MinMaxScaler,
+    RobustScaler,
+    SimpleImputer,
+    IterativeImputer,
+)
+
+# Numerical values to precompute the encoding of. Covers the usual number of beds, bathrooms, guests and
+# minimum nights; anything else is encoded by the fitted transformer when it is seen.
+TABLE_VALUES = np.unique(
+    np.concatenate([np.arange(0, 366), np.arange(0, 20.25, 0.25), [500, 730, 1000, 1125]])
+).astype(np.float64)
+
+
+class UnsupportedPipeline(Exception):
+    """Raised when a pipeline contains a step the FeatureEncoder does not know how to compile"""
+
+
+class FeatureEncoder:
+    """
+    Maps validated listings straight to the numerical array the final estimator of the pipeline expects,
+    without building a DataFrame or running the ColumnTransformers on every request.
+
+    The column layout is derived once from the fitted preprocessing pipeline: every output column is either
+    a one-hot indicator of a categorical field, a field passed through as-is, or the output of a columnwise
+    numerical transformer. The numerical transformers are evaluated ahead of time over TABLE_VALUES, so the
+    encoded values are identical to the ones the pipeline would produce.
+    """
+
+    def __init__(self, fields, n_features, onehot, passthrough, blocks):
+        self.fields = fields
+        self.n_features = n_features
+        self.onehot = onehot  # [(field, {category: output column}, handle_unknown)]
+        self.passthrough = passthrough  # [(field, output column)]
+        self.blocks = blocks  # [(transformer, [fields], [output columns], [{value: encoded value}], [column names])]
+
+    @classmethod
+    def from_pipeline(cls, preprocessor, columns):
+        """Compile a fitted preprocessing pipeline
+
+        Args:
+            preprocessor (Pipeline): Fitted preprocessing steps of the model (every step except the final estimator)
+            columns (dict): Maps the field names of a listing to the DataFrame columns the pipeline was fitted on, in order
+
+        Raises:
+            UnsupportedPipeline: The pipeline contains a step that cannot be compiled
+
+        Returns:
+            FeatureEncoder: Encoder producing the same array as preprocessor.transform
+        """
+        steps = _flatten(preprocessor)
+        fields = list(columns.keys())
+        # Each column flowing through the pipeline is described by where its values come from:
+        # ("field", name) for a field that is passed through unchanged, or ("block", idx, k) for the kth output of a numerical transformer
+        sources = [("field", field) for field in fields]
+        names = list(columns.values())
+        blocks = []
+        onehot = []
+        passthrough = []
+        for step_idx, step in enumerate(steps):
+            final = step_idx == len(steps) - 1
+            if isinstance(step, FunctionTransformer) and step.func is pd.DataFrame:
+                # Only renames the columns
+                names = list((step.kw_args or {}).get("columns", range(len(sources))))
+                if len(names) != len(sources):
+                    raise UnsupportedPipeline("DataFrame step does not match the number of columns")
+                continue
+            if not isinstance(step, ColumnTransformer):
+                raise UnsupportedPipeline(f"Cannot compile step {step!r}")
+            new_sources = []
+            for name, transformer, selected in step.transformers_:
+                selected = _resolve_columns(selected, names)
+                if transformer == "drop" or len(selected) == 0:
+                    continue
+                inputs = [sources[idx] for idx in selected]
+                if transformer == "passthrough" or (
+                    isinstance(transformer, SimpleImputer) and all(src[0] == "field" for src in inputs)
+                ):
+                    # Validated listings have no missing values, so imputing categorical fields changes nothing
+                    new_sources.extend(inputs)
+                elif isinstance(transformer, OneHotEncoder):
+                    if not final or getattr(transformer, "drop_idx_", None) is not None:
+                        raise UnsupportedPipeline("Only a final, non-dropping OneHotEncoder is supported")
+                    if any(src[0] != "field" for src in inputs):
+                        raise UnsupportedPipeline("OneHotEncoder should be applied to raw fields")
+                    for src, categories in zip(inputs, transformer.categories_):
+                        start = len(new_sources)
+                        lookup = {category: start + k for k, category in enumerate(categories)}
+                        onehot.append((src[1], lookup, transformer.handle_unknown))
+                        new_sources.extend(("onehot",) for _ in categories)
+                else:
+                    if any(src[0] != "field" for src in inputs) or not _is_columnwise(transformer):
+                        raise UnsupportedPipeline(f"Cannot compile transformer {name!r}")
+                    block_fields = [src[1] for src in inputs]
+                    block_names = [names[idx] for idx in selected]
+                    tables = _build_tables(transformer, block_names)
+                    new_sources.extend(("block", len(blocks), k) for k in range(len(block_fields)))
+                    blocks.append([transformer, block_fields, None, tables, block_names])
+            sources = new_sources
+            names = list(range(len(sources)))
+
+        for column, src in enumerate(sources):
+            if src[0] == "field":
+                passthrough.append((src[1], column))
+            elif src[0] == "block":
+                if blocks[src[1]][2] is None:
+                    blocks[src[1]][2] = [None] * len(blocks[src[1]][1])
+                blocks[src[1]][2][src[2]] = column
+        blocks = [tuple(block) for block in blocks if block[2] is not None]
+        return cls(fields, len(sources), onehot, passthrough, blocks)
+
+    def transform(self, rows):
+        """Encode listings into the array expected by the final estimator
+
+        Args:
+            rows (list[dict]): Validated listings, keyed by field name
+
+        Raises:
+            ValueError: A categorical field has an unknown value, and the encoder was fitted to reject them
+
+        Returns:
+            np.ndarray: Array of shape (len(rows), n_features)
+        """
+        X = np.zeros((len(rows), self.n_features), dtype=np.float64)
+        for field, lookup, handle_unknown in self.onehot:
+            for idx, row in enumerate(rows):
+                column = lookup.get(row[field])
+                if column is not None:
+                    X[idx, column] = 1.0
+                elif handle_unknown == "error":
+                    raise ValueError(f"Found unknown category {row[field]!r} in {field}")
+        for field, column in self.passthrough:
+            X[:, column] = [float(row[field]) for row in rows]
+        for transformer, fields, columns, tables, block_names in self.blocks:
+            values = np.array([[float(row[field]) for field in fields] for row in rows], dtype=np.float64)
+            encoded = np.empty_like(values)
+            missing = []
+            for idx, row_values in enumerate(values):
+                try:
+                    encoded[idx] = [table[value] for table, value in zip(tables, row_values)]
+                except KeyError:
+                    missing.append(idx)
+            if missing:
+                encoded[missing] = transformer.transform(_as_input(values[missing], block_names))
+            for k, column in enumerate(columns):
+                if column is not None:
+                    X[:, column] = encoded[:, k]
+        return X
+
+
+def _flatten(step):
+    """List the steps of a (possibly nested) pipeline in the order they are applied"""
+    if isinstance(step, Pipeline):
+        return [leaf for _, inner in step.steps for leaf in _flatten(inner)]
+    return [step]
+
+
+def _resolve_columns(selected, names):
+    """Resolve the columns selected by a ColumnTransformer into positions"""
+    if isinstance(selected, slice):
+        return list(range(len(names)))[selected]
+    if isinstance(selected, (str, int, np.integer)):
+        selected = [selected]
+    selected = list(selected)
+    if len(selected) > 0 and all(isinstance(col, (bool, np.bool_)) for col in selected):
+        return [idx for idx, keep in enumerate(selected) if keep]
+    resolved = []
+    for col in selected:
+        if isinstance(col, (int, np.integer)):
+            resolved.append(int(col))
+        elif col in names:
+            resolved.append(names.index(col))
+        else:
+            raise UnsupportedPipeline(f"Unknown column {col!r}")
+    return resolved
+
+
+def _is_columnwise(transformer):
+    if isinstance(transformer, Pipeline):
+        return all(_is_columnwise(step) for _, step in transformer.steps)
+    return isinstance(transformer, COLUMNWISE_TRANSFORMERS)
+
+
+def _as_input(values, names):
+    # Transformers fitted on a DataFrame expect the same column names back
+    if all(isinstance(name, str) for name in names):
+        return pd.DataFrame(values, columns=names)
+    return values
+
+
+def _build_tables(transformer, names):
+    """Precompute the encoding of TABLE_VALUES for every column of a columnwise transformer"""
+    grid = np.repeat(TABLE_VALUES[:, None], len(names), axis=1)
+    encoded = np.asarray(transformer.transform(_as_input(grid, names)), dtype=np.float64)
+    if encoded.shape != grid.shape:
+        raise UnsupportedPipeline("Numerical transformer changes the number of columns")
+    return [dict(zip(TABLE_VALUES.tolist(), encoded[:, k].tolist())) for k in range(len(names))]
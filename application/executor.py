@@ -0,0 +1,139 @@
+"""
+Runs model inference in a pool of worker processes, so that CPU-heavy predictions do not hold the GIL of the
+threads serving web requests. Each child process imports the app once, loading its own copy of the model.
+"""
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.exceptions import ServiceUnavailable
+import multiprocessing
+import threading
+
+
+class InferenceUnavailable(ServiceUnavailable):
+    """Raised when the inference pool cannot take or finish a prediction in time. Rendered as a 503 response"""
+
+    def __init__(self, description):
+        super().__init__(description=description)
+        self.message = description
+
+
+def init_child():
+    """Load the model in a child process, before it receives any prediction"""
+    from application.inference import current_model, predict_rows, WARMUP_ROW
+
+    predict_rows([WARMUP_ROW], current_model())
+
+
+def predict_in_child(rows):
+    """Predict with the model of the child process
+
+    Returns:
+        tuple: Predictions, and the version of the model that made them
+    """
+    from application.inference import current_model, predict_rows
+
+    loaded = current_model()
+    return predict_rows(rows, loaded), loaded.version
+
+
+class ProcessInferenceExecutor:
+    """
+    Process pool with a bounded number of pending calls. Calls beyond max_pending are rejected straight away
+    instead of queueing up behind the others, and calls that take longer than timeout are abandoned. When a child
+    dies (e.g. killed for using too much memory), the pool is replaced by a new one on the next call.
+    """
+
+    def __init__(self, workers=2, max_pending=32, timeout=5.0, start_method="spawn", initializer=init_child):
+        """
+        Args:
+            workers (int, optional): Number of child processes. Defaults to 2.
+            max_pending (int, optional): Maximum number of calls queued or running at once. Defaults to 32.
+            timeout (float, optional): Seconds to wait for the result of a call, including time spent queued. Defaults to 5.0.
+            start_method (str, optional): How children are started. "spawn" is the safest, as the app runs threads that should not be forked. Defaults to "spawn".
+            initializer (Callable, optional): Run in each child when it starts. Defaults to init_child, which loads the model.
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.start_method = start_method
+        self.initializer = initializer
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pool = None
+
+        self.rejected = 0
+        self.timeouts = 0
+        self.broken = 0
+
+    @property
+    def pool(self):
+        # Created on first use, so that importing the app does not start processes
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context(self.start_method),
+                        initializer=self.initializer,
+                    )
+        return self._pool
+
+    def call(self, fn, *args):
+        """Run fn(*args) in a child process and wait for its result
+
+        Raises:
+            InferenceUnavailable: Too many calls are pending, the call timed out, or a child process died
+
+        Returns:
+            Any: Result of the call
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise InferenceUnavailable("Too many predictions are pending. Please try again later.")
+        pool = self.pool
+        try:
+            future = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._replace(pool)
+            raise InferenceUnavailable("The prediction workers stopped. Please try again.")
+        except Exception:
+            self._slots.release()
+            raise
+        # The slot is only freed once the child is done, so abandoned calls still count against the queue
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise InferenceUnavailable("Prediction timed out. Please try again later.")
+        except BrokenProcessPool:
+            self._replace(pool)
+            raise InferenceUnavailable("The prediction workers stopped. Please try again.")
+
+    def _replace(self, pool):
+        # A pool whose child died fails every call, so the next call starts a new one. Only the first of the calls
+        # that saw this pool break drops it
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+            self.broken += 1
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def predict(self, rows):
+        """Predict rows in a child process
+
+        Returns:
+            tuple: Predictions, and the version of the model that made them
+        """
+        return self.call(predict_in_child, rows)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
@@ -0,0 +1,73 @@
+"""
+Encoders for the history export, turning an iterator of history rows into chunks of NDJSON or CSV text.
+Each chunk is written as soon as its rows are encoded, so a whole history is never held in memory.
+"""
+from application.models import Entry
+import csv
+import datetime as dt
+import io
+import json
+
+# Content type and file extension of each export format
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+}
+
+# Keys of an exported entry, in the order of the history table
+FIELDS = ["entry_id" if column.name == "id" else column.name for column in Entry.__table__.columns]
+
+
+def export_record(row):
+    """Export a history row under the same keys as the history API, with dates in ISO 8601
+
+    Args:
+        row (Row): Row of the history table
+
+    Returns:
+        dict: Exported entry
+    """
+    record = {}
+    for key, value in row._mapping.items():
+        if isinstance(value, dt.datetime):
+            value = value.isoformat()
+        record["entry_id" if key == "id" else key] = value
+    return record
+
+
+def ndjson_chunks(rows, chunk_size=1000):
+    """Encode rows as newline-delimited json, one entry per line
+
+    Yields:
+        str: Lines of up to chunk_size entries
+    """
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(export_record(row)) + "\n")
+        if len(lines) >= chunk_size:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+
+def csv_chunks(rows, chunk_size=1000):
+    """Encode rows as csv, with a header row naming the columns
+
+    Yields:
+        str: Header, then lines of up to chunk_size entries
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(export_record(row))
+        count += 1
+        if count >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,198 @@
+from sklearn.compose import TransformedTargetRegressor
+from sklearn.ensemble import ExtraTreesRegressor, RandomForestRegressor
+from sklearn.pipeline import Pipeline
+import json
+import numpy as np
+import os
+
+# Inverse target transforms the FlatForest can apply itself, by name so that the forest can be saved to disk
+INVERSE_FUNCS = {"identity": None, "expm1": np.expm1, "exp": np.exp}
+
+# Arrays saved by FlatForest.save, one .npy file each, so that they can be memory-mapped when loaded
+ARRAYS = ("feature", "threshold", "children", "value", "is_leaf", "roots")
+
+# Rows are traversed in chunks, to bound the size of the (rows x trees) node index arrays
+CHUNK_SIZE = 1024
+
+
+class UnsupportedModel(Exception):
+    """Raised when a model cannot be compiled into a FlatForest"""
+
+
+class FlatForest:
+    """
+    Array-based evaluator for a fitted forest of regression trees.
+
+    The nodes of every tree are concatenated into contiguous arrays (feature, threshold, children, value).
+    Leaves point back to themselves, so a batch of rows is evaluated across all trees at once by moving every
+    (row, tree) pair one level down per step, until all of them have reached a leaf. This replaces sklearn's
+    loop over estimators, which dominates the latency of small batches.
+    """
+
+    def __init__(self, feature, threshold, children, value, is_leaf, roots, max_depth, n_features, inverse_func="identity"):
+        self.feature = feature
+        self.threshold = threshold
+        # Interleaved left and right children, so that a step down the tree is a single lookup of children[2 * node + go_right]
+        self.children = children
+        self.value = value
+        self.is_leaf = is_leaf
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.n_features = int(n_features)
+        self.inverse_func = inverse_func
+        self._inverse = INVERSE_FUNCS[inverse_func]
+
+    @classmethod
+    def from_model(cls, model):
+        """Flatten the forest at the end of a model
+
+        Args:
+            model: Pipeline ending in a forest, a TransformedTargetRegressor wrapping a forest, or a forest
+
+        Raises:
+            UnsupportedModel: The model is not a single-output forest of regression trees, or its target transform is unknown
+
+        Returns:
+            FlatForest: Evaluator producing the same predictions as the final estimator of the model
+        """
+        if isinstance(model, Pipeline):
+            model = model[-1]
+        inverse_func = "identity"
+        if isinstance(model, TransformedTargetRegressor):
+            inverse_func = _inverse_name(model)
+            model = model.regressor_
+        if not isinstance(model, (RandomForestRegressor, ExtraTreesRegressor)):
+            raise UnsupportedModel(f"Cannot compile {type(model).__name__}")
+        if model.n_outputs_ != 1:
+            raise UnsupportedModel("Only single-output forests are supported")
+
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            leaf = tree.children_left == -1
+            roots.append(offset)
+            features.append(np.where(leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            # Leaves loop back to themselves, so rows that reach a leaf early stay there
+            lefts.append(np.where(leaf, nodes, tree.children_left) + offset)
+            rights.append(np.where(leaf, nodes, tree.children_right) + offset)
+            values.append(tree.value[:, 0, 0])
+            max_depth = max(max_depth, tree.max_depth)
+            offset += tree.node_count
+
+        feature = np.concatenate(features).astype(np.intp)
+        left = np.concatenate(lefts).astype(np.intp)
+        right = np.concatenate(rights).astype(np.intp)
+        return cls(
+            feature=feature,
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            children=np.stack([left, right], axis=1).ravel(),
+            value=np.concatenate(values).astype(np.float64),
+            is_leaf=left == np.arange(offset, dtype=np.intp),
+            roots=np.array(roots, dtype=np.intp),
+            max_depth=max_depth,
+            n_features=model.n_features_in_,
+            inverse_func=inverse_func,
+        )
+
+    def save(self, directory):
+        """Save the forest as one .npy file per array, plus its metadata, so that it can be memory-mapped by FlatForest.load"""
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, "forest.json"), "w") as f:
+            json.dump(
+                {
+                    "max_depth": self.max_depth,
+                    "n_features": self.n_features,
+                    "inverse_func": self.inverse_func,
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        """Load a forest saved by FlatForest.save
+
+        Args:
+            directory (str): Directory the forest was saved to
+            mmap_mode (str, optional): Memory-map the arrays instead of reading them into memory, so that processes loading the same forest share its pages. Defaults to "r" (read-only). None reads the arrays into memory.
+
+        Returns:
+            FlatForest: Loaded forest
+        """
+        with open(os.path.join(directory, "forest.json")) as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in ARRAYS
+        }
+        return cls(**arrays, **meta)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def apply(self, X):
+        """Index of the leaf each row ends up in, for every tree
+
+        Args:
+            X (np.ndarray): Array of shape (n_rows, n_features)
+
+        Returns:
+            np.ndarray: Array of shape (n_rows, n_trees)
+        """
+        # sklearn compares float32 inputs against float64 thresholds
+        X = np.ascontiguousarray(X, dtype=np.float32).ravel()
+        n_rows = len(X) // self.n_features
+        # One entry per (tree, row) pair, tree-major so that neighbouring entries walk the same tree
+        nodes = np.repeat(self.roots, n_rows)
+        row_offsets = np.tile(np.arange(n_rows, dtype=np.intp) * self.n_features, self.n_trees)
+        active = np.flatnonzero(~self.is_leaf[nodes])
+        while active.size:
+            current = nodes[active]
+            go_right = X[row_offsets[active] + self.feature[current]] > self.threshold[current]
+            current = self.children[2 * current + go_right]
+            nodes[active] = current
+            # Pairs that reached a leaf are done, so each level only works on the paths still descending
+            active = active[~self.is_leaf[current]]
+        return nodes.reshape(self.n_trees, n_rows).T
+
+    def predict(self, X):
+        """Predict a batch of rows
+
+        Args:
+            X (np.ndarray): Array of shape (n_rows, n_features), as produced by the preprocessing steps of the model
+
+        Returns:
+            np.ndarray: Predictions of shape (n_rows,), with the inverse target transform applied
+        """
+        if hasattr(X, "toarray"):  # Sparse output of a ColumnTransformer
+            X = X.toarray()
+        X = np.asarray(X)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, got array of shape {X.shape}")
+        predictions = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), CHUNK_SIZE):
+            leaves = self.value[self.apply(X[start : start + CHUNK_SIZE]).T]
+            # Accumulate tree by tree, in the same order as sklearn, so that the sums round the same way
+            total = np.zeros(leaves.shape[1], dtype=np.float64)
+            for tree_values in leaves:
+                total += tree_values
+            predictions[start : start + CHUNK_SIZE] = total / self.n_trees
+        if self._inverse is not None:
+            predictions = self._inverse(predictions)
+        return predictions
+
+
+def _inverse_name(regressor):
+    """Name of the inverse target transform of a TransformedTargetRegressor"""
+    if regressor.transformer is not None:
+        raise UnsupportedModel("Only func/inverse_func target transforms are supported")
+    for name, func in INVERSE_FUNCS.items():
+        if regressor.inverse_func is func:
+            return name
+    raise UnsupportedModel(f"Unknown inverse target transform {regressor.inverse_func!r}")
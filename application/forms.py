@@ -1,18 +1,17 @@
 from flask_wtf import FlaskForm
 from application import NEIGHBORHOODS, ROOM_TYPES
+from application.schema import LISTING_SCHEMA
 from wtforms import BooleanField, SelectField, SubmitField, PasswordField, FloatField, IntegerField
 
 from wtforms.fields.html5 import URLField, EmailField
 from wtforms.validators import (
     Length,
     InputRequired,
-    NumberRange,
     Optional,
     URL,
     Email,
     Regexp,
-    EqualTo,
-    ValidationError
+    EqualTo
 )
 
 password_validator = Regexp(
@@ -23,19 +22,19 @@ password_validator = Regexp(
 
 class Prediction(FlaskForm):
     beds = IntegerField(
-        "Number of Beds", validators=[InputRequired(), NumberRange(min=0)]
+        "Number of Beds", validators=[InputRequired()]
     )
 
     bathrooms = FloatField(
-        "Number of Bathrooms", validators=[InputRequired(), NumberRange(min=0)]
+        "Number of Bathrooms", validators=[InputRequired()]
     )
 
     accomodates = IntegerField(
-        "Accomodates", validators=[InputRequired(), NumberRange(min=0)]
+        "Accomodates", validators=[InputRequired()]
     )
 
     minimum_nights = IntegerField(
-        "Minimum Nights", validators=[InputRequired(), NumberRange(min=0)]
+        "Minimum Nights", validators=[InputRequired()]
     )
 
     room_type = SelectField(
@@ -56,16 +55,25 @@ class Prediction(FlaskForm):
     pool = BooleanField("Pool?", default=False)
 
     actual_price = FloatField(
-        "Actual Listing Price in SGD (Optional)", validators=[Optional(), NumberRange(min=0)]
+        "Actual Listing Price in SGD (Optional)", validators=[Optional()]
     )
 
     link = URLField("Link to Listing (Optional)", validators=[Optional(), URL()])
 
     submit = SubmitField("Submit")
 
-    def validate_accomodates(form, field):
-        if field.data < form.beds.data:
-            raise ValidationError("Accomodates should be greater than or equal to the number of beds")
+    def validate(self, extra_validators=None):
+        """Parse the form, then check the listing against LISTING_SCHEMA. The validated listing is kept in self.listing"""
+        self.listing = None
+        if not super().validate(extra_validators):
+            return False
+        listing, errors = LISTING_SCHEMA.validate({key: self[key].data for key in LISTING_SCHEMA.fields})
+        for key, message in errors.items():
+            self[key].errors.append(message)
+        if errors:
+            return False
+        self.listing = listing
+        return True
 
 class Login(FlaskForm):
     email = EmailField("Email address", validators=[InputRequired(), Email()])
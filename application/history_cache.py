@@ -0,0 +1,143 @@
+"""
+Per-user versions of the history, and the cache of rendered history pages built on them.
+
+Every write to a user's history (add_entry, add_entries, delete_entry, and rebuild_user_stats for the summaries)
+bumps the user's generation in the history_versions table, in the same transaction as the write, so every worker
+process sees it. Rendered fragments of history.html are cached under the generation they were rendered at, so a
+write makes every cached page of its user unreachable at once, while the pages of other users stay cached. The
+unreachable pages are evicted as the least recently used.
+
+The generation makes the ETag of the history page and API, along with a digest of the view of the history that was
+requested (page or cursor, sort order and page size), so a client that already has the current version of a page gets
+a 304 after a single primary key lookup, without the rows being read or serialized, and a copy of one view never
+validates another. The request is checked before the version, so an invalid one is refused even with a matching ETag. The time of the last
+write is sent as the Last-Modified, but If-Modified-Since is not answered with a 304: HTTP dates have a precision of
+one second, so a write made in the same second as the client's copy would go unnoticed.
+"""
+from application import app, db
+from application.cache import LRUCache, MISSING
+from application.metrics import metrics
+from flask import request
+from sqlalchemy import select
+import datetime as dt
+import hashlib
+from sqlalchemy.dialects.sqlite import insert
+
+history_versions = db.Table(
+    "history_versions",
+    db.Column("user_id", db.Integer, db.ForeignKey("users.id"), primary_key=True),
+    db.Column("generation", db.Integer, nullable=False),
+    db.Column("updated", db.DateTime, nullable=True),  # UTC time of the last write
+)
+
+# Built once, like the upserts of application/stats.py
+_BUMP = insert(history_versions).values(generation=1)
+_BUMP = _BUMP.on_conflict_do_update(
+    index_elements=["user_id"],
+    set_={"generation": history_versions.c.generation + 1, "updated": _BUMP.excluded.updated},
+)
+
+
+def bump_history_versions(user_ids):
+    """Move users to a new generation, in the current transaction. Called by every function writing to the history,
+    before it commits
+
+    Args:
+        user_ids (Iterable[int]): Ids of the users whose history changed
+    """
+    updated = dt.datetime.utcnow()
+    params = [{"user_id": user_id, "updated": updated} for user_id in sorted(set(user_ids))]
+    if params:
+        db.session.execute(_BUMP, params)
+
+
+def history_version(user_id):
+    """Current generation of a user's history, and the time it was written at
+
+    Args:
+        user_id (int): Id of the user
+
+    Returns:
+        tuple: Generation, 0 if the history was never written to, and UTC time of the last write, or None
+    """
+    row = db.session.execute(
+        select(history_versions.c.generation, history_versions.c.updated).where(history_versions.c.user_id == user_id)
+    ).first()
+    return (0, None) if row is None else (row.generation, row.updated)
+
+
+def not_modified(user_id, version, view):
+    """Whether the client sending the current request already has this view of this version of the user's history,
+    from the If-None-Match header
+
+    Args:
+        user_id (int): Id of the user
+        version (tuple): Generation and time of the last write, as returned by history_version
+        view (tuple): Normalized parameters of the request, e.g. (page, cursor, per_page, col_sort, desc)
+
+    Returns:
+        bool: True if the request can be answered with a 304
+    """
+    return bool(request.if_none_match) and request.if_none_match.contains_weak(_etag(user_id, version, view))
+
+
+def add_validators(response, user_id, version, view):
+    """Set the ETag and Last-Modified of a response showing this view of this version of the user's history. Clients
+    and proxies may keep the response, but only for this user, and must check that it is current before using it
+
+    Returns:
+        Response: The response
+    """
+    response.set_etag(_etag(user_id, version, view), weak=True)
+    last_modified = _last_modified(version)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def _etag(user_id, version, view):
+    digest = hashlib.blake2b(repr(view).encode(), digest_size=8).hexdigest()
+    return f"{user_id}-{version[0]}-{digest}"
+
+
+def _last_modified(version):
+    # HTTP dates have a precision of one second
+    updated = version[1]
+    return None if updated is None else updated.replace(microsecond=0, tzinfo=dt.timezone.utc)
+
+
+# Rendered fragments of history.html, keyed by (user_id, generation, page, cursor, per_page, col_sort, desc)
+fragment_cache = LRUCache(maxsize=app.config.get("HISTORY_FRAGMENT_CACHE_SIZE", 1024))
+
+
+def cached_fragment(key, render):
+    """Look up a rendered fragment, rendering and caching it if missing
+
+    Args:
+        key (tuple): Key of the fragment, starting with the user id and generation it was rendered at
+        render (Callable): Renders the fragment
+
+    Returns:
+        str: Rendered fragment
+    """
+    fragment = fragment_cache.get(key)
+    if fragment is MISSING:
+        fragment = render()
+        fragment_cache.set(key, fragment)
+    return fragment
+
+
+def collect_history_cache_metrics():
+    """Counters of the history fragment cache, exported by /metrics"""
+    cache = fragment_cache.stats()
+    return [
+        ("rentier_history_cache_hits_total", "counter", "History pages served from the fragment cache", {}, cache["hits"]),
+        ("rentier_history_cache_misses_total", "counter", "History pages rendered", {}, cache["misses"]),
+        ("rentier_history_cache_evictions_total", "counter", "History fragments evicted from the full cache", {}, cache["evictions"]),
+        ("rentier_history_cache_size", "gauge", "History fragments currently cached", {}, cache["size"]),
+    ]
+
+
+metrics.register_collector(collect_history_cache_metrics)
@@ -0,0 +1,212 @@
+"""
+Write-behind queue for the history entries recorded by /predict.
+
+With HISTORY_WRITE_MODE = "async", the page renders as soon as the prediction is known, and the entry is queued
+instead of committed. A single writer thread drains the queue, committing everything queued so far in one
+transaction, so concurrent requests no longer contend for SQLite's write lock one commit at a time. Entries still
+in the queue are committed when the process exits. They can be lost if the process is killed, which is the price
+of "async"; "sync" (the default) commits before responding, as before.
+"""
+from application import app
+from application.metrics import metrics
+from application.models import Entry, add_entries, add_entry
+from collections import Counter
+import atexit
+import queue
+import threading
+import time
+
+BATCH_SIZE_METRIC = "rentier_history_commit_batch_size"
+
+
+class HistoryWriter:
+    """
+    Bounded queue of history rows, committed in batches by a single writer thread.
+    When the queue is full, rows are committed by the caller instead, so that entries are never dropped.
+    A batch that fails to commit (e.g. while another process holds the write lock) is retried with a growing delay,
+    then committed one row at a time, so that only the rows the database keeps rejecting are lost.
+    """
+
+    def __init__(self, write_fn, max_queue=10000, max_batch=500, retries=3, retry_delay=0.05):
+        """
+        Args:
+            write_fn (Callable): Function committing a list of rows in one transaction
+            max_queue (int, optional): Maximum number of rows waiting to be committed. Defaults to 10000.
+            max_batch (int, optional): Maximum number of rows committed per transaction. Defaults to 500.
+            retries (int, optional): Number of times a failed batch is retried. Defaults to 3.
+            retry_delay (float, optional): Seconds to wait before the first retry, doubled before each of the others. Defaults to 0.05.
+        """
+        self.write_fn = write_fn
+        self.max_batch = max(1, int(max_batch))
+        self.retries = max(0, int(retries))
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.batch_sizes = Counter()
+        self.written = 0
+        self.batches = 0
+        self.overflows = 0
+        self.retries_made = 0
+        self.failures = 0
+        self.dropped = 0
+        self.last_error = None
+
+    def submit(self, row):
+        """Queue a row to be committed by the writer thread, or commit it right away if the queue is full"""
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self.overflows += 1
+            self._write([row])
+
+    def flush(self, timeout=None):
+        """Wait until every queued row has been committed
+
+        Args:
+            timeout (float, optional): Maximum number of seconds to wait. Defaults to None (no limit).
+
+        Returns:
+            bool: Whether the queue was drained in time
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stats(self):
+        """Snapshot of the queue depth and commit counters"""
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "written": self.written,
+                "batches": self.batches,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+                "overflows": self.overflows,
+                "retries": self.retries_made,
+                "failures": self.failures,
+                "dropped": self.dropped,
+                "last_error": self.last_error,
+            }
+
+    def _ensure_worker(self):
+        # Started lazily, so that forking servers start the thread in each worker rather than the parent
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, rows, retries=None):
+        error = self._commit(rows, self.retries if retries is None else retries)
+        if error is None:
+            with self._lock:
+                self.written += len(rows)
+                self.batches += 1
+                self.batch_sizes[len(rows)] += 1
+            metrics.observe(BATCH_SIZE_METRIC, len(rows))
+            return
+        if len(rows) > 1:
+            # A row the database rejects should not take the rest of its batch with it
+            app.logger.warning(f"Failed to commit {len(rows)} history entries, committing them one at a time: {error!r}")
+            for row in rows:
+                self._write([row], retries=0)
+            return
+        with self._lock:
+            self.dropped += 1
+        app.logger.error(f"Failed to commit a history entry, which is lost: {error!r}")
+
+    def _commit(self, rows, retries):
+        """Commit rows, retrying with a growing delay. Returns the last error, or None once they are committed"""
+        delay = self.retry_delay
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+                with self._lock:
+                    self.retries_made += 1
+            try:
+                with app.app_context():
+                    self.write_fn(rows)
+                return None
+            except Exception as error:  # Keep the writer alive, the error is reported in the metrics and logs
+                last_error = error
+        with self._lock:
+            self.failures += 1
+            self.last_error = repr(last_error)
+        return last_error
+
+
+def write_rows(rows):
+    add_entries(rows, return_ids=False)
+
+
+history_writer = HistoryWriter(
+    write_rows,
+    max_queue=app.config.get("HISTORY_WRITE_QUEUE_SIZE", 10000),
+    max_batch=app.config.get("HISTORY_WRITE_BATCH_SIZE", 500),
+    retries=app.config.get("HISTORY_WRITE_RETRIES", 3),
+    retry_delay=app.config.get("HISTORY_WRITE_RETRY_DELAY", 0.05),
+)
+
+
+@atexit.register
+def flush_on_exit():
+    history_writer.flush(timeout=app.config.get("HISTORY_WRITE_FLUSH_TIMEOUT", 10))
+
+
+def record_entry(entry):
+    """Save a new history entry, committing it right away or queueing it depending on HISTORY_WRITE_MODE
+
+    Args:
+        entry (Entry): Validated entry
+
+    Returns:
+        int: Id of the entry, or None if it was queued
+    """
+    if app.config.get("HISTORY_WRITE_MODE", "sync") != "async":
+        return add_entry(entry)
+    history_writer.submit(
+        {column.name: getattr(entry, column.name) for column in Entry.__table__.columns if column.name != "id"}
+    )
+    return None
+
+
+def collect_history_writer_metrics():
+    """Queue depth and commit counters of the history writer, exported by /metrics"""
+    stats = history_writer.stats()
+    return [
+        ("rentier_history_write_queue_depth", "gauge", "History entries waiting to be committed", {}, stats["queued"]),
+        ("rentier_history_written_total", "counter", "History entries committed by the writer", {}, stats["written"]),
+        ("rentier_history_write_batches_total", "counter", "Transactions committed by the writer", {}, stats["batches"]),
+        ("rentier_history_write_overflows_total", "counter", "History entries committed by the request because the queue was full", {}, stats["overflows"]),
+        ("rentier_history_write_retries_total", "counter", "Commits of history entries retried after a failure", {}, stats["retries"]),
+        ("rentier_history_write_failures_total", "counter", "Batches of history entries that failed to commit after every retry", {}, stats["failures"]),
+        ("rentier_history_write_dropped_total", "counter", "History entries lost because they could not be committed", {}, stats["dropped"]),
+    ]
+
+
+metrics.describe(BATCH_SIZE_METRIC, "Number of history entries committed per transaction by the writer")
+metrics.register_collector(collect_history_writer_metrics)
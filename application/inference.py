@@ -0,0 +1,326 @@
+from application import app, ai_model, model_version, NEIGHBORHOODS, ROOM_TYPES
+from application.batching import MicroBatcher
+from application.cache import LRUCache, MISSING
+from application.encoder import FeatureEncoder, UnsupportedPipeline
+from application.executor import InferenceUnavailable, ProcessInferenceExecutor
+from application.forest import FlatForest, UnsupportedModel
+from application.metrics import metrics
+from application.model_store import MappedModel, load_model
+from application.registry import LoadedModel, ModelRegistry
+from application.schema import LISTING_SCHEMA
+from concurrent.futures import TimeoutError
+from sklearn.pipeline import Pipeline
+import pandas as pd
+
+# Maps the field names used by the forms and APIs to the column names the model was trained on.
+# The order matters, as the model expects its columns in the same order as during training.
+FEATURE_COLUMNS = {
+    "beds": "beds",
+    "bathrooms": "bathrooms_cleaned",
+    "accomodates": "accommodates",
+    "minimum_nights": "minimum_nights",
+    "room_type": "room_type",
+    "neighborhood": "neighbourhood_cleansed",
+    "wifi": "wifi",
+    "elevator": "elevator",
+    "pool": "pool",
+}
+
+
+def parse_prediction_input(data):
+    """Parse and validate the features of a single listing sent to a prediction API, against LISTING_SCHEMA.
+
+    Args:
+        data (dict): Listing, as decoded from the json body of the request
+
+    Raises:
+        SchemaError: A field is missing, out of range or of the wrong type
+
+    Returns:
+        dict: Validated features of the listing, along with its actual price (if any)
+    """
+    return LISTING_SCHEMA.check(data)
+
+
+def make_model_input(rows):
+    """Build the DataFrame the model expects from a list of listings
+
+    Args:
+        rows (list[dict]): Validated listings, keyed by the field names in FEATURE_COLUMNS
+
+    Returns:
+        pd.DataFrame: One row per listing, with the columns the model was trained on
+    """
+    return pd.DataFrame(
+        {column: [row[field] for row in rows] for field, column in FEATURE_COLUMNS.items()}
+    )
+
+
+def compile_encoder(model):
+    """Derive a FeatureEncoder from the preprocessing steps of the model, so that requests skip building a DataFrame
+
+    Args:
+        model (Pipeline): Loaded model
+
+    Returns:
+        FeatureEncoder: Compiled encoder, or None if it is disabled or the pipeline cannot be compiled
+    """
+    if not app.config.get("FEATURE_ENCODER_ENABLED", True) or not isinstance(
+        model, (Pipeline, MappedModel)
+    ):
+        return None
+    try:
+        return FeatureEncoder.from_pipeline(model[:-1], FEATURE_COLUMNS)
+    except UnsupportedPipeline as error:
+        app.logger.warning(f"Falling back to DataFrame model inputs: {error}")
+        return None
+
+
+def compile_forest(model):
+    """Flatten the forest of the model into a FlatForest, when INFERENCE_ENGINE is "flat"
+
+    Args:
+        model (Pipeline): Loaded model
+
+    Returns:
+        FlatForest: Compiled forest, or None if it is disabled or the model is not a supported forest
+    """
+    if isinstance(model, MappedModel):  # Already flattened, and there is no sklearn forest to fall back on
+        return model.forest
+    if app.config.get("INFERENCE_ENGINE", "flat") != "flat":
+        return None
+    try:
+        return FlatForest.from_model(model)
+    except UnsupportedModel as error:
+        app.logger.warning(f"Falling back to sklearn inference: {error}")
+        return None
+
+
+# Predicted once by every newly loaded model, before it starts serving requests
+WARMUP_ROW = {
+    "beds": 1,
+    "bathrooms": 1.0,
+    "accomodates": 2,
+    "minimum_nights": 1,
+    "room_type": sorted(ROOM_TYPES)[0],
+    "neighborhood": NEIGHBORHOODS[0],
+    "wifi": True,
+    "elevator": False,
+    "pool": False,
+}
+
+
+def prepare_model(version, model):
+    """Compile everything needed to serve a model, and warm it with a first prediction
+
+    Args:
+        version (str): Version of the model
+        model (Pipeline | MappedModel): Loaded model
+
+    Returns:
+        LoadedModel: Model ready to be swapped in
+    """
+    loaded = LoadedModel(version, model, compile_encoder(model), compile_forest(model))
+    predict_rows([WARMUP_ROW], loaded)
+    return loaded
+
+
+def load_version(version, path):
+    """Load a version of the model from the registry, in the background"""
+    return prepare_model(version, load_model(path, mmap=app.config.get("MODEL_MMAP", False)))
+
+
+def predict_rows(rows, loaded=None):
+    """Predict the price of many listings with a single call to the model. Batches of up to FLAT_FOREST_MAX_ROWS listings are evaluated by the FlatForest, which has less overhead per call; larger batches go to sklearn.
+
+    Args:
+        rows (list[dict]): Validated listings, keyed by the field names in FEATURE_COLUMNS
+        loaded (LoadedModel, optional): Model to predict with. Defaults to the model currently being served.
+
+    Returns:
+        list[float]: Predicted price of each listing, in the same order as the rows
+    """
+    if len(rows) == 0:
+        return []
+    if loaded is None:
+        loaded = current_model()
+    model, encoder, forest = loaded.model, loaded.encoder, loaded.forest
+    if encoder is None and forest is None:
+        with metrics.stage("inference.pipeline"):
+            return [float(price) for price in model.predict(make_model_input(rows))]
+    with metrics.stage("inference.encode"):
+        if encoder is not None:
+            X = encoder.transform(rows)
+        else:
+            X = model[:-1].transform(make_model_input(rows))
+    with metrics.stage("inference.model"):
+        if forest is not None and len(rows) <= app.config.get("FLAT_FOREST_MAX_ROWS", 256):
+            predictions = forest.predict(X)
+        else:
+            predictions = model[-1].predict(X)
+    return [float(price) for price in predictions]
+
+
+# Serves the model loaded at startup, and swaps in new versions published to MODEL_REGISTRY_DIR
+registry = ModelRegistry(
+    prepare_model(model_version, ai_model),
+    directory=app.config.get("MODEL_REGISTRY_DIR"),
+    load=load_version,
+    poll_interval=app.config.get("MODEL_REGISTRY_POLL_SECONDS", 30),
+)
+
+
+def current_model():
+    """The model currently being served. Callers should hold on to the returned LoadedModel for the whole request, as it may be swapped out at any time"""
+    registry.ensure_watching()
+    return registry.current
+
+
+# Runs predictions in child processes when INFERENCE_EXECUTOR is "process". The pool is only started on first use
+process_executor = ProcessInferenceExecutor(
+    workers=app.config.get("INFERENCE_PROCESS_WORKERS", 2),
+    max_pending=app.config.get("INFERENCE_PROCESS_MAX_PENDING", 32),
+    timeout=app.config.get("INFERENCE_PROCESS_TIMEOUT", 5.0),
+)
+
+
+def predict_versioned(rows, loaded):
+    """Predict many listings, in this thread or in the inference process pool depending on INFERENCE_EXECUTOR
+
+    Args:
+        rows (list[dict]): Validated listings, keyed by the field names in FEATURE_COLUMNS
+        loaded (LoadedModel): Model to predict with, when predicting in this thread
+
+    Raises:
+        InferenceUnavailable: The process pool is full, or the prediction timed out
+
+    Returns:
+        tuple: Predicted price of each listing, and the version of the model that predicted them.
+        Child processes watch the registry on their own, so their version may briefly differ from loaded.version
+    """
+    if len(rows) == 0:
+        return [], loaded.version
+    if app.config.get("INFERENCE_EXECUTOR", "thread") == "process":
+        return process_executor.predict(rows)
+    return predict_rows(rows, loaded), loaded.version
+
+
+def predict_current(rows):
+    """Predict with the current model, returning (prediction, version) pairs so that callers know which version answered"""
+    predictions, version = predict_versioned(rows, current_model())
+    return [(prediction, version) for prediction in predictions]
+
+
+# Coalesces single predictions from concurrent requests, if enabled in the config
+batcher = MicroBatcher(
+    predict_current,
+    max_batch_size=app.config.get("MICROBATCH_MAX_SIZE", 64),
+    max_wait_ms=app.config.get("MICROBATCH_WINDOW_MS", 2.0),
+)
+
+# Most requests are for the same few listing shapes, so recent predictions are kept around.
+# Entries are tied to the model that computed them, and are dropped as soon as the model changes.
+prediction_cache = LRUCache(
+    maxsize=app.config.get("PREDICTION_CACHE_SIZE", 4096),
+    ttl=app.config.get("PREDICTION_CACHE_TTL", 3600),
+)
+
+
+def cache_key(row):
+    """Canonical form of a listing's features, so that equivalent inputs (e.g. 1 and 1.0 beds) share a cache entry
+
+    Args:
+        row (dict): Validated listing, keyed by the field names in FEATURE_COLUMNS
+
+    Returns:
+        tuple: Hashable feature vector
+    """
+    return (
+        float(row["beds"]),
+        float(row["bathrooms"]),
+        float(row["accomodates"]),
+        float(row["minimum_nights"]),
+        row["room_type"],
+        row["neighborhood"],
+        bool(row["wifi"]),
+        bool(row["elevator"]),
+        bool(row["pool"]),
+    )
+
+
+def predict_one(row):
+    """Predict the price of a single listing. Cached predictions are returned straight away. Otherwise, the listing goes through the micro-batcher when MICROBATCH_ENABLED is set, so that concurrent requests share one call to the model.
+
+    Args:
+        row (dict): Validated listing, keyed by the field names in FEATURE_COLUMNS
+
+    Raises:
+        InferenceUnavailable: The micro-batcher did not predict the listing within MICROBATCH_TIMEOUT seconds
+
+    Returns:
+        tuple: Predicted price of the listing, and the version of the model that predicted it
+    """
+    loaded = current_model()
+    key = cache_key(row)
+    prediction = prediction_cache.get(key, generation=loaded)
+    if prediction is not MISSING:
+        return prediction, loaded.version
+    if app.config.get("MICROBATCH_ENABLED", False):
+        try:
+            prediction, version = batcher.predict(row, timeout=app.config.get("MICROBATCH_TIMEOUT", 5.0))
+        except TimeoutError:
+            raise InferenceUnavailable("Prediction timed out. Please try again later.")
+    else:
+        predictions, version = predict_versioned([row], loaded)
+        prediction = predictions[0]
+    if version == loaded.version:  # Never cache a prediction under a model that did not make it
+        prediction_cache.set(key, prediction, generation=loaded)
+    return prediction, version
+
+
+def predict_many(rows):
+    """Predict the price of many listings. Listings that are not cached are predicted with a single call to the model.
+
+    Args:
+        rows (list[dict]): Validated listings, keyed by the field names in FEATURE_COLUMNS
+
+    Returns:
+        tuple: Predicted price of each listing (in the same order as the rows), and the version of the model that predicted them
+    """
+    loaded = current_model()
+    keys = [cache_key(row) for row in rows]
+    predictions = [prediction_cache.get(key, generation=loaded) for key in keys]
+    missing = [idx for idx, prediction in enumerate(predictions) if prediction is MISSING]
+    computed, version = predict_versioned([rows[idx] for idx in missing], loaded)
+    for idx, prediction in zip(missing, computed):
+        predictions[idx] = prediction
+        if version == loaded.version:
+            prediction_cache.set(keys[idx], prediction, generation=loaded)
+    return predictions, version
+
+
+def collect_inference_metrics():
+    """Counters of the prediction cache, micro-batcher, process pool and model registry, exported by /metrics"""
+    cache = prediction_cache.stats()
+    batches = batcher.stats()
+    return [
+        ("rentier_prediction_cache_hits_total", "counter", "Predictions served from the cache", {}, cache["hits"]),
+        ("rentier_prediction_cache_misses_total", "counter", "Predictions not found in the cache", {}, cache["misses"]),
+        ("rentier_prediction_cache_evictions_total", "counter", "Predictions evicted from the full cache", {}, cache["evictions"]),
+        ("rentier_prediction_cache_size", "gauge", "Predictions currently cached", {}, cache["size"]),
+        ("rentier_microbatch_requests_total", "counter", "Predictions submitted to the micro-batcher", {}, batches["requests"]),
+        ("rentier_microbatch_batches_total", "counter", "Batches predicted by the micro-batcher", {}, batches["batches"]),
+        ("rentier_microbatch_queue_delay_seconds_total", "counter", "Time predictions spent waiting for their batch", {}, batches["queue_delay_total"]),
+        ("rentier_microbatch_queue_delay_seconds_max", "gauge", "Longest time a prediction waited for its batch", {}, batches["queue_delay_max"]),
+        ("rentier_microbatch_batch_size", "histogram", "Rows per batch predicted by the micro-batcher", {}, batcher.batch_size_histogram()),
+        ("rentier_microbatch_timeouts_total", "counter", "Predictions abandoned after timing out in the micro-batcher", {}, batches["timeouts"]),
+        ("rentier_inference_rejected_total", "counter", "Predictions rejected because the inference pool was full", {}, process_executor.rejected),
+        ("rentier_inference_timeouts_total", "counter", "Predictions abandoned after timing out in the inference pool", {}, process_executor.timeouts),
+        ("rentier_inference_pool_restarts_total", "counter", "Inference pools replaced after a child process died", {}, process_executor.broken),
+        ("rentier_model_swaps_total", "counter", "Model versions swapped in from the registry", {}, registry.swaps),
+        ("rentier_model_load_failures_total", "counter", "Model versions that failed to load from the registry", {}, registry.failures),
+        ("rentier_model_info", "gauge", "Version of the model being served", {"version": registry.current.version}, 1),
+    ]
+
+
+metrics.register_collector(collect_inference_metrics)
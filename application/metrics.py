@@ -0,0 +1,190 @@
+"""
+In-process latency metrics, served in the Prometheus text format from /metrics.
+
+Timings are aggregated into summaries: a running count and sum, plus quantiles computed over a sliding window of
+the most recent samples. Recording a sample is an append under a lock, so the timers can stay on in production.
+Each worker process keeps its own metrics, which Prometheus aggregates when it scrapes every worker.
+"""
+from application import app
+from collections import deque
+import threading
+import time
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Time spent in each stage of a request, labelled by stage
+STAGE_METRIC = "rentier_stage_duration_seconds"
+# Time spent in each request, labelled by endpoint and method
+REQUEST_METRIC = "rentier_request_duration_seconds"
+
+HELP = {
+    STAGE_METRIC: "Time spent in each stage of a request",
+    REQUEST_METRIC: "Time spent handling a request, from the first before_request hook to the response",
+}
+
+
+class Summary:
+    """Count, sum and recent samples of an observed value"""
+
+    def __init__(self, window=1024):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        with self._lock:
+            self._samples.append(value)
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        """Count, sum and quantiles of the window of recent samples
+
+        Returns:
+            dict: {"count", "sum", "quantiles": {quantile: value}}. Quantiles are None until a sample has been observed
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total = self.count, self.sum
+        quantiles = {
+            q: samples[min(len(samples) - 1, int(q * len(samples)))] if samples else None
+            for q in QUANTILES
+        }
+        return {"count": count, "sum": total, "quantiles": quantiles}
+
+
+class Timer:
+    """Context manager observing the time spent in its block"""
+
+    __slots__ = ("summary", "start")
+
+    def __init__(self, summary):
+        self.summary = summary
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.summary is not None:
+            self.summary.observe(time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry:
+    """
+    Holds the summaries of the app, keyed by metric name and labels, and the collectors that export the counters
+    of other components (cache, micro-batcher, ...) when the metrics are scraped.
+    """
+
+    def __init__(self, enabled=True, window=1024):
+        """
+        Args:
+            enabled (bool, optional): Record timings. When disabled, timers do nothing. Defaults to True.
+            window (int, optional): Number of recent samples quantiles are computed over, per summary. Defaults to 1024.
+        """
+        self.enabled = enabled
+        self.window = window
+        self._lock = threading.Lock()
+        self._summaries = {}
+        self._collectors = []
+        self._help = dict(HELP)
+
+    def summary(self, name, **labels):
+        """Summary for a metric name and set of labels, created on first use"""
+        key = (name, tuple(sorted(labels.items())))
+        summary = self._summaries.get(key)
+        if summary is None:
+            with self._lock:
+                summary = self._summaries.setdefault(key, Summary(self.window))
+        return summary
+
+    def describe(self, name, help):
+        """Set the help text of a metric, shown in /metrics"""
+        self._help[name] = help
+
+    def observe(self, name, value, **labels):
+        if self.enabled:
+            self.summary(name, **labels).observe(value)
+
+    def time(self, name, **labels):
+        """Time a block of code
+
+        Example:
+            with metrics.time(REQUEST_METRIC, endpoint="index", method="GET"):
+                ...
+        """
+        return Timer(self.summary(name, **labels) if self.enabled else None)
+
+    def stage(self, stage):
+        """Time a stage of a request, under STAGE_METRIC"""
+        return self.time(STAGE_METRIC, stage=stage)
+
+    def register_collector(self, collector):
+        """Export values computed at scrape time
+
+        Args:
+            collector (Callable): Function returning a list of (name, type, help, labels, value), where type is "counter",
+                "gauge" or "histogram". The value of a histogram is a dict of cumulative "buckets", as (upper bound,
+                count) pairs ending with infinity, and the "sum" and "count" of the observations
+        """
+        self._collectors.append(collector)
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format
+
+        Returns:
+            str: Metrics, one family at a time
+        """
+        lines = []
+        with self._lock:
+            summaries = sorted(self._summaries.items())
+        last_name = None
+        for (name, labels), summary in summaries:
+            if name != last_name:
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} summary")
+                last_name = name
+            snapshot = summary.snapshot()
+            for q, value in snapshot["quantiles"].items():
+                if value is not None:
+                    lines.append(f"{name}{_labels(labels + (('quantile', q),))} {value!r}")
+            lines.append(f"{name}_sum{_labels(labels)} {snapshot['sum']!r}")
+            lines.append(f"{name}_count{_labels(labels)} {snapshot['count']}")
+
+        families = {}
+        for collector in self._collectors:
+            for name, kind, help, labels, value in collector():
+                families.setdefault(name, (kind, help, []))[2].append((labels, value))
+        for name, (kind, help, samples) in families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                labels = tuple(sorted(labels.items()))
+                if kind == "histogram":
+                    for bound, count in value["buckets"]:
+                        le = "+Inf" if bound == float("inf") else bound
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {float(count)!r}")
+                    lines.append(f"{name}_sum{_labels(labels)} {float(value['sum'])!r}")
+                    lines.append(f"{name}_count{_labels(labels)} {float(value['count'])!r}")
+                else:
+                    lines.append(f"{name}{_labels(labels)} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+metrics = MetricsRegistry(
+    enabled=app.config.get("METRICS_ENABLED", True),
+    window=app.config.get("METRICS_WINDOW", 1024),
+)
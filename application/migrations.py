@@ -0,0 +1,87 @@
+from application import db
+from application.stats import rebuild_user_stats, stats_missing
+from sqlalchemy import inspect, text
+
+
+def add_missing_columns():
+    """Add columns that were added to the models after the database was created. db.create_all only creates missing tables, so existing tables are altered here.
+
+    Returns:
+        list[str]: Columns added, as "table.column"
+    """
+    inspector = inspect(db.engine)
+    added = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable:
+                raise RuntimeError(f"Cannot add non-nullable column {table.name}.{column.name} to an existing table")
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as connection:
+                connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def add_missing_indexes():
+    """Create indexes that were added to the models after the database was created
+
+    Returns:
+        list[str]: Indexes created
+    """
+    inspector = inspect(db.engine)
+    created = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name in existing:
+                continue
+            index.create(bind=db.engine, checkfirst=True)
+            created.append(index.name)
+    return created
+
+
+def drop_obsolete_indexes():
+    """Drop the (user_id, column) indexes of the history that the models no longer define, so that writes stop
+    maintaining them
+
+    Returns:
+        list[str]: Indexes dropped, as "-name"
+    """
+    history = db.metadata.tables["history"]
+    defined = {index.name for index in history.indexes}
+    dropped = []
+    for index in inspect(db.engine).get_indexes(history.name):
+        name = index["name"]
+        if name.startswith("ix_history_user_id_") and name not in defined:
+            with db.engine.begin() as connection:
+                connection.execute(text(f'DROP INDEX "{name}"'))
+            dropped.append(f"-{name}")
+    return dropped
+
+
+def add_missing_stats():
+    """Compute the per-user summaries of a history that was written before they existed
+
+    Returns:
+        list[str]: ["user_stats"] if the summaries were computed
+    """
+    if not stats_missing():
+        return []
+    rebuild_user_stats()
+    return ["user_stats"]
+
+
+def upgrade_database():
+    """Bring an existing database up to date with the models. Safe to run on every start
+
+    Returns:
+        list[str]: Columns, indexes and tables added or filled, and indexes dropped
+    """
+    return add_missing_columns() + add_missing_indexes() + drop_obsolete_indexes() + add_missing_stats()
@@ -0,0 +1,108 @@
+"""
+Loading of the served model, either as a regular joblib pickle or from a memory-mappable sidecar.
+
+The sidecar of `<model>.joblib` is the directory `<model>.joblib.mmap/`, holding the flattened forest as .npy files
+(see FlatForest.save) and the small preprocessing steps as their own joblib file. Worker processes memory-map the
+forest arrays, so they share one copy through the OS page cache instead of each unpickling their own.
+
+This module is imported while `application` is being initialised, so it must not import from `application` itself.
+"""
+from application.forest import FlatForest
+import joblib
+import json
+import os
+import shutil
+import tempfile
+
+MMAP_SUFFIX = ".mmap"
+
+
+class MappedModel:
+    """
+    Model loaded from a sidecar: the preprocessing steps of the pipeline, followed by a memory-mapped FlatForest.
+    Like a Pipeline, model[:-1] gives the preprocessing steps and model[-1] the final estimator.
+    """
+
+    def __init__(self, preprocessor, forest):
+        self.preprocessor = preprocessor
+        self.forest = forest
+
+    def predict(self, X):
+        return self.forest.predict(self.preprocessor.transform(X))
+
+    def __getitem__(self, index):
+        if index == slice(None, -1):
+            return self.preprocessor
+        if index == -1:
+            return self.forest
+        raise IndexError("A MappedModel only supports model[:-1] and model[-1]")
+
+
+def sidecar_path(model_path):
+    return model_path + MMAP_SUFFIX
+
+
+def _source_stamp(model_path):
+    """Identifies the version of the joblib file a sidecar was exported from"""
+    stat = os.stat(model_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def export_sidecar(model, model_path):
+    """Export the memory-mappable sidecar of a model
+
+    Args:
+        model (Pipeline): Loaded model, ending in a forest supported by FlatForest
+        model_path (str): Path of the joblib file the model was loaded from
+
+    Returns:
+        str: Path of the sidecar directory
+    """
+    target = sidecar_path(model_path)
+    # Write to a temporary directory first and rename it into place, so that workers starting
+    # at the same time never see a half-written sidecar
+    tmp = tempfile.mkdtemp(prefix=os.path.basename(target) + ".", dir=os.path.dirname(os.path.abspath(target)))
+    try:
+        FlatForest.from_model(model).save(os.path.join(tmp, "forest"))
+        joblib.dump(model[:-1], os.path.join(tmp, "preprocessor.joblib"))
+        with open(os.path.join(tmp, "source.json"), "w") as f:
+            json.dump(_source_stamp(model_path), f)
+        if os.path.isdir(target):
+            shutil.rmtree(target, ignore_errors=True)
+        try:
+            os.rename(tmp, target)
+        except OSError:  # Another worker got there first
+            pass
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return target
+
+
+def sidecar_is_fresh(model_path):
+    """Whether the sidecar of model_path exists and was exported from its current version"""
+    try:
+        with open(os.path.join(sidecar_path(model_path), "source.json")) as f:
+            return json.load(f) == _source_stamp(model_path)
+    except (OSError, ValueError):
+        return False
+
+
+def load_model(model_path, mmap=False):
+    """Load the served model
+
+    Args:
+        model_path (str): Path of the joblib file of the model
+        mmap (bool, optional): Load the model from its memory-mapped sidecar, exporting the sidecar first if it is missing or stale. Defaults to False.
+
+    Returns:
+        Pipeline | MappedModel: Loaded model
+    """
+    if not mmap:
+        return joblib.load(model_path)
+    if not sidecar_is_fresh(model_path):
+        export_sidecar(joblib.load(model_path), model_path)
+    directory = sidecar_path(model_path)
+    return MappedModel(
+        preprocessor=joblib.load(os.path.join(directory, "preprocessor.joblib")),
+        forest=FlatForest.load(os.path.join(directory, "forest"), mmap_mode="r"),
+    )
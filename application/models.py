@@ -1,7 +1,13 @@
-from application import db, NEIGHBORHOODS, ROOM_TYPES
+from application import db
+from application.history_cache import bump_history_versions
+from application.pagination import KeysetPage, decode_cursor, encode_cursor
+from application.schema import ENTRY_REQUEST_SCHEMA, ENTRY_SCHEMA
+from application.stats import count_entries, stats_row, update_user_stats
 import datetime as dt
 import re
 from flask import flash, abort
+from flask_sqlalchemy import Pagination
+from sqlalchemy import and_, literal, or_, select, tuple_
 from sqlalchemy.orm import validates
 from sqlalchemy.sql.expression import column
 from sqlalchemy.exc import IntegrityError
@@ -30,115 +36,124 @@ class Entry(db.Model):
     prediction = db.Column(db.Float, nullable=False)
     difference = db.Column(db.Float, nullable=True)
     created = db.Column(db.DateTime, nullable=False)
+    model_version = db.Column(db.String(100), nullable=True)
 
-    @validates("beds")
-    def validate_beds(self, key, beds):
-        assert type(beds) is int, "Beds should be an integer"
-        assert (
-            beds >= 0
-        ), "Beds should be greater than or equal to 0 (some AirBNB listings have no beds)"
-        return beds
-
-    @validates("bathrooms")
-    def validate_bathrooms(self, key, bathrooms):
-        assert type(bathrooms) in {
-            int,
-            float,
-        }, "Bathrooms should be an integer or float"
-        assert bathrooms >= 0, "Bathrooms should be greater than or equal to 0"
-        return bathrooms
-
-    @validates("accomodates")
-    def validate_accomodates(self, key, accomodates):
-        assert type(accomodates) is int, "Accomodates should be an integer"
-        assert accomodates > 0, "A room should accomodate at least one"
-        return accomodates
-
-    @validates("minimum_nights")
-    def validate_minimum_nights(self, key, minimum_nights):
-        assert (
-            type(minimum_nights) is int
-        ), "Minimum number of lights should be an integer"
-        assert minimum_nights >= 0, "Minimum number of lights should not be negative"
-        return minimum_nights
-
-    @validates("wifi")
-    def validate_wifi(self, key, wifi):
-        assert type(wifi) is bool, "data type should be a boolean"
-        return wifi
-
-    @validates("elevator")
-    def validate_elevator(self, key, elevator):
-        assert type(elevator) is bool, "data type should be a boolean"
-        return elevator
-
-    @validates("pool")
-    def validate_pool(self, key, pool):
-        assert type(pool) is bool, "data type should be a boolean"
-        return pool
-
-    @validates("neighborhood")
-    def validate_neighborhood(self, key, neighborhood):
-        assert type(neighborhood) is str, "Data type should be a string"
-        assert (
-            neighborhood in NEIGHBORHOODS
-        ), "Neighborhood should be one of the recognized neighborhoods"
-        return neighborhood
+    # Set while an entry is built from a row that was already validated (see from_row)
+    _validated = False
 
-    @validates("room_type")
-    def validate_room_type(self, key, room_type):
-        assert type(room_type) is str, "Data type should be a string"
-        assert (
-            room_type in ROOM_TYPES
-        ), "Room Type should be one of the valid Room Types"
-        return room_type
-
-    @validates("actual_price")
-    def validate_actual_price(self, key, actual_price):
-        assert type(actual_price) in {
-            type(None),
-            int,
-            float,
-        }, "Either actual price should be None, int or float"
-        if actual_price is not None:
-            assert (
-                actual_price > 0
-            ), "Actual price should be greater than 0"
-        return actual_price
-
-    @validates("prediction")
-    def validate_prediction(self, key, prediction):
-        assert type(prediction) in {float, int}, "Data type should be a float or int"
-        assert prediction > 0, "Prediction should be positive"
-        return prediction
+    # Every column set by the app or its users is checked against the rules of ENTRY_SCHEMA when it is set
+    @validates(*ENTRY_SCHEMA.fields)
+    def validate_field(self, key, value):
+        if self._validated:
+            return value
+        return ENTRY_SCHEMA.check_field(key, value)
 
-    @validates("created")
-    def validates_created(self, key, created):
-        assert type(created) is dt.datetime, "created should be a datetime object"
-        return created
+    @classmethod
+    def from_row(cls, row):
+        """Build an entry from a row that was already validated, e.g. by validate_entry_fields or a form, without checking
+        each column again. Columns set on the entry afterwards are checked as usual
+
+        Args:
+            row (dict): Validated row of the history table
+
+        Returns:
+            Entry: New entry
+        """
+        entry = cls()
+        entry._validated = True
+        for key, value in row.items():
+            setattr(entry, key, value)
+        entry._validated = False
+        return entry
 
-    @validates("link")
-    def validates_link(self, key, link):
-        assert type(link) in {type(None), str}, "Link should be None or Str"
-        return link
 
-    @validates("difference")
-    def validates_difference(self, key, difference):
-        assert type(difference) in {int, float, type(None)}, "Difference should be a number or None"
-        return difference
+# Columns the history can be sorted by. A user's history is always filtered by user_id, then sorted, so each of them
+# has an index on (user_id, column), and every page is read in order from the index. SQLite appends the rowid to every
+# index entry, so ties are returned in id order without a sort. Every index is another B-tree to update on each insert
+# and delete, so the history is not sortable by the other columns (the flags, listing details, link and model
+# version), which would be sorted from all of the user's entries on every page (see
+# benchmarks/bench_history_indexes.py). The (user_id, difference) index also gives the median of a user's summary.
+SORTABLE_COLUMNS = ["created", "prediction", "actual_price", "difference"]
+for _column in SORTABLE_COLUMNS:
+    db.Index(f"ix_history_user_id_{_column}", Entry.user_id, Entry.__table__.c[_column])
+
 
 def add_entry(entry):
     try:
         db.session.add(entry)
+        update_user_stats([stats_row(entry)])
+        bump_history_versions([entry.user_id])
         db.session.commit()
         return entry.id
     except Exception as error:
         db.session.rollback()
         abort(500)
 
+def validate_entry_fields(data, user_id, created):
+    """Validate a history entry sent to the history APIs against ENTRY_REQUEST_SCHEMA, without building an Entry
+
+    Args:
+        data (dict): Entry, as decoded from the json body of a request
+        user_id (int): Id of the user the entry belongs to
+        created (datetime): Creation time of the entry
+
+    Raises:
+        SchemaError: A field is missing or invalid
+
+    Returns:
+        dict: Validated row of the history table
+    """
+    row = ENTRY_REQUEST_SCHEMA.check(data)
+    row["created"] = created
+    row["user_id"] = user_id
+    return row
+
+
+def add_entries(rows, return_ids=True):
+    """Insert many validated rows in one transaction, with a single executemany, updating the summaries and
+    generations of their users
+
+    Args:
+        rows (list[dict]): Rows of the history table, as returned by validate_entry_fields
+        return_ids (bool, optional): Read back the ids of the inserted rows, which requires every row to belong to the same user. Defaults to True.
+
+    Returns:
+        list[int]: Id of each inserted row, in the same order as the rows (empty without return_ids)
+    """
+    if len(rows) == 0:
+        return []
+    table = Entry.__table__
+    try:
+        db.session.execute(table.insert(), rows)
+        update_user_stats(rows)
+        bump_history_versions(row["user_id"] for row in rows)
+        ids = []
+        if return_ids:
+            # The transaction holds the write lock, so the user's newest rows are the ones just inserted, in order
+            ids = db.session.execute(
+                select(table.c.id)
+                .where(table.c.user_id == rows[0]["user_id"])
+                .order_by(table.c.id.desc())
+                .limit(len(rows))
+            ).scalars().all()[::-1]
+        db.session.commit()
+        return ids
+    except Exception as error:
+        db.session.rollback()
+        abort(500)
+
+
 def delete_entry(entry):
+    """Delete an entry, remove it from the summary of its user and bump the user's generation. An entry already
+    deleted by a concurrent request is only removed from the summary once"""
     try:
-        db.session.delete(entry)
+        row = stats_row(entry)
+        table = Entry.__table__
+        deleted = db.session.execute(table.delete().where(table.c.id == entry.id)).rowcount
+        if deleted:
+            update_user_stats([row], sign=-1)
+            bump_history_versions([row["user_id"]])
+        db.session.expunge(entry)
         db.session.commit()
         return entry.id
     except Exception as error:
@@ -146,21 +161,150 @@ def delete_entry(entry):
         abort(500)
 
 
-def get_history(user_id, page=None, per_page=5, order_by="created", desc=True):
+def get_history(user_id, page=None, per_page=5, order_by="created", desc=True, columns=None):
+    # Pages that do not exist are checked outside of the try, so that they stay 404s
+    if page is not None and page < 1:
+        abort(404)
     try:
         order_by = column(order_by)
         if desc:
             order_by = order_by.desc()
         else:
             order_by = order_by.asc()
-        results = db.session.query(Entry).filter_by(user_id=user_id).order_by(order_by)
         if page is None:
-            return results.all()
-        else:
-            return results.paginate(page=page, per_page=per_page) 
+            return db.session.query(Entry).filter_by(user_id=user_id).order_by(order_by).all()
+        # Numbered pages are read as rows through Core (see history_select), and counted from the user's summary
+        offset = (page - 1) * per_page
+        items = db.session.execute(
+            history_select(user_id, columns).order_by(order_by).limit(per_page).offset(offset)
+        ).fetchall()
+        # A summary left out of date (see `flask rebuild-stats`) still counts the entries that were read
+        total = max(count_entries(user_id), offset + len(items))
     except Exception as error:
         flash(str(error), "danger")
         abort(500)
+    if not items and page != 1:
+        abort(404)
+    return Pagination(None, page, per_page, total, items)
+
+
+def history_select(user_id, columns=None):
+    """Core select of a user's history, fetched as lightweight rows instead of Entry objects. Rows have the columns
+    as attributes, like entries, but skip the identity map, attribute instrumentation and validators of the ORM.
+
+    Args:
+        user_id (int): Id of the user
+        columns (list[str], optional): Columns to select. Defaults to None (every column of the history table).
+
+    Returns:
+        Select: Query of the user's entries, which can be sorted, filtered and limited further
+    """
+    table = Entry.__table__
+    if columns is None:
+        return select(table).where(table.c.user_id == user_id)
+    return select(*(table.c[name] for name in columns)).where(table.c.user_id == user_id)
+
+
+def _seek(sort_column, desc, value, id):
+    """Filter for the entries after (value, id), in the order (sort_column, id) sorted in the given direction.
+    As in SQLite, NULLs come first in ascending order and last in descending order."""
+    if value is None:
+        after_nulls = Entry.id < id if desc else Entry.id > id
+        condition = and_(sort_column.is_(None), after_nulls)
+        return condition if desc else or_(condition, sort_column.isnot(None))
+    position = tuple_(literal(value, sort_column.type), literal(id))
+    if desc:
+        condition = tuple_(sort_column, Entry.id) < position
+        return or_(condition, sort_column.is_(None)) if sort_column.nullable else condition
+    return tuple_(sort_column, Entry.id) > position
+
+
+def get_history_page(user_id, per_page=5, order_by="created", desc=True, cursor=None, columns=None):
+    """Fetch a page of a user's history by keyset pagination. Ties in the sort column are ordered by id, so every page
+    is a range scan of the (user_id, column) index, whatever its depth.
+
+    Args:
+        user_id (int): Id of the user
+        per_page (int, optional): Number of entries per page. Defaults to 5.
+        order_by (str, optional): Column to sort by, one of SORTABLE_COLUMNS. Defaults to "created".
+        desc (bool, optional): Sort in descending order. Defaults to True.
+        cursor (str, optional): Cursor of the page to fetch, from a previous page. Defaults to None (the first page).
+        columns (list[str], optional): Columns to select, see history_select. The sort column and id are always selected. Defaults to None (every column).
+
+    Raises:
+        ValueError: The history cannot be sorted by order_by
+        InvalidCursor: The cursor is invalid, or was made for another sort order
+
+    Returns:
+        KeysetPage: Entries of the page, as rows, with the cursors of the previous and next pages
+    """
+    if order_by not in SORTABLE_COLUMNS:
+        raise ValueError(f"Cannot sort history by {order_by}")
+    sort_column = Entry.__table__.c[order_by]
+    if columns is not None:
+        # The cursors are made from the sort column and id of the first and last rows
+        columns = list(columns) + [name for name in ("id", order_by) if name not in columns]
+    query = history_select(user_id, columns)
+    backwards = False
+    if cursor is not None:
+        value, id, direction = decode_cursor(cursor, order_by, desc)
+        # The page before a cursor is fetched by walking the order backwards from it
+        backwards = direction == "prev"
+        query = query.where(_seek(sort_column, desc != backwards, value, id))
+    if desc != backwards:
+        query = query.order_by(sort_column.desc(), Entry.id.desc())
+    else:
+        query = query.order_by(sort_column.asc(), Entry.id.asc())
+    items = db.session.execute(query.limit(per_page + 1)).fetchall()
+    more = len(items) > per_page  # One extra entry tells whether there is a page beyond this one
+    items = items[:per_page]
+    if backwards:
+        items.reverse()
+    has_prev, has_next = (more, True) if backwards else (cursor is not None, more)
+    page = KeysetPage(items, per_page)
+    if items and has_prev:
+        page.prev_cursor = encode_cursor(order_by, desc, getattr(items[0], order_by), items[0].id, "prev")
+    if items and has_next:
+        page.next_cursor = encode_cursor(order_by, desc, getattr(items[-1], order_by), items[-1].id, "next")
+    return page
+
+
+def iter_history(user_id, order_by="created", desc=True, chunk_size=1000):
+    """Iterate over a user's whole history, without loading it all at once. Entries are read in chunks of chunk_size,
+    each with its own short query seeking past the previous chunk, so no read transaction is held while the caller
+    is busy with the rows (e.g. sending them to a slow client).
+
+    Args:
+        user_id (int): Id of the user
+        order_by (str, optional): Column to sort by, one of SORTABLE_COLUMNS. Defaults to "created".
+        desc (bool, optional): Sort in descending order. Defaults to True.
+        chunk_size (int, optional): Number of entries read per query. Defaults to 1000.
+
+    Raises:
+        ValueError: The history cannot be sorted by order_by
+
+    Yields:
+        Row: Every column of an entry, in the order of the history table
+    """
+    if order_by not in SORTABLE_COLUMNS:
+        raise ValueError(f"Cannot sort history by {order_by}")
+    table = Entry.__table__
+    sort_column = table.c[order_by]
+    if desc:
+        order = (sort_column.desc(), table.c.id.desc())
+    else:
+        order = (sort_column.asc(), table.c.id.asc())
+    last = None
+    while True:
+        query = history_select(user_id)
+        if last is not None:
+            query = query.where(_seek(sort_column, desc, last[order_by], last["id"]))
+        with db.engine.connect() as connection:
+            rows = connection.execute(query.order_by(*order).limit(chunk_size)).fetchall()
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1]._mapping
 
 
 class User(db.Model):
@@ -204,6 +348,17 @@ class User(db.Model):
         return created
 
 
+def update_password_hash(user, password_hash):
+    """Store a new hash of a user's password, e.g. after it was hashed again with the current method"""
+    try:
+        user.password_hash = password_hash
+        db.session.commit()
+    except Exception as error:
+        db.session.rollback()
+        flash(str(error), "danger")
+        abort(500)
+
+
 def add_user(new_user):
     try:
         db.session.add(new_user)
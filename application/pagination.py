@@ -0,0 +1,122 @@
+"""
+Keyset (cursor) pagination of a user's history.
+
+A page is fetched by seeking past the (sort column, id) of the last row of the previous page, so every page costs
+the same index range scan, whatever its depth, and no COUNT(*) is needed. The position is handed to clients as an
+opaque cursor, signed with the SECRET_KEY so that it cannot be forged or edited.
+"""
+from application import app
+from itsdangerous import BadSignature, URLSafeSerializer
+import datetime as dt
+
+CURSOR_SALT = "history-cursor"
+
+
+class InvalidCursor(Exception):
+    """Raised when a cursor cannot be decoded, or was issued for a different sort order"""
+
+
+class InvalidPage(Exception):
+    """Raised when a page number requested by a client is not a positive integer"""
+
+
+class KeysetPage:
+    """
+    A page of history entries fetched by keyset pagination, with the cursors of its neighbours.
+    Named like the attributes of Flask-SQLAlchemy's Pagination, so that templates can handle both.
+    """
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def _serializer():
+    return URLSafeSerializer(app.config["SECRET_KEY"], salt=CURSOR_SALT)
+
+
+def encode_cursor(order_by, desc, value, id, direction="next"):
+    """Encode a position in a sorted history
+
+    Args:
+        order_by (str): Column the history is sorted by
+        desc (bool): Whether it is sorted in descending order
+        value: Value of the sort column at the position
+        id (int): Id of the entry at the position, which breaks ties between equal values
+        direction (str, optional): "next" for the entries after the position, "prev" for the ones before it. Defaults to "next".
+
+    Returns:
+        str: Opaque, url-safe cursor
+    """
+    if isinstance(value, dt.datetime):
+        value = {"datetime": value.isoformat()}
+    return _serializer().dumps([order_by, bool(desc), value, id, direction])
+
+
+def decode_cursor(cursor, order_by, desc):
+    """Decode a cursor made by encode_cursor
+
+    Args:
+        cursor (str): Cursor sent by the client
+        order_by (str): Column the history is being sorted by
+        desc (bool): Whether it is being sorted in descending order
+
+    Raises:
+        InvalidCursor: The cursor is malformed, was tampered with, or was made for another sort order
+
+    Returns:
+        tuple: (value, id, direction)
+    """
+    try:
+        cursor_order_by, cursor_desc, value, id, direction = _serializer().loads(cursor)
+    except (BadSignature, TypeError, ValueError):
+        raise InvalidCursor("Invalid cursor")
+    if cursor_order_by != order_by or cursor_desc != bool(desc):
+        raise InvalidCursor("Cursor does not match the sort order")
+    if direction not in ("next", "prev") or type(id) is not int:
+        raise InvalidCursor("Invalid cursor")
+    if isinstance(value, dict):
+        try:
+            value = dt.datetime.fromisoformat(value["datetime"])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidCursor("Invalid cursor")
+    return value, id, direction
+
+
+def parse_page(page):
+    """Parse a page number requested by a client
+
+    Raises:
+        InvalidPage: The page is not an integer, or is below 1
+
+    Returns:
+        int: Page number, or None if no page was requested
+    """
+    if page is None:
+        return None
+    try:
+        page = int(page)
+    except ValueError:
+        raise InvalidPage("Page should be an integer")
+    if page < 1:
+        raise InvalidPage("Page should be at least 1")
+    return page
+
+
+def clamp_per_page(per_page, default):
+    """Bound a page size requested by a client to HISTORY_MAX_PER_PAGE"""
+    try:
+        per_page = int(per_page) if per_page is not None else default
+    except ValueError:
+        per_page = default
+    return max(1, min(per_page, app.config.get("HISTORY_MAX_PER_PAGE", 100)))
@@ -0,0 +1,198 @@
+"""
+Hashes and checks passwords in a small pool of threads, instead of the threads serving requests.
+
+PBKDF2 is slow on purpose. hashlib releases the GIL while it runs, so the pool does not need processes: what it adds
+is a bound on how many cores a spike of logins can take (PASSWORD_HASH_WORKERS), and on how many logins can wait
+for them (PASSWORD_HASH_MAX_PENDING), so that predictions keep being served. Logins beyond that get a 503.
+
+Hashes record the method they were made with (see werkzeug.security.generate_password_hash). When a user logs in
+with a hash made with another method than PASSWORD_HASH_METHOD, e.g. fewer iterations, the password is hashed again
+with the current method, so raising the cost applies to every user as they log in.
+"""
+from application import app
+from application.metrics import metrics
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+import threading
+import time
+
+# Time spent hashing or checking a password in the pool, labelled by operation
+HASH_METRIC = "rentier_password_hash_seconds"
+# Time a password waited for a thread of the pool, labelled by operation
+QUEUE_METRIC = "rentier_password_queue_wait_seconds"
+
+
+class HashingUnavailable(ServiceUnavailable):
+    """Raised when the hashing pool cannot take or finish a password in time. Rendered as a 503 response"""
+
+    def __init__(self, description):
+        super().__init__(description=description)
+        self.message = description
+
+
+def normalize_method(method):
+    """Method of a hash with its defaults spelled out, so that "pbkdf2:sha256" and "pbkdf2:sha256:260000" compare equal"""
+    parts = method.split(":")
+    if parts[0] == "pbkdf2":
+        parts += ["sha256", str(DEFAULT_PBKDF2_ITERATIONS)][len(parts) - 1:]
+    return ":".join(parts)
+
+
+def hash_method(password_hash):
+    """Method a hash was made with, normalized"""
+    return normalize_method(password_hash.split("$", 1)[0])
+
+
+class PasswordHasher:
+    """
+    Thread pool with a bounded number of pending passwords. Passwords beyond max_pending are rejected straight away
+    instead of queueing up behind the others, and passwords that take longer than timeout are abandoned.
+    With no workers, passwords are hashed in the calling thread.
+    """
+
+    def __init__(self, method="pbkdf2:sha256:260000", salt_length=16, workers=2, max_pending=64, timeout=10.0):
+        """
+        Args:
+            method (str, optional): Method of new hashes, as taken by generate_password_hash. Defaults to "pbkdf2:sha256:260000".
+            salt_length (int, optional): Length of the salt of new hashes. Defaults to 16.
+            workers (int, optional): Number of threads hashing passwords. Defaults to 2.
+            max_pending (int, optional): Maximum number of passwords queued or being hashed at once. Defaults to 64.
+            timeout (float, optional): Seconds to wait for a password, including time spent queued. Defaults to 10.0.
+        """
+        self.method = normalize_method(method)
+        self.salt_length = salt_length
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pool = None
+
+        self.rejected = 0
+        self.timeouts = 0
+        self.rehashed = 0
+
+    @property
+    def pool(self):
+        # Created on first use, so that importing the app does not start threads
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._pool
+
+    def _timed(self, operation, fn, args, submitted):
+        start = time.perf_counter()
+        metrics.observe(QUEUE_METRIC, start - submitted, operation=operation)
+        try:
+            return fn(*args)
+        finally:
+            metrics.observe(HASH_METRIC, time.perf_counter() - start, operation=operation)
+
+    def call(self, operation, fn, *args):
+        """Run fn(*args) in the pool and wait for its result
+
+        Args:
+            operation (str): Label of the call in the metrics
+
+        Raises:
+            HashingUnavailable: Too many passwords are pending, or the call timed out
+
+        Returns:
+            Any: Result of the call
+        """
+        if self.workers <= 0:
+            return self._timed(operation, fn, args, time.perf_counter())
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashingUnavailable("Too many logins are pending. Please try again later.")
+        try:
+            future = self.pool.submit(self._timed, operation, fn, args, time.perf_counter())
+        except Exception:
+            self._slots.release()
+            raise
+        # The slot is only freed once the thread is done, so abandoned calls still count against the queue
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise HashingUnavailable("Login timed out. Please try again later.")
+
+    def _hash(self, password):
+        return generate_password_hash(password, self.method, self.salt_length)
+
+    def needs_rehash(self, password_hash):
+        """Whether a hash was made with another method than the current one"""
+        return hash_method(password_hash) != self.method
+
+    def _verify(self, password_hash, password):
+        if not check_password_hash(password_hash, password):
+            return False, None
+        if not self.needs_rehash(password_hash):
+            return True, None
+        return True, self._hash(password)
+
+    def hash(self, password):
+        """Hash a new password with the current method
+
+        Returns:
+            str: Hash, with its method and salt
+        """
+        return self.call("hash", self._hash, password)
+
+    def verify(self, password_hash, password):
+        """Check a password against its hash, and hash it again if the hash uses an outdated method
+
+        Returns:
+            tuple: Whether the password is correct, and its new hash to store (None if the hash is up to date)
+        """
+        ok, new_hash = self.call("verify", self._verify, password_hash, password)
+        if new_hash is not None:
+            with self._lock:
+                self.rehashed += 1
+        return ok, new_hash
+
+    def stats(self):
+        """Snapshot of the pool's counters"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "rehashed": self.rehashed,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+password_hasher = PasswordHasher(
+    method=app.config.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256:260000"),
+    salt_length=app.config.get("PASSWORD_HASH_SALT_LENGTH", 16),
+    workers=app.config.get("PASSWORD_HASH_WORKERS", 2),
+    max_pending=app.config.get("PASSWORD_HASH_MAX_PENDING", 64),
+    timeout=app.config.get("PASSWORD_HASH_TIMEOUT", 10.0),
+)
+
+
+def collect_password_metrics():
+    """Counters of the hashing pool, exported by /metrics"""
+    stats = password_hasher.stats()
+    return [
+        ("rentier_password_rejected_total", "counter", "Passwords rejected because the hashing pool was full", {}, stats["rejected"]),
+        ("rentier_password_timeouts_total", "counter", "Passwords abandoned after timing out in the hashing pool", {}, stats["timeouts"]),
+        ("rentier_password_rehashed_total", "counter", "Passwords hashed again on login because their hash used an outdated method", {}, stats["rehashed"]),
+    ]
+
+
+metrics.describe(HASH_METRIC, "Time spent hashing or checking a password in the hashing pool")
+metrics.describe(QUEUE_METRIC, "Time a password waited for a thread of the hashing pool")
+metrics.register_collector(collect_password_metrics)
@@ -0,0 +1,177 @@
+"""
+In-process token-bucket rate limiting, per user and per client IP, configured per endpoint with RATE_LIMITS.
+
+Each (endpoint, scope, user or IP) has a bucket holding up to `burst` tokens, refilled at `rate` tokens per second.
+A request takes a token from the bucket of its IP and, when a user is logged in, from the bucket of its user, and is
+refused with a 429 and a Retry-After header when either is empty.
+
+A check is a dict lookup and a few float operations under one of a fixed set of striped locks, chosen by the hash of
+the bucket's key, so requests for different clients rarely wait on each other. Buckets that have been idle long
+enough to be full again are indistinguishable from new ones, so they are dropped by a sweep, started in a daemon
+thread by the first request after every sweep_interval seconds, keeping memory to the clients seen recently.
+Each worker process keeps its own buckets, so a client can make up to one burst per process.
+"""
+from application import app
+from application.metrics import metrics
+from collections import Counter
+import math
+import threading
+import time
+
+
+class TokenBuckets:
+    """Token buckets keyed by any hashable, created full on first use"""
+
+    def __init__(self, stripes=64, sweep_interval=60.0, clock=time.monotonic, background=True):
+        """
+        Args:
+            stripes (int, optional): Number of locks buckets are spread over. Defaults to 64.
+            sweep_interval (float, optional): Seconds between sweeps of the idle buckets. Defaults to 60.0.
+            clock (Callable, optional): Monotonic clock, in seconds. Defaults to time.monotonic.
+            background (bool, optional): Sweep in a daemon thread rather than in the request that starts the sweep,
+                which would wait for it. Defaults to True.
+        """
+        self.clock = clock
+        self.sweep_interval = sweep_interval
+        self.background = background
+        self._locks = [threading.Lock() for _ in range(max(1, stripes))]
+        self._sweep_lock = threading.Lock()
+        self._buckets = {}  # key: [tokens, last refill, seconds to refill from empty]
+        self._next_sweep = clock() + sweep_interval
+
+        self.evictions = 0
+
+    def take(self, key, rate, burst):
+        """Take a token from a bucket
+
+        Args:
+            key (Hashable): Key of the bucket
+            rate (float): Tokens added per second
+            burst (float): Capacity of the bucket
+
+        Returns:
+            float: 0 if a token was taken, else the number of seconds until one is available
+        """
+        now = self.clock()
+        with self._locks[hash(key) % len(self._locks)]:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [burst, now, burst / rate]
+            else:
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                wait = 0.0
+            else:
+                wait = (1 - bucket[0]) / rate
+        if now >= self._next_sweep and self._sweep_lock.acquire(blocking=False):
+            self._next_sweep = now + self.sweep_interval
+            if self.background:
+                threading.Thread(target=self._sweep, args=(now,), name="rate-limit-sweep", daemon=True).start()
+            else:
+                self._sweep(now)
+        return wait
+
+    def sweep(self, now=None):
+        """Drop the buckets that are full again. Skipped if another thread is already sweeping
+
+        Returns:
+            int: Number of buckets dropped
+        """
+        if not self._sweep_lock.acquire(blocking=False):
+            return 0
+        now = self.clock() if now is None else now
+        self._next_sweep = now + self.sweep_interval
+        return self._sweep(now)
+
+    def _sweep(self, now):
+        # Called with the sweep lock held, which is released once done
+        try:
+            dropped = 0
+            for key, bucket in list(self._buckets.items()):
+                if now - bucket[1] < bucket[2]:
+                    continue
+                with self._locks[hash(key) % len(self._locks)]:
+                    # Checked again under the lock, as a request may have used the bucket since
+                    if now - bucket[1] >= bucket[2] and self._buckets.get(key) is bucket:
+                        del self._buckets[key]
+                        dropped += 1
+            self.evictions += dropped
+            return dropped
+        finally:
+            self._sweep_lock.release()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def clear(self):
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            self._buckets.clear()
+        finally:
+            for lock in self._locks:
+                lock.release()
+
+
+class RateLimiter:
+    """Per-user and per-IP limits of endpoints, on top of TokenBuckets"""
+
+    # Scopes of the limits of an endpoint, in the order they are checked
+    SCOPES = ("ip", "user")
+
+    def __init__(self, buckets=None):
+        self.buckets = TokenBuckets() if buckets is None else buckets
+        self._lock = threading.Lock()
+        self.throttled = Counter()  # (endpoint, scope): requests refused
+
+    def check(self, endpoint, limits, user_id=None, ip=None):
+        """Take a token for a request from each bucket it falls in
+
+        Args:
+            endpoint (str): Name of the endpoint
+            limits (dict): {"ip": {"rate", "burst"}, "user": {"rate", "burst"}}, either of which can be left out
+            user_id (int, optional): Id of the logged in user. Defaults to None (only the IP is limited).
+            ip (str, optional): Address of the client. Defaults to None (only the user is limited).
+
+        Returns:
+            tuple: Scope of the limit that was hit and the number of whole seconds until the request can be retried,
+                or None if the request is allowed
+        """
+        for scope, client in zip(self.SCOPES, (ip, user_id)):
+            limit = limits.get(scope)
+            if limit is None or client is None:
+                continue
+            wait = self.buckets.take((endpoint, scope, client), limit["rate"], limit.get("burst", limit["rate"]))
+            if wait > 0:
+                with self._lock:
+                    self.throttled[(endpoint, scope)] += 1
+                return scope, max(1, math.ceil(wait))
+        return None
+
+    def stats(self):
+        """Snapshot of the counters of refused requests, and of the buckets"""
+        with self._lock:
+            throttled = dict(self.throttled)
+        return {"throttled": throttled, "buckets": len(self.buckets), "evictions": self.buckets.evictions}
+
+
+rate_limiter = RateLimiter(TokenBuckets(sweep_interval=app.config.get("RATE_LIMIT_SWEEP_SECONDS", 60.0)))
+
+
+def collect_rate_limit_metrics():
+    """Requests refused by the rate limits, and the number of buckets, exported by /metrics"""
+    stats = rate_limiter.stats()
+    samples = [
+        ("rentier_rate_limited_total", "counter", "Requests refused by a rate limit", {"endpoint": endpoint, "scope": scope}, count)
+        for (endpoint, scope), count in sorted(stats["throttled"].items())
+    ]
+    samples += [
+        ("rentier_rate_limit_buckets", "gauge", "Rate limit buckets of the clients seen recently", {}, stats["buckets"]),
+        ("rentier_rate_limit_evictions_total", "counter", "Idle rate limit buckets dropped", {}, stats["evictions"]),
+    ]
+    return samples
+
+
+metrics.register_collector(collect_rate_limit_metrics)
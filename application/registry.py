@@ -0,0 +1,212 @@
+"""
+Registry of versioned model artifacts, so that a new model can be deployed without restarting the workers.
+
+A registry is a directory holding the model artifacts and a manifest.json listing them:
+    {"current": "3", "versions": {"2": {"file": "2.joblib"}, "3": {"file": "3.joblib"}}}
+Publishing a version (see publish) copies its artifact in and rewrites the manifest atomically. Every worker polls
+the manifest, loads and warms the new current version in a background thread, then swaps it in.
+
+This module is imported while `application` is being initialised, so it must not import from `application` itself.
+"""
+import datetime as dt
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+MANIFEST = "manifest.json"
+
+
+class LoadedModel:
+    """A version of the model, along with everything compiled from it, ready to serve predictions"""
+
+    def __init__(self, version, model, encoder=None, forest=None):
+        self.version = version
+        self.model = model
+        self.encoder = encoder
+        self.forest = forest
+
+    def __repr__(self):
+        return f"LoadedModel(version={self.version!r})"
+
+
+def read_manifest(directory):
+    """Read the manifest of a registry
+
+    Returns:
+        dict: Manifest, with an empty list of versions if the registry has not been published to yet
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"current": None, "versions": {}}
+
+
+def current_artifact(directory):
+    """Version and artifact path of the current version of a registry
+
+    Returns:
+        tuple: (version, path), or (None, None) if no version has been published
+    """
+    manifest = read_manifest(directory)
+    version = manifest.get("current")
+    if version is None:
+        return None, None
+    return version, os.path.join(directory, manifest["versions"][version]["file"])
+
+
+def _write_manifest(directory, manifest):
+    fd, tmp = tempfile.mkstemp(prefix=MANIFEST + ".", dir=directory)
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(directory, MANIFEST))  # Readers see either the old or the new manifest
+
+
+def publish(directory, model_path, version, activate=True):
+    """Add a model artifact to a registry
+
+    Args:
+        directory (str): Registry directory
+        model_path (str): joblib file of the model
+        version (str): Version name, unique within the registry
+        activate (bool, optional): Make it the current version, so that running workers swap to it. Defaults to True.
+
+    Raises:
+        ValueError: The version already exists
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    version = str(version)
+    if version in manifest["versions"]:
+        raise ValueError(f"Version {version} already exists in the registry")
+    filename = f"{version}.joblib"
+    # Copy under a temporary name first, so that the artifact is complete once it appears
+    fd, tmp = tempfile.mkstemp(prefix=filename + ".", dir=directory)
+    os.close(fd)
+    shutil.copyfile(model_path, tmp)
+    os.replace(tmp, os.path.join(directory, filename))
+    manifest["versions"][version] = {
+        "file": filename,
+        "published": dt.datetime.utcnow().isoformat(),
+    }
+    if activate:
+        manifest["current"] = version
+    _write_manifest(directory, manifest)
+
+
+def activate(directory, version):
+    """Make an already published version the current one (e.g. to roll back)"""
+    manifest = read_manifest(directory)
+    if str(version) not in manifest["versions"]:
+        raise ValueError(f"Version {version} does not exist in the registry")
+    manifest["current"] = str(version)
+    _write_manifest(directory, manifest)
+
+
+class ModelRegistry:
+    """
+    Holds the model currently being served, and swaps in new versions from a registry directory.
+
+    Requests only ever read `current`, which is replaced in a single assignment once a new version has been
+    loaded and warmed, so loading never blocks the request path, and requests already holding the old
+    version finish with it.
+    """
+
+    def __init__(self, initial, directory=None, load=None, poll_interval=30):
+        """
+        Args:
+            initial (LoadedModel): Model to serve until a new version is loaded
+            directory (str, optional): Registry directory to watch. Defaults to None (never swap).
+            load (Callable, optional): Function taking (version, path) and returning a warmed LoadedModel. Required with a directory.
+            poll_interval (float, optional): Seconds between checks of the manifest. Defaults to 30.
+        """
+        self.current = initial
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self._load = load
+        self._lock = threading.Lock()
+        self._loading = None  # Version being loaded in the background
+        self._failed = None  # (version, modification time of its artifact) that failed to load
+        self._broken_manifest = None  # (modification time, error) of the manifest, while it cannot be read
+        self._watcher = None
+
+        self.swaps = 0
+        self.failures = 0
+        self.last_error = None
+
+    def check(self):
+        """Start loading the current version of the manifest in the background, if it is not the one being served
+
+        Returns:
+            threading.Thread: Thread loading the new version, or None if there is nothing to load
+        """
+        if self.directory is None:
+            return None
+        version, path = current_artifact(self.directory)
+        if version is None:
+            return None
+        artifact = (version, _mtime(path))
+        with self._lock:
+            if version == self.current.version or version == self._loading:
+                return None
+            # A version that failed to load is only tried again once its artifact is replaced
+            if artifact == self._failed:
+                return None
+            self._loading = version
+        thread = threading.Thread(
+            target=self._load_and_swap, args=(artifact, path), name=f"model-loader-{version}", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def ensure_watching(self):
+        """Start polling the manifest, if not already polling. Started lazily, so that forking servers poll from each worker"""
+        if self.directory is None or (self._watcher is not None and self._watcher.is_alive()):
+            return
+        with self._lock:
+            if self._watcher is None or not self._watcher.is_alive():
+                self._watcher = threading.Thread(target=self._watch, name="model-registry-watcher", daemon=True)
+                self._watcher.start()
+
+    def poll(self):
+        """Check the manifest once, as the watcher does. A manifest that cannot be read is counted as a failure once,
+        rather than on every poll, and is read again on each poll until it is fixed"""
+        try:
+            self.check()
+        except Exception as error:  # A broken manifest should not stop the watcher
+            broken = (_mtime(os.path.join(self.directory, MANIFEST)), str(error))
+            if broken != self._broken_manifest:
+                self.failures += 1
+                self._broken_manifest = broken
+            self.last_error = str(error)
+        else:
+            self._broken_manifest = None
+
+    def _watch(self):
+        while True:
+            self.poll()
+            time.sleep(self.poll_interval)
+
+    def _load_and_swap(self, artifact, path):
+        version = artifact[0]
+        try:
+            loaded = self._load(version, path)
+            self.current = loaded
+            self.swaps += 1
+        except Exception as error:  # Keep serving the previous version
+            self.failures += 1
+            self.last_error = f"Failed to load version {version}: {error}"
+            self._failed = artifact
+        finally:
+            with self._lock:
+                self._loading = None
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
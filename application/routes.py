@@ -1,13 +1,20 @@
-from application import app, db, ai_model, NEIGHBORHOODS, ROOM_TYPES
+from application import app, db
 from application.models import (
     User,
     add_user,
+    update_password_hash,
     Entry,
     add_entry,
     get_history,
+    get_history_page,
+    iter_history,
     delete_entry,
+    add_entries,
+    validate_entry_fields,
+    SORTABLE_COLUMNS,
 )
 from flask import (
+    g,
     render_template,
     request,
     flash,
@@ -16,16 +23,34 @@ from flask import (
     session,
     url_for,
     jsonify,
+    make_response,
+    Markup,
+    Response,
+    stream_with_context,
 )
 from application.forms import Prediction, Login, Register
-from werkzeug.security import check_password_hash, generate_password_hash
-from werkzeug.exceptions import BadRequest, InternalServerError
-from application.utils import login_required, API_Error
+from werkzeug.exceptions import BadRequest, InternalServerError, NotFound
+from application.utils import login_required, current_user_id, request_user_id, API_Error
+from application.ratelimit import rate_limiter
+from application.tokens import bearer_token, issue_token, max_age as token_max_age, revoke_token
+from application.migrations import upgrade_database
+from application.inference import parse_prediction_input, predict_many, predict_one
+from application.executor import InferenceUnavailable
+from application.passwords import HashingUnavailable, password_hasher
+from application.metrics import metrics, REQUEST_METRIC
+from application.pagination import InvalidCursor, InvalidPage, clamp_per_page, decode_cursor, parse_page
+from application.export import FORMATS, csv_chunks, ndjson_chunks
+from application.history_writer import record_entry
+from application.history_cache import add_validators, cached_fragment, history_version, not_modified
+from application.schema import ENTRY_REQUEST_SCHEMA, LISTING_SCHEMA, SchemaError, error_message
+from application.stats import get_user_stats
 from datetime import datetime as dt
-import pandas as pd
+import hmac
+import time
 
-# Create database if does not exist
+# Create database if does not exist, and bring an existing one up to date
 db.create_all()
+upgrade_database()
 
 
 @app.errorhandler(Exception)
@@ -43,7 +68,58 @@ def error_handler(error):
 
 @app.errorhandler(API_Error)
 def api_error_handler(error):
-    return jsonify({"message": error.message}), error.status_code
+    body = {"message": error.message}
+    if error.fields is not None:
+        body["fields"] = error.fields
+    return jsonify(body), error.status_code, error.headers or {}
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.before_request
+def check_rate_limits():
+    limits = app.config.get("RATE_LIMITS", {}).get(request.endpoint)
+    if limits is None:
+        return
+    limited = rate_limiter.check(request.endpoint, limits, request_user_id(), request.remote_addr)
+    if limited is not None:
+        scope, retry_after = limited
+        raise API_Error(
+            f"Too many requests from this {'user' if scope == 'user' else 'address'}. Please try again in {retry_after} seconds.",
+            429,
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+@app.after_request
+def record_request_time(response):
+    if "request_start" in g:
+        metrics.observe(
+            REQUEST_METRIC,
+            time.perf_counter() - g.request_start,
+            endpoint=request.endpoint or "unmatched",
+            method=request.method,
+        )
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    Returns the metrics of this worker process, in the Prometheus text format. With a METRICS_TOKEN, only to
+    scrapers sending it as a bearer token
+    """
+    if not metrics.enabled:
+        abort(404)
+    expected = app.config.get("METRICS_TOKEN")
+    if expected is not None:
+        token = bearer_token(request.headers) or ""
+        if not hmac.compare_digest(token.encode(), expected.encode()):
+            abort(401)
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/", methods=["GET"])
@@ -65,84 +141,40 @@ def predict():
         show_result = False
         results = {}
         if request.method == "POST":
-            if not pred_form.validate_on_submit():
+            with metrics.stage("predict.form_validation"):
+                valid = pred_form.validate_on_submit()
+            if not valid:
                 abort(400)
-            beds = pred_form.beds.data
-            bathrooms = pred_form.bathrooms.data
-            accomodates = pred_form.accomodates.data
-            minimum_nights = pred_form.minimum_nights.data
-            room_type = pred_form.room_type.data
-            neighborhood = pred_form.neighborhood.data
-            wifi = pred_form.wifi.data
-            elevator = pred_form.elevator.data
-            pool = pred_form.pool.data
-            actual_price = pred_form.actual_price.data
+            # The form checked the listing against LISTING_SCHEMA while validating
+            listing = pred_form.listing
+            actual_price = listing["actual_price"]
             link = pred_form.link.data  # store link for history
-            try:
-                assert beds >= 0, "Beds must be greater than or equal to zero"
-                assert bathrooms >= 0, "Bathrooms must be greater than or equal to zero"
-                assert accomodates >= 0, "Accomodates must be greater than zero"
-                assert (
-                    accomodates >= beds
-                ), "Accomodates must be greater than or equal to number of beds"
-                assert (
-                    minimum_nights >= 0
-                ), "MinimumNights must be greater than or equal to zero"
-                assert room_type in ROOM_TYPES, "Room type is invalid"
-                assert neighborhood in NEIGHBORHOODS, "Neighborhood is invalid"
-                assert type(wifi) is bool, "Wifi must be a boolean"
-                assert type(elevator) is bool, "Elevator must be a boolean"
-                assert type(pool) is bool, "Pool must be a boolean"
-                assert type(actual_price) in {
-                    type(None),
-                    float,
-                    int,
-                }, "Actual price should be a number or None"
-                if actual_price is not None:
-                    assert actual_price > 0, "Actual price should be greater than 0"
-            except:
-                raise BadRequest
-            entry_params = pd.DataFrame(
-                {
-                    "beds": [beds],
-                    "bathrooms_cleaned": [bathrooms],
-                    "accommodates": [accomodates],
-                    "minimum_nights": [minimum_nights],
-                    "room_type": [room_type],
-                    "neighbourhood_cleansed": [neighborhood],
-                    "wifi": [wifi],
-                    "elevator": [elevator],
-                    "pool": [pool],
-                }
-            )
-            result = ai_model.predict(entry_params)
+            with metrics.stage("predict.inference"):
+                prediction, model_version = predict_one(listing)
             show_result = True
-            results = {"price": result[0], "actual_price": actual_price}
+            results = {"price": prediction, "actual_price": actual_price}
             difference = None
             if actual_price is not None:
-                difference = float(actual_price - result[0])
+                difference = float(actual_price - prediction)
                 results["price_diff"] = abs(difference)
                 results["same"] = (
                     results["price_diff"] < 0.05
                 )  # account for floating point inprecision
-            new_entry = Entry(
-                beds=beds,
-                bathrooms=bathrooms,
-                accomodates=accomodates,
-                minimum_nights=minimum_nights,
-                room_type=room_type,
-                neighborhood=neighborhood,
-                wifi=wifi,
-                elevator=elevator,
-                pool=pool,
-                actual_price=actual_price,
-                link=link,
-                prediction=float(result[0]),
-                created=dt.utcnow(),
-                user_id=session["user_id"],
-                difference=difference,
-            )
-            add_entry(new_entry)
+            with metrics.stage("predict.entry"):
+                # The listing was validated by the form, and the other columns are set by the app
+                new_entry = Entry.from_row(
+                    dict(
+                        listing,
+                        link=link,
+                        prediction=prediction,
+                        created=dt.utcnow(),
+                        user_id=current_user_id(),
+                        difference=difference,
+                        model_version=model_version,
+                    )
+                )
+            with metrics.stage("predict.commit"):
+                record_entry(new_entry)
     except BadRequest:
         flash(f"Input validation failed. Please try again!", "danger")
 
@@ -155,25 +187,83 @@ def predict():
     )
 
 
+# Columns shown by history.html, the only ones read for the history page
+HISTORY_PAGE_COLUMNS = [
+    "id",
+    "created",
+    "beds",
+    "bathrooms",
+    "accomodates",
+    "minimum_nights",
+    "room_type",
+    "neighborhood",
+    "wifi",
+    "elevator",
+    "pool",
+    "prediction",
+    "actual_price",
+    "difference",
+    "link",
+]
+# Entries of the "Sort by" menu of history.html
+HISTORY_SORT_MENU = sorted(SORTABLE_COLUMNS)
+
+
 @app.route("/history", methods=["GET"])
 @login_required
 def history():
     """
     Return history page, containing the specific history of a user
     """
-    page = int(request.args.get("page", 1))
-    per_page = int(request.args.get("per_page", 5))
+    try:
+        page = parse_page(request.args.get("page"))
+    except InvalidPage as error:
+        abort(400, description=str(error))
+    # Numbered pages, from links made before cursors were introduced, take precedence over a cursor
+    cursor = request.args.get("cursor") if page is None else None
+    per_page = clamp_per_page(request.args.get("per_page"), 5)
     col_sort = request.args.get("col_sort", "created")
     desc = request.args.get("dir", "desc") == "desc"
-    history = get_history(session["user_id"], page, per_page, col_sort, desc)
-    return render_template(
-        "history.html",
-        title="Rentier | History",
-        history=history,
-        col_sort=col_sort,
-        desc=desc,
-        per_page=per_page,
+    if col_sort not in SORTABLE_COLUMNS:
+        abort(400, description="History cannot be sorted by this column")
+    if cursor is not None:
+        try:
+            decode_cursor(cursor, col_sort, desc)
+        except InvalidCursor as error:
+            abort(400, description=str(error))
+    user_id = current_user_id()
+
+    def render_table():
+        with metrics.stage("history.query"):
+            if page is not None:
+                history = get_history(user_id, page, per_page, col_sort, desc, HISTORY_PAGE_COLUMNS)
+            else:
+                history = get_history_page(user_id, per_page, col_sort, desc, cursor, HISTORY_PAGE_COLUMNS)
+        with metrics.stage("history.stats"):
+            stats = get_user_stats(user_id)
+        with metrics.stage("history.render"):
+            return render_template(
+                "includes/history_table.html",
+                history=history,
+                stats=stats,
+                col_sort=col_sort,
+                desc=desc,
+                per_page=per_page,
+                sortable_columns=HISTORY_SORT_MENU,
+            )
+
+    # The generation is read before the rows, so a page is never cached under a newer generation than its rows
+    with metrics.stage("history.version"):
+        version = history_version(user_id)
+    view = (page, cursor, per_page, col_sort, desc)
+    # Flashed messages are only shown by a page that is sent
+    if "_flashes" not in session and not_modified(user_id, version, view):
+        return add_validators(Response(status=304), user_id, version, view)
+    history_table = cached_fragment((user_id, version[0]) + view, render_table)
+    response = make_response(
+        render_template("history.html", title="Rentier | History", history_table=Markup(history_table))
     )
+    return add_validators(response, user_id, version, view)
 
 
 @app.route("/delete", methods=["POST"])
@@ -183,7 +273,7 @@ def delete():
     Delete entry from history
     """
     id = request.form.get("id")
-    user_id = session["user_id"]
+    user_id = current_user_id()
     result = db.session.query(Entry).filter_by(id=id, user_id=user_id).first()
     if result is None:
         abort(404, description="We could not find this entry in your history")
@@ -205,13 +295,18 @@ def login():
             email = loginForm.email.data
             password = loginForm.password.data
             remember = loginForm.remember_me.data
-            rows = db.session.query(User).filter_by(email=email).all()
+            with metrics.stage("login.query"):
+                rows = db.session.query(User).filter_by(email=email).all()
             if len(rows) == 0:
                 flash("User does not exist", "danger")
                 abort(400)
-            if not check_password_hash(rows[0].password_hash, password):
+            with metrics.stage("login.password_check"):
+                password_ok, new_hash = password_hasher.verify(rows[0].password_hash, password)
+            if not password_ok:
                 flash("Password is incorrect!", "danger")
                 abort(400)
+            if new_hash is not None:
+                update_password_hash(rows[0], new_hash)
             session["user_id"] = rows[0].id
             flash(f"Logged In", "success")
             if remember:
@@ -238,7 +333,8 @@ def register():
             if not registerForm.validate_on_submit():
                 abort(400)
             email = registerForm.email.data
-            password_hash = generate_password_hash(registerForm.password.data)
+            with metrics.stage("register.password_hash"):
+                password_hash = password_hasher.hash(registerForm.password.data)
             new_user = User(
                 email=email, password_hash=password_hash, created=dt.utcnow()
             )
@@ -279,13 +375,16 @@ def api_add_user():
             )
         # Retrieve fields from data
         email = data["email"]
-        password_hash = generate_password_hash(data["password"])
+        with metrics.stage("api_add_user.password_hash"):
+            password_hash = password_hasher.hash(data["password"])
         created = dt.utcnow()
         # Create a new entry into user table
         new_user = User(email=email, password_hash=password_hash, created=created)
 
         # Add entry to user table
         result = add_user(new_user)
+    except HashingUnavailable as e:
+        raise API_Error(e.message, 503)
     except Exception as e:
         raise API_Error(" ".join(e.args), 400)
     return jsonify(
@@ -298,6 +397,36 @@ def api_add_user():
     )
 
 
+def check_credentials(email, password, stage):
+    """Find a user by email and check their password, hashing it again if its hash is outdated
+
+    Args:
+        email (str): Email of the user
+        password (str): Password to check
+        stage (str): Prefix of the metrics stages, e.g. "api_login"
+
+    Raises:
+        API_Error: The user does not exist, the password is wrong, or the hashing pool is full
+
+    Returns:
+        User: The user
+    """
+    with metrics.stage(f"{stage}.query"):
+        rows = db.session.query(User).filter_by(email=email).all()
+    if len(rows) == 0:
+        raise API_Error("User not found", 404)
+    with metrics.stage(f"{stage}.password_check"):
+        try:
+            password_ok, new_hash = password_hasher.verify(rows[0].password_hash, password)
+        except HashingUnavailable as e:
+            raise API_Error(e.message, 503)
+    if not password_ok:
+        raise API_Error("Wrong password", 403)
+    if new_hash is not None:
+        update_password_hash(rows[0], new_hash)
+    return rows[0]
+
+
 @app.route("/api/login", methods=["POST"])
 def api_login_user():
     """
@@ -311,12 +440,8 @@ def api_login_user():
     email = data["email"]
     password = data["password"]
     remember_me = data["remember_me"]
-    rows = db.session.query(User).filter_by(email=email).all()
-    if len(rows) == 0:
-        raise API_Error("User not found", 404)
-    if not check_password_hash(rows[0].password_hash, password):
-        raise API_Error("Wrong password", 403)
-    session["user_id"] = rows[0].id
+    user = check_credentials(email, password, "api_login")
+    session["user_id"] = user.id
     if remember_me:
         session.permanent = True
     else:
@@ -324,7 +449,7 @@ def api_login_user():
 
     return jsonify(
         {
-            "id": rows[0].id,
+            "id": user.id,
             "email": email,
             "password": password,
             "remember_me": remember_me,
@@ -332,9 +457,41 @@ def api_login_user():
     )
 
 
+@app.route("/api/tokens", methods=["POST"])
+def api_issue_token():
+    """
+    Api for getting a bearer token, accepted by the other apis in place of a session until it expires
+    """
+    data = request.get_json()
+    if type(data) is not dict or type(data.get("email")) is not str or type(data.get("password")) is not str:
+        raise API_Error("Send the email and password of the user as a json object", 400)
+    user = check_credentials(data["email"], data["password"], "api_tokens")
+    return jsonify(
+        {
+            "user_id": user.id,
+            "token": issue_token(user.id),
+            "token_type": "Bearer",
+            "expires_in": token_max_age(),
+        }
+    )
+
+
+@app.route("/api/tokens", methods=["DELETE"])
+@login_required
+def api_revoke_token():
+    """
+    Api for revoking the bearer token the request is authenticated with
+    """
+    token = g.get("token")
+    if token is None:
+        raise API_Error("Only requests authenticated with a bearer token can revoke it", 400)
+    revoke_token(token)
+    return jsonify({"user_id": token["user_id"], "revoked": True})
+
+
 @app.route("/api/predict", methods=["POST"])
 @login_required
-def api_predict():  # TODO: Implement input validation
+def api_predict():
     """
     Api for requesting and returning user predictions based on user input
     """
@@ -344,103 +501,87 @@ def api_predict():  # TODO: Implement input validation
             raise TypeError(
                 "Invalid request type. Ensure data is in the form of a json file."
             )
-        beds = int(data["beds"])
-        bathrooms = float(data["bathrooms"])
-        accomodates = int(data["accomodates"])
-        minimum_nights = data["minimum_nights"]
-        room_type = data["room_type"]
-        neighborhood = data["neighborhood"]
-        wifi = data["wifi"]
-        elevator = data["elevator"]
-        pool = data["pool"]
-        actual_price = data["actual_price"]
-        assert beds >= 0, "Beds must be greater than or equal to zero"
-        assert bathrooms >= 0, "Bathrooms must be greater than or equal to zero"
-        assert accomodates >= 0, "Accomodates must be greater than zero"
-        assert (
-            accomodates >= beds
-        ), "Accomodates must be greater than or equal to number of beds"
-        assert (
-            minimum_nights >= 0
-        ), "MinimumNights must be greater than or equal to zero"
-        assert room_type in ROOM_TYPES, "Room type is invalid"
-        assert neighborhood in NEIGHBORHOODS, "Neighborhood is invalid"
-        assert type(wifi) is bool, "Wifi must be a boolean"
-        assert type(elevator) is bool, "Elevator must be a boolean"
-        assert type(pool) is bool, "Pool must be a boolean"
-        assert type(actual_price) in {
-            type(None),
-            float,
-            int,
-        }, "Actual price should be a number or None"
-        if actual_price is not None:
-            assert actual_price > 0, "Actual price should be greater than 0"
+        with metrics.stage("api_predict.input_checks"):
+            inputs = parse_prediction_input(data)
+    except SchemaError as e:
+        raise API_Error(str(e), 400, e.errors)
     except Exception as e:
         raise API_Error(" ".join(e.args), 400)
 
-    X = pd.DataFrame(
-        {
-            "beds": [beds],
-            "bathrooms_cleaned": [bathrooms],
-            "accommodates": [accomodates],
-            "minimum_nights": [minimum_nights],
-            "room_type": [room_type],
-            "neighbourhood_cleansed": [neighborhood],
-            "wifi": [wifi],
-            "elevator": [elevator],
-            "pool": [pool],
-        }
-    )
-    result = ai_model.predict(X)
+    try:
+        with metrics.stage("api_predict.inference"):
+            prediction, model_version = predict_one(inputs)
+    except InferenceUnavailable as e:
+        raise API_Error(e.message, 503)
+    actual_price = inputs["actual_price"]
     if actual_price is not None:
-        difference = actual_price - result[0]
+        difference = actual_price - prediction
     else:
         difference = None
-    return jsonify({"prediction": result[0], "difference": difference})
+    return jsonify(
+        {
+            "prediction": prediction,
+            "difference": difference,
+            "model_version": model_version,
+        }
+    )
+
+
+@app.route("/api/predict/batch", methods=["POST"])
+@login_required
+def api_predict_batch():
+    """
+    Api for predicting many listings at once. Every listing is validated separately, and all valid listings are predicted with a single call to the model
+    """
+    data = request.get_json()
+    if type(data) is not list:
+        raise API_Error(
+            "Invalid request type. Ensure data is a json array of listings.", 400
+        )
+    max_rows = app.config.get("PREDICT_BATCH_MAX_ROWS", 1000)
+    if len(data) > max_rows:
+        raise API_Error(f"A batch can contain at most {max_rows} listings.", 413)
+
+    results = [None] * len(data)
+    valid_rows, valid_idx, invalid = LISTING_SCHEMA.validate_many(data)
+    for idx, errors in invalid.items():
+        results[idx] = {"message": error_message(errors), "fields": errors}
+
+    try:
+        predictions, model_version = predict_many(valid_rows)
+    except InferenceUnavailable as e:
+        raise API_Error(e.message, 503)
+    for idx, inputs, prediction in zip(valid_idx, valid_rows, predictions):
+        actual_price = inputs["actual_price"]
+        results[idx] = {
+            "prediction": prediction,
+            "difference": None if actual_price is None else actual_price - prediction,
+        }
+    return jsonify(
+        {
+            "results": results,
+            "errors": len(data) - len(valid_rows),
+            "model_version": model_version,
+        }
+    )
 
 
 @app.route("/api/history/<int:id>", methods=["POST"])
 @login_required
 def api_add_history(id):
-    if session["user_id"] != id:
+    if current_user_id() != id:
         raise API_Error("Your user id does not match up with the request.", 403)
     data = request.get_json()
     if data is None:
         raise TypeError(
             "Invalid request type. Ensure data is in the form of a json file."
         )
-    beds = data["beds"]
-    bathrooms = data["bathrooms"]
-    accomodates = data["accomodates"]
-    minimum_nights = data["minimum_nights"]
-    room_type = data["room_type"]
-    neighborhood = data["neighborhood"]
-    wifi = data["wifi"]
-    elevator = data["elevator"]
-    pool = data["pool"]
-    actual_price = data["actual_price"]
-    link = data["link"]
-    prediction = data["prediction"]
-    difference = data["difference"]
     try:
-        new_entry = Entry(
-            beds=beds,
-            bathrooms=bathrooms,
-            accomodates=accomodates,
-            minimum_nights=minimum_nights,
-            room_type=room_type,
-            neighborhood=neighborhood,
-            wifi=wifi,
-            elevator=elevator,
-            pool=pool,
-            actual_price=actual_price,
-            link=link,
-            prediction=float(prediction),
-            created=dt.utcnow(),
-            user_id=id,
-            difference=difference,
-        )
-        result = add_entry(new_entry)
+        row = validate_entry_fields(data, id, dt.utcnow())
+    except SchemaError as e:
+        raise API_Error(str(e), 400, e.errors)
+    try:
+        result = add_entry(Entry.from_row(row))
     except Exception as e:
         raise API_Error(" ".join(e.args), 400)
     return jsonify({"result": result})
@@ -449,40 +590,151 @@ def api_add_history(id):
 AssertionError()
 
 
-@app.route("/api/history/<int:id>", methods=["GET"])
+@app.route("/api/history/<int:id>/bulk", methods=["POST"])
 @login_required
-def api_get_user_history(id):
-    if session["user_id"] != id:
+def api_add_history_bulk(id):
+    """
+    Api for adding many entries to a user's history at once. Every entry is validated separately, and all valid entries are inserted in a single transaction
+    """
+    if current_user_id() != id:
         raise API_Error("Your user id does not match up with the request.", 403)
-    entries = get_history(id)
-    result = [
+    data = request.get_json()
+    if type(data) is not list:
+        raise API_Error(
+            "Invalid request type. Ensure data is a json array of entries.", 400
+        )
+    max_rows = app.config.get("HISTORY_BULK_MAX_ROWS", 1000)
+    if len(data) > max_rows:
+        raise API_Error(f"A batch can contain at most {max_rows} entries.", 413)
+
+    created = dt.utcnow()
+    results = [None] * len(data)
+    valid_rows = []
+    valid_idx = []
+    with metrics.stage("api_history_bulk.validation"):
+        valid_rows, valid_idx, invalid = ENTRY_REQUEST_SCHEMA.validate_many(data)
+        for row in valid_rows:
+            row["created"] = created
+            row["user_id"] = id
+    for idx, errors in invalid.items():
+        results[idx] = {"message": error_message(errors), "fields": errors}
+
+    with metrics.stage("api_history_bulk.insert"):
+        ids = add_entries(valid_rows)
+    for idx, entry_id in zip(valid_idx, ids):
+        results[idx] = {"id": entry_id}
+    return jsonify(
         {
-            "entry_id": entry.id,
-            "user_id": entry.user_id,
-            "beds": entry.beds,
-            "bathrooms": entry.bathrooms,
-            "accomodates": entry.accomodates,
-            "minimum_nights": entry.minimum_nights,
-            "room_type": entry.room_type,
-            "neighborhood": entry.neighborhood,
-            "wifi": entry.wifi,
-            "elevator": entry.elevator,
-            "pool": entry.pool,
-            "actual_price": entry.actual_price,
-            "link": entry.link,
-            "prediction": entry.prediction,
-            "created": entry.created,
-            "difference": entry.difference,
+            "results": results,
+            "inserted": len(ids),
+            "errors": len(data) - len(ids),
         }
-        for entry in entries
-    ]
-    return jsonify(result)
+    )
+
+
+@app.route("/api/history/<int:id>", methods=["GET"])
+@login_required
+def api_get_user_history(id):
+    if current_user_id() != id:
+        raise API_Error("Your user id does not match up with the request.", 403)
+    page = request.args.get("page")
+    per_page = clamp_per_page(
+        request.args.get("per_page"), app.config.get("HISTORY_API_PER_PAGE", 100)
+    )
+    col_sort = request.args.get("col_sort", "created")
+    desc = request.args.get("dir", "desc") == "desc"
+    if col_sort not in SORTABLE_COLUMNS:
+        raise API_Error("History cannot be sorted by this column", 400)
+    try:
+        page = parse_page(page)
+    except InvalidPage as error:
+        raise API_Error(str(error), 400)
+    cursor = request.args.get("cursor") if page is None else None
+    if cursor is not None:
+        try:
+            decode_cursor(cursor, col_sort, desc)
+        except InvalidCursor as error:
+            raise API_Error(str(error), 400)
+    view = (page, cursor, per_page, col_sort, desc)
+    with metrics.stage("api_history.version"):
+        version = history_version(id)
+    if not_modified(id, version, view):
+        return add_validators(Response(status=304), id, version, view)
+    # Other pages are linked from the Link header, so that the body stays a list of entries
+    link_args = {"id": id, "per_page": per_page, "col_sort": col_sort, "dir": "desc" if desc else "asc"}
+    links = {}
+    with metrics.stage("api_history.query"):
+        if page is not None:
+            try:
+                history = get_history(id, page, per_page, col_sort, desc)
+            except NotFound:
+                raise API_Error("This page is past the end of the history", 404)
+            if history.has_prev:
+                links["prev"] = {"page": history.prev_num}
+            if history.has_next:
+                links["next"] = {"page": history.next_num}
+        else:
+            history = get_history_page(id, per_page, col_sort, desc, cursor)
+            if history.has_prev:
+                links["prev"] = {"cursor": history.prev_cursor}
+            if history.has_next:
+                links["next"] = {"cursor": history.next_cursor}
+        entries = history.items
+    # Entries are rows of every column of the history table, returned under the same keys, except for id
+    keys = ["entry_id" if key == "id" else key for key in Entry.__table__.columns.keys()]
+    result = [dict(zip(keys, entry)) for entry in entries]
+    response = jsonify(result)
+    if links:
+        response.headers["Link"] = ", ".join(
+            f'<{url_for("api_get_user_history", _external=True, **link_args, **args)}>; rel="{rel}"'
+            for rel, args in links.items()
+        )
+    return add_validators(response, id, version, view)
+
+
+@app.route("/api/history/<int:id>/stats", methods=["GET"])
+@login_required
+def api_user_stats(id):
+    """
+    Api for getting the summary of a user's history: number of entries, mean and median difference, and the same by neighborhood and room type
+    """
+    if current_user_id() != id:
+        raise API_Error("Your user id does not match up with the request.", 403)
+    with metrics.stage("api_history_stats.query"):
+        stats = get_user_stats(id)
+    return jsonify(stats)
+
+
+@app.route("/api/history/<int:id>/export", methods=["GET"])
+@login_required
+def api_export_user_history(id):
+    """
+    Api for downloading a user's whole history as NDJSON (default) or CSV. The history is streamed in chunks as it is read, so memory use does not grow with its size
+    """
+    if current_user_id() != id:
+        raise API_Error("Your user id does not match up with the request.", 403)
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in FORMATS:
+        raise API_Error(f"Format should be one of {', '.join(FORMATS)}", 400)
+    col_sort = request.args.get("col_sort", "created")
+    desc = request.args.get("dir", "desc") == "desc"
+    if col_sort not in SORTABLE_COLUMNS:
+        raise API_Error("History cannot be sorted by this column", 400)
+    chunk_size = app.config.get("HISTORY_EXPORT_CHUNK_SIZE", 1000)
+    rows = iter_history(id, col_sort, desc, chunk_size)
+    encode = csv_chunks if export_format == "csv" else ndjson_chunks
+    mimetype, extension = FORMATS[export_format]
+    return Response(
+        stream_with_context(encode(rows, chunk_size)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="history_{id}.{extension}"'},
+    )
 
 
 @app.route("/api/history/<int:user_id>/<int:id>/", methods=["DELETE"])
 @login_required
 def api_delete_entry(user_id, id):
-    if session["user_id"] != user_id:
+    if current_user_id() != user_id:
         raise API_Error("Your user id does not match up with the request.", 403)
     result = db.session.query(Entry).filter_by(id=id, user_id=user_id).first()
     if result is None:
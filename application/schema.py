@@ -0,0 +1,314 @@
+"""
+Validation rules of listings and history entries, defined once and shared by the forms, the APIs and the models.
+
+A Schema is compiled when it is defined, into the source of a Python function validating a whole row: one
+straight-line block per field, with exact type lookups in frozensets, membership tests against frozensets of
+choices and bound comparisons, and no call or loop per field. Every invalid field is reported under its name,
+instead of stopping at the first failed assert. Each field also gets a function of its own, for the model hooks.
+"""
+from application import NEIGHBORHOODS, ROOM_TYPES
+import copy
+import datetime as dt
+
+# Key of the errors that concern a whole row rather than one of its fields
+ROW_ERRORS = "__all__"
+
+_MISSING = object()
+_INVALID = object()  # Value of a field that could not be converted
+_NONE = type(None)
+_INF = float("inf")
+
+
+class SchemaError(AssertionError):
+    """
+    Raised when an input does not match a schema. errors maps each invalid field to its message.
+    Subclasses AssertionError, which is what validation failures were raised as before schemas.
+    """
+
+    def __init__(self, errors):
+        super().__init__(error_message(errors))
+        self.errors = errors
+
+
+def error_message(errors):
+    """Single message listing every error of a row"""
+    return "; ".join(errors.values())
+
+
+class Field:
+    """Rules of a field"""
+
+    def __init__(
+        self,
+        types,
+        message,
+        minimum=None,
+        exclusive=False,
+        range_message=None,
+        choices=None,
+        choice_message=None,
+        nullable=False,
+        coerce=None,
+        default=_MISSING,
+    ):
+        """
+        Args:
+            types (tuple[type]): Accepted types. Checked exactly, so bool is not accepted as an int. Floats must be finite
+            message (str): Error when the value has the wrong type
+            minimum (float, optional): Smallest accepted value. Defaults to None.
+            exclusive (bool, optional): Whether the minimum itself is rejected. Defaults to False.
+            range_message (str, optional): Error when the value is below the minimum. Defaults to None.
+            choices (Iterable, optional): Accepted values. Defaults to None (any value).
+            choice_message (str, optional): Error when the value is not one of the choices. Defaults to None.
+            nullable (bool, optional): Whether None is accepted, skipping every other check. Defaults to False.
+            coerce (Callable, optional): Conversion applied before the checks, e.g. int. Defaults to None.
+            default (optional): Value of the field when it is missing. Defaults to none (the field is required).
+        """
+        self.types = frozenset(tuple(types) + ((_NONE,) if nullable else ()))
+        self.message = message
+        self.minimum = minimum
+        self.exclusive = exclusive
+        self.range_message = range_message
+        self.choices = None if choices is None else frozenset(choices)
+        self.choice_message = choice_message
+        self.nullable = nullable
+        self.coerce = coerce
+        self.default = default
+
+    def strict(self, types=None):
+        """Copy of the field without its conversion, for values that should already have been converted, e.g. by the app
+
+        Args:
+            types (tuple[type], optional): Accepted types. Defaults to None (the types of the field).
+
+        Returns:
+            Field: Field with the same rules, checking the values as they are
+        """
+        field = copy.copy(self)
+        field.coerce = None
+        if types is not None:
+            field.types = frozenset(tuple(types) + ((_NONE,) if self.nullable else ()))
+        return field
+
+    def source(self, key, var, prefix, namespace):
+        """Lines of source checking the field, held in the variable var, and adding its error to a dict named errors
+
+        Args:
+            key (str): Name of the field
+            var (str): Variable holding the value
+            prefix (str): Prefix of the names added to namespace
+            namespace (dict): Globals of the compiled function, where the types, choices... of the field are added
+
+        Returns:
+            list[str]: Lines of source, not indented
+        """
+        lines = []
+        namespace[f"{prefix}_types"] = self.types
+        if self.coerce is not None:
+            namespace[f"{prefix}_coerce"] = self.coerce
+            indent = ""
+            if self.nullable:
+                lines.append(f"if {var} is not None:")
+                indent = "    "
+            lines += [
+                f"{indent}try:",
+                f"{indent}    {var} = {prefix}_coerce({var})",
+                f"{indent}except (TypeError, ValueError, OverflowError):",
+                f"{indent}    {var} = _INVALID",
+            ]
+        lines += [f"if type({var}) not in {prefix}_types:", f"    errors[{key!r}] = {self.message!r}"]
+        if float in self.types:
+            # NaN fails every comparison, so it would pass the range checks below
+            lines += [
+                f"elif type({var}) is float and not -_INF < {var} < _INF:",
+                f"    errors[{key!r}] = {self.message!r}",
+            ]
+        not_none = f"{var} is not None and " if self.nullable else ""
+        if self.minimum is not None:
+            namespace[f"{prefix}_minimum"] = self.minimum
+            operator = "<=" if self.exclusive else "<"
+            lines += [
+                f"elif {not_none}{var} {operator} {prefix}_minimum:",
+                f"    errors[{key!r}] = {self.range_message!r}",
+            ]
+        if self.choices is not None:
+            namespace[f"{prefix}_choices"] = self.choices
+            lines += [
+                f"elif {not_none}{var} not in {prefix}_choices:",
+                f"    errors[{key!r}] = {self.choice_message!r}",
+            ]
+        return lines
+
+
+def _indent(lines, level):
+    return ["    " * level + line for line in lines]
+
+
+class Schema:
+    """Fields of a row, along with checks involving several fields, compiled into a validator"""
+
+    def __init__(self, name, fields, checks=()):
+        """
+        Args:
+            name (str): Name of a row, used in error messages
+            fields (dict[str, Field]): Rules of each field, in the order of the validated rows
+            checks (Iterable, optional): (field, predicate, message) tuples. The predicate is called with the valid row,
+                and the message is reported under field when it returns False. Skipped when any field is invalid. Defaults to ().
+        """
+        self.name = name
+        self.fields = dict(fields)
+        self.checks = tuple(checks)
+        self.validate = self._compile()
+        self._field_checkers = {key: self._compile_field(idx, key) for idx, key in enumerate(self.fields)}
+
+    def _namespace(self):
+        return {"_MISSING": _MISSING, "_INVALID": _INVALID, "_INF": _INF, "_checks": self.checks}
+
+    def _compile(self):
+        namespace = self._namespace()
+        namespace["_not_a_row"] = f"{self.name} should be a json object"
+        lines = [
+            "def validate(data):",
+            "    if type(data) is not dict:",
+            "        return None, {%r: _not_a_row}" % ROW_ERRORS,
+            "    errors = {}",
+            "    get = data.get",
+        ]
+        for idx, (key, field) in enumerate(self.fields.items()):
+            var = f"v{idx}"
+            lines.append(f"    {var} = get({key!r}, _MISSING)")
+            body = field.source(key, var, f"f{idx}", namespace)
+            if field.default is _MISSING:
+                lines += [f"    if {var} is _MISSING:", f"        errors[{key!r}] = {'Missing field ' + key!r}", "    else:"]
+                lines += _indent(body, 2)
+            else:
+                namespace[f"f{idx}_default"] = field.default
+                lines += [f"    if {var} is _MISSING:", f"        {var} = f{idx}_default"]
+                lines += _indent(body, 1)
+        lines += [
+            "    if errors:",
+            "        return None, errors",
+            "    row = {%s}" % ", ".join(f"{key!r}: v{idx}" for idx, key in enumerate(self.fields)),
+            "    for key, predicate, message in _checks:",
+            "        if not predicate(row):",
+            "            return None, {key: message}",
+            "    return row, errors",
+        ]
+        exec(compile("\n".join(lines), f"<schema {self.name}>", "exec"), namespace)
+        validate = namespace["validate"]
+        validate.__doc__ = """Validate a row
+
+        Args:
+            data (dict): Row to validate. Keys that are not fields of the schema are ignored
+
+        Returns:
+            tuple: Validated row (None if it is invalid), and the errors of the invalid fields, empty if the row is valid
+        """
+        return validate
+
+    def _compile_field(self, idx, key):
+        namespace = self._namespace()
+        lines = ["def check(value):", "    errors = {}"]
+        lines += _indent(self.fields[key].source(key, "value", f"f{idx}", namespace), 1)
+        lines.append("    return value, errors.get(%r)" % key)
+        exec(compile("\n".join(lines), f"<schema {self.name}.{key}>", "exec"), namespace)
+        return namespace["check"]
+
+    def validate_many(self, rows):
+        """Validate an array of rows
+
+        Args:
+            rows (list): Rows to validate
+
+        Returns:
+            tuple: Valid rows, their indexes in rows, and {index: errors} of the invalid rows
+        """
+        valid, valid_idx, invalid = [], [], {}
+        validate = self.validate
+        for idx, data in enumerate(rows):
+            row, errors = validate(data)
+            if errors:
+                invalid[idx] = errors
+            else:
+                valid.append(row)
+                valid_idx.append(idx)
+        return valid, valid_idx, invalid
+
+    def check(self, data):
+        """Validate a row
+
+        Raises:
+            SchemaError: The row is invalid
+
+        Returns:
+            dict: Validated row
+        """
+        row, errors = self.validate(data)
+        if errors:
+            raise SchemaError(errors)
+        return row
+
+    def check_field(self, key, value):
+        """Validate a single field, e.g. when it is set on a model
+
+        Raises:
+            SchemaError: The value is invalid
+
+        Returns:
+            Validated value
+        """
+        value, error = self._field_checkers[key](value)
+        if error is not None:
+            raise SchemaError({key: error})
+        return value
+
+
+# Features of a listing sent for a prediction, from the prediction form or APIs. Counts sent as strings or floats are converted
+LISTING_SCHEMA = Schema(
+    "Listing",
+    {
+        "beds": Field((int,), "Beds must be an integer", coerce=int, minimum=0, range_message="Beds must be greater than or equal to zero"),
+        "bathrooms": Field((float,), "Bathrooms must be a number", coerce=float, minimum=0, range_message="Bathrooms must be greater than or equal to zero"),
+        "accomodates": Field((int,), "Accomodates must be an integer", coerce=int, minimum=0, exclusive=True, range_message="Accomodates must be greater than zero"),
+        "minimum_nights": Field((int,), "MinimumNights must be an integer", coerce=int, minimum=0, range_message="MinimumNights must be greater than or equal to zero"),
+        "room_type": Field((str,), "Room type is invalid", choices=ROOM_TYPES, choice_message="Room type is invalid"),
+        "neighborhood": Field((str,), "Neighborhood is invalid", choices=NEIGHBORHOODS, choice_message="Neighborhood is invalid"),
+        "wifi": Field((bool,), "Wifi must be a boolean"),
+        "elevator": Field((bool,), "Elevator must be a boolean"),
+        "pool": Field((bool,), "Pool must be a boolean"),
+        "actual_price": Field(
+            (float, int), "Actual price should be a number or None", nullable=True, minimum=0, exclusive=True, range_message="Actual price should be greater than 0"
+        ),
+    },
+    checks=[
+        ("accomodates", lambda row: row["accomodates"] >= row["beds"], "Accomodates must be greater than or equal to number of beds"),
+    ],
+)
+
+# Columns of a history entry set by the app or its users, as checked when they are set on an Entry. The listing columns
+# follow the rules of LISTING_SCHEMA, without its conversions: entries are built from listings that were already converted
+ENTRY_SCHEMA = Schema(
+    "Entry",
+    {
+        **{key: field.strict() for key, field in LISTING_SCHEMA.fields.items()},
+        "bathrooms": LISTING_SCHEMA.fields["bathrooms"].strict((int, float)),
+        "link": Field((str,), "Link should be None or Str", nullable=True),
+        "prediction": Field((float, int), "Data type should be a float or int", minimum=0, exclusive=True, range_message="Prediction should be positive"),
+        "difference": Field((int, float), "Difference should be a number or None", nullable=True),
+        "created": Field((dt.datetime,), "created should be a datetime object"),
+        "model_version": Field((str,), "Model version should be None or Str", nullable=True, default=None),
+    },
+    checks=LISTING_SCHEMA.checks,
+)
+
+# Entries sent to the history APIs: predictions are converted to floats, and the creation time is set by the app
+ENTRY_REQUEST_SCHEMA = Schema(
+    "Entry",
+    {
+        **{key: field for key, field in ENTRY_SCHEMA.fields.items() if key != "created"},
+        "prediction": Field(
+            (float,), "Data type should be a float or int", coerce=float, minimum=0, exclusive=True, range_message="Prediction should be positive"
+        ),
+    },
+    checks=ENTRY_SCHEMA.checks,
+)
@@ -0,0 +1,308 @@
+"""
+Per-user summaries of the history: number of entries, mean and median prediction error (difference), and the same
+broken down by neighborhood and room type.
+
+The counts and sums behind the summaries are kept in the user_stats and user_stats_breakdown tables, which every
+write to the history (add_entry, delete_entry and add_entries) updates with upserts in its own transaction, so
+reading a summary never scans the history. The median cannot be maintained that way: it is read from the
+(user_id, difference) index of the history, at the offset given by the stored count, which still steps through half
+of the user's index entries. It is cached under the generation of the user's history (see
+application/history_cache.py), so it is only read again after the history changes. The stored count of entries is
+also the total of the numbered history pages (count_entries), instead of a COUNT query per page.
+
+`flask rebuild-stats` recomputes both tables from the history, and `flask rebuild-stats --check` only reports the
+users whose summaries are out of date (e.g. after entries were deleted with a bulk query).
+"""
+from application import app, db
+from application.cache import LRUCache, MISSING
+from application.history_cache import bump_history_versions, history_version, history_versions
+from sqlalchemy import delete, func, literal, select, true
+from sqlalchemy.dialects.sqlite import insert
+import click
+import math
+
+# Columns of the history the summaries are computed from
+STATS_COLUMNS = ("user_id", "neighborhood", "room_type", "difference")
+# Columns of the history the summaries are broken down by
+BREAKDOWNS = ("neighborhood", "room_type")
+# Counts and sums kept for each user, and each value of a breakdown
+TOTALS = ("entries", "difference_count", "difference_sum", "abs_difference_sum")
+
+user_stats = db.Table(
+    "user_stats",
+    db.Column("user_id", db.Integer, db.ForeignKey("users.id"), primary_key=True),
+    db.Column("entries", db.Integer, nullable=False),
+    db.Column("difference_count", db.Integer, nullable=False),
+    db.Column("difference_sum", db.Float, nullable=False),
+    db.Column("abs_difference_sum", db.Float, nullable=False),
+)
+
+user_stats_breakdown = db.Table(
+    "user_stats_breakdown",
+    db.Column("user_id", db.Integer, db.ForeignKey("users.id"), primary_key=True),
+    db.Column("breakdown", db.String(20), primary_key=True),
+    db.Column("value", db.String(100), primary_key=True),
+    db.Column("entries", db.Integer, nullable=False),
+    db.Column("difference_count", db.Integer, nullable=False),
+    db.Column("difference_sum", db.Float, nullable=False),
+    db.Column("abs_difference_sum", db.Float, nullable=False),
+)
+
+
+def _history():
+    return db.metadata.tables["history"]
+
+
+def _upsert(table, keys):
+    """Insert that adds to the totals of an existing row instead of failing"""
+    statement = insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=keys,
+        set_={total: table.c[total] + statement.excluded[total] for total in TOTALS},
+    )
+
+
+# Built once, as building them costs about as much as running them on a few rows
+_UPSERT_USER_STATS = _upsert(user_stats, ["user_id"])
+_UPSERT_BREAKDOWN = _upsert(user_stats_breakdown, ["user_id", "breakdown", "value"])
+
+
+def update_user_stats(rows, sign=1):
+    """Add entries to the summaries of their users, or remove them, in the current transaction. Called by every
+    function writing to the history, before it commits
+
+    Args:
+        rows (Iterable[dict]): Entries added or removed, with at least the STATS_COLUMNS
+        sign (int, optional): 1 for added entries, -1 for removed ones. Defaults to 1.
+    """
+    totals = {}
+    for row in rows:
+        user_id = row["user_id"]
+        difference = row["difference"]
+        keys = [(user_id, None, None)] + [(user_id, name, row[name]) for name in BREAKDOWNS]
+        for key in keys:
+            current = totals.get(key)
+            if current is None:
+                current = totals[key] = [0, 0, 0.0, 0.0]
+            current[0] += sign
+            if difference is not None:
+                current[1] += sign
+                current[2] += sign * difference
+                current[3] += sign * abs(difference)
+    if not totals:
+        return
+    users, breakdowns = [], []
+    for (user_id, name, value), deltas in totals.items():
+        params = dict(zip(TOTALS, deltas), user_id=user_id)
+        if name is None:
+            users.append(params)
+        else:
+            params.update(breakdown=name, value=value)
+            breakdowns.append(params)
+    db.session.execute(_UPSERT_USER_STATS, users)
+    db.session.execute(_UPSERT_BREAKDOWN, breakdowns)
+    if sign < 0:
+        # A user or value without entries has no summary, as after a rebuild
+        user_ids = [params["user_id"] for params in users]
+        db.session.execute(delete(user_stats).where(user_stats.c.user_id.in_(user_ids), user_stats.c.entries <= 0))
+        db.session.execute(
+            delete(user_stats_breakdown).where(
+                user_stats_breakdown.c.user_id.in_(user_ids), user_stats_breakdown.c.entries <= 0
+            )
+        )
+
+
+def stats_row(entry):
+    """STATS_COLUMNS of an Entry, as passed to update_user_stats"""
+    return {column: getattr(entry, column) for column in STATS_COLUMNS}
+
+
+def _mean(total, count):
+    return None if count == 0 else total / count
+
+
+# Medians of the users' differences, keyed by (user_id, generation, count)
+median_cache = LRUCache(maxsize=app.config.get("MEDIAN_CACHE_SIZE", 4096))
+
+
+def median_difference(user_id, count):
+    """Median difference of a user's entries, read from the (user_id, difference) index the first time it is needed
+    for the current generation of the user's history
+
+    Args:
+        user_id (int): Id of the user
+        count (int): Number of the user's entries with a difference
+
+    Returns:
+        float: Median difference, or None if no entry has one
+    """
+    if count == 0:
+        return None
+    key = (user_id, history_version(user_id)[0], count)
+    median = median_cache.get(key)
+    if median is MISSING:
+        # SQLite steps through the index entries before the offset, so this grows with the history
+        history = _history()
+        values = db.session.execute(
+            select(history.c.difference)
+            .where(history.c.user_id == user_id, history.c.difference.isnot(None))
+            .order_by(history.c.difference)
+            .limit(2 - count % 2)
+            .offset((count - 1) // 2)
+        ).scalars().all()
+        median = sum(values) / len(values)
+        median_cache.set(key, median)
+    return median
+
+
+def count_entries(user_id):
+    """Number of entries of a user, read from user_stats instead of counting the history
+
+    Args:
+        user_id (int): Id of the user
+
+    Returns:
+        int: Number of entries
+    """
+    count = db.session.execute(select(user_stats.c.entries).where(user_stats.c.user_id == user_id)).scalar()
+    return count or 0
+
+
+def get_user_stats(user_id):
+    """Summary of a user's history
+
+    Args:
+        user_id (int): Id of the user
+
+    Returns:
+        dict: Number of entries, mean, mean absolute and median difference, and the number of entries and mean
+            difference for each neighborhood and room type of the history
+    """
+    row = db.session.execute(select(user_stats).where(user_stats.c.user_id == user_id)).first()
+    if row is None:
+        summary = {"entries": 0, "mean_difference": None, "mean_absolute_difference": None, "median_difference": None}
+        return dict(summary, **{name: {} for name in BREAKDOWNS})
+    summary = {
+        "entries": row.entries,
+        "mean_difference": _mean(row.difference_sum, row.difference_count),
+        "mean_absolute_difference": _mean(row.abs_difference_sum, row.difference_count),
+        "median_difference": median_difference(user_id, row.difference_count),
+    }
+    summary.update({name: {} for name in BREAKDOWNS})
+    breakdowns = db.session.execute(
+        select(user_stats_breakdown)
+        .where(user_stats_breakdown.c.user_id == user_id)
+        .order_by(user_stats_breakdown.c.entries.desc(), user_stats_breakdown.c.value)
+    )
+    for breakdown in breakdowns:
+        summary[breakdown.breakdown][breakdown.value] = {
+            "entries": breakdown.entries,
+            "mean_difference": _mean(breakdown.difference_sum, breakdown.difference_count),
+        }
+    return summary
+
+
+def _totals():
+    history = _history()
+    return [
+        func.count(),
+        func.count(history.c.difference),
+        func.coalesce(func.sum(history.c.difference), 0.0),
+        func.coalesce(func.sum(func.abs(history.c.difference)), 0.0),
+    ]
+
+
+def _expected(user_id=None):
+    """Selects computing the summaries of the history from scratch, for user_stats and each breakdown"""
+    history = _history()
+    condition = true() if user_id is None else history.c.user_id == user_id
+    selects = {
+        None: select(history.c.user_id, *_totals()).where(condition).group_by(history.c.user_id)
+    }
+    for name in BREAKDOWNS:
+        selects[name] = (
+            select(history.c.user_id, literal(name), history.c[name], *_totals())
+            .where(condition)
+            .group_by(history.c.user_id, history.c[name])
+        )
+    return selects
+
+
+def rebuild_user_stats(user_id=None):
+    """Recompute the summaries from the history, and commit. The users whose summaries may have changed move to a new
+    generation, so their cached history pages are rendered again
+
+    Args:
+        user_id (int, optional): Only rebuild the summary of this user. Defaults to None (every user).
+    """
+    for table in (user_stats, user_stats_breakdown):
+        statement = delete(table)
+        if user_id is not None:
+            statement = statement.where(table.c.user_id == user_id)
+        db.session.execute(statement)
+    for name, query in _expected(user_id).items():
+        if name is None:
+            db.session.execute(user_stats.insert().from_select(["user_id", *TOTALS], query))
+        else:
+            db.session.execute(
+                user_stats_breakdown.insert().from_select(["user_id", "breakdown", "value", *TOTALS], query)
+            )
+    if user_id is None:
+        user_ids = db.session.execute(select(user_stats.c.user_id).union(select(history_versions.c.user_id))).scalars()
+        bump_history_versions(list(user_ids))
+    else:
+        bump_history_versions([user_id])
+    db.session.commit()
+
+
+def check_user_stats(tolerance=1e-6):
+    """Compare the summaries with the history, without changing them
+
+    Args:
+        tolerance (float, optional): Relative difference allowed between sums, which are updated in floating point. Defaults to 1e-6.
+
+    Returns:
+        list[int]: Ids of the users whose summaries are out of date
+    """
+
+    def load(rows, width):
+        return {tuple(row[:width]): tuple(row[width:]) for row in rows}
+
+    stored = {None: select(user_stats)}
+    for name in BREAKDOWNS:
+        stored[name] = select(user_stats_breakdown).where(user_stats_breakdown.c.breakdown == name)
+    stale = set()
+    for name, query in _expected().items():
+        width = 1 if name is None else 3  # Columns identifying a row, before the totals
+        expected = load(db.session.execute(query), width)
+        found = load(db.session.execute(stored[name]), width)
+        for key in expected.keys() | found.keys():
+            if key not in expected or key not in found:
+                stale.add(key[0])
+            elif not all(
+                math.isclose(a, b, rel_tol=tolerance, abs_tol=tolerance) for a, b in zip(expected[key], found[key])
+            ):
+                stale.add(key[0])
+    return sorted(stale)
+
+
+def stats_missing():
+    """Whether the history has entries but no summary, as on a database created before the summaries existed"""
+    history = _history()
+    has_history = db.session.execute(select(history.c.id).limit(1)).first() is not None
+    has_stats = db.session.execute(select(user_stats.c.user_id).limit(1)).first() is not None
+    return has_history and not has_stats
+
+
+@app.cli.command("rebuild-stats")
+@click.option("--check", is_flag=True, help="Only report the users whose summaries are out of date")
+def rebuild_stats_command(check):
+    """Rebuild the per-user summaries of the history from scratch"""
+    stale = check_user_stats()
+    if check:
+        for user_id in stale:
+            click.echo(f"Summary of user {user_id} is out of date")
+        click.echo(f"{len(stale)} summaries out of date")
+        raise SystemExit(1 if stale else 0)
+    rebuild_user_stats()
+    click.echo(f"Rebuilt the summaries of every user ({len(stale)} were out of date)")
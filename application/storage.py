@@ -0,0 +1,68 @@
+"""
+SQLite storage profiles: the PRAGMAs set on every new connection, and the connection pool of the engine.
+
+The "default" profile leaves SQLite and SQLAlchemy as they are. The "production" profile switches the database to
+write-ahead logging, so that readers no longer block writers (and the other way round), waits for locks instead
+of failing with "database is locked", and keeps connections open in a pool so that their page cache survives
+between requests. Individual PRAGMAs can be overridden with SQLITE_PRAGMAS.
+"""
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+SQLITE_PROFILES = {
+    "default": {},
+    "production": {
+        "journal_mode": "WAL",
+        # In WAL mode, NORMAL only syncs at checkpoints: a power loss can roll back the last commits, but never corrupts the database
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,  # Milliseconds to wait for a lock before giving up
+        "cache_size": -64000,  # Negative sizes are in KiB, so 64MB of page cache per connection
+        "mmap_size": 268435456,  # Read the first 256MB of the database through memory-mapping
+        "temp_store": "MEMORY",
+    },
+}
+
+
+def sqlite_pragmas(config):
+    """PRAGMAs of the SQLITE_PROFILE selected in a config, with SQLITE_PRAGMAS applied over them
+
+    Raises:
+        ValueError: The profile does not exist
+    """
+    profile = config.get("SQLITE_PROFILE", "default")
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown SQLITE_PROFILE {profile!r}, should be one of {', '.join(SQLITE_PROFILES)}")
+    return {**SQLITE_PROFILES[profile], **config.get("SQLITE_PRAGMAS", {})}
+
+
+def configure_storage(app, db):
+    """Apply the storage profile of the app. Must be called before the database engine is first used
+
+    Args:
+        app (Flask): App, whose config selects the profile
+        db (SQLAlchemy): Database of the app
+    """
+    uri = app.config.get("SQLALCHEMY_DATABASE_URI", "")
+    if not uri.startswith("sqlite"):
+        return
+    pragmas = sqlite_pragmas(app.config)
+    in_memory = uri in ("sqlite://", "sqlite:///:memory:")
+    if app.config.get("SQLITE_PROFILE", "default") != "default" and not in_memory:
+        # pysqlite opens a new connection for every checkout of a file database by default. A pool keeps them open,
+        # along with their page cache and memory map; connections are handed between threads, but never shared
+        options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+        options.setdefault("poolclass", QueuePool)
+        options.setdefault("pool_size", app.config.get("SQLITE_POOL_SIZE", 8))
+        options.setdefault("max_overflow", app.config.get("SQLITE_POOL_OVERFLOW", 8))
+        options.setdefault("connect_args", {}).setdefault("check_same_thread", False)
+    if not pragmas:
+        return
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    with app.app_context():
+        event.listen(db.engine, "connect", set_pragmas)
@@ -0,0 +1,139 @@
+"""
+Signed, expiring bearer tokens for API clients, as an alternative to the session cookie set by /api/login.
+
+A token is issued by POST /api/tokens after one password check, and sent back as "Authorization: Bearer <token>".
+It holds the user id and a random token id, signed with the app's SECRET_KEY along with the time it was issued, so
+checking it is an HMAC and a timestamp comparison: no database query and no password hash. Tokens expire
+API_TOKEN_MAX_AGE seconds after they were issued.
+
+A token can be revoked before it expires. Revoked token ids are kept in an in-memory denylist until the token would
+have expired anyway, so the denylist stays small. It is kept per process: with several worker processes, a revoked
+token is only refused by the process that revoked it, and API_TOKEN_MAX_AGE bounds how long the others accept it.
+"""
+from application import app
+from application.metrics import metrics
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+import secrets
+import threading
+import time
+
+# Salt of the token signatures, so that tokens cannot be swapped with other values signed with SECRET_KEY
+TOKEN_SALT = "rentier-api-token"
+
+
+class InvalidToken(Exception):
+    """Raised when a bearer token is malformed, has a bad signature, has expired or was revoked"""
+
+
+class TokenDenylist:
+    """Ids of revoked tokens, each kept until the time the token expires"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._expiry = {}
+        self.revoked = 0
+
+    def add(self, token_id, expires_at):
+        """Revoke a token
+
+        Args:
+            token_id (str): Id of the token
+            expires_at (float): Time (as from time.time) after which the token is refused anyway
+        """
+        now = time.time()
+        with self._lock:
+            # Dropping the tokens that have expired since keeps the denylist to the tokens that are still valid
+            for expired in [key for key, expiry in self._expiry.items() if expiry <= now]:
+                del self._expiry[expired]
+            if expires_at > now:
+                self._expiry[token_id] = expires_at
+            self.revoked += 1
+
+    def __contains__(self, token_id):
+        expiry = self._expiry.get(token_id)
+        return expiry is not None and expiry > time.time()
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def clear(self):
+        with self._lock:
+            self._expiry.clear()
+
+
+denylist = TokenDenylist()
+
+
+def _serializer():
+    return URLSafeTimedSerializer(app.config["SECRET_KEY"], salt=TOKEN_SALT)
+
+
+def max_age():
+    """Lifetime of a token, in seconds"""
+    return app.config.get("API_TOKEN_MAX_AGE", 3600)
+
+
+def issue_token(user_id):
+    """Sign a new token for a user
+
+    Args:
+        user_id (int): Id of the user
+
+    Returns:
+        str: Token, to be sent in the Authorization header
+    """
+    return _serializer().dumps({"user_id": user_id, "token_id": secrets.token_urlsafe(12)})
+
+
+def load_token(token):
+    """Check a token's signature, age and revocation
+
+    Raises:
+        InvalidToken: The token cannot be used
+
+    Returns:
+        dict: Payload of the token, with its user_id and token_id, and the time it expires at (expires_at)
+    """
+    try:
+        payload, issued = _serializer().loads(token, max_age=max_age(), return_timestamp=True)
+    except SignatureExpired:
+        raise InvalidToken("Token has expired")
+    except BadSignature:
+        raise InvalidToken("Token is invalid")
+    if type(payload) is not dict or "user_id" not in payload or "token_id" not in payload:
+        raise InvalidToken("Token is invalid")
+    if payload["token_id"] in denylist:
+        raise InvalidToken("Token has been revoked")
+    return dict(payload, expires_at=issued.timestamp() + max_age())
+
+
+def revoke_token(payload):
+    """Refuse a token from now on
+
+    Args:
+        payload (dict): Payload of the token, as returned by load_token
+    """
+    denylist.add(payload["token_id"], payload["expires_at"])
+
+
+def bearer_token(headers):
+    """Token of an "Authorization: Bearer <token>" header
+
+    Returns:
+        str: Token, or None if the request has no bearer token
+    """
+    scheme, _, token = headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    return token.strip()
+
+
+def collect_token_metrics():
+    """Size of the denylist and number of revoked tokens, exported by /metrics"""
+    return [
+        ("rentier_api_tokens_revoked_total", "counter", "API tokens revoked", {}, denylist.revoked),
+        ("rentier_api_token_denylist_size", "gauge", "Revoked API tokens that have not expired yet", {}, len(denylist)),
+    ]
+
+
+metrics.register_collector(collect_token_metrics)
@@ -1,9 +1,11 @@
 from functools import wraps
-from flask import redirect, request, url_for, session, flash
+from flask import g, redirect, request, url_for, session, flash
 from application import app
+from application.tokens import InvalidToken, bearer_token, load_token
 
 def login_required(func):
     """Flask decorator to check if a user is logged in, else, redirect them to login page, which will direct them back to the original page once logged in. Checks if the secured session cookie contains a user id.
+    Requests with a bearer token (see application/tokens.py) are checked against the token instead, and get a 401 if it cannot be used.
 
     Args:
         func (Callable): Function to be decorated (usually an endpoint)
@@ -14,6 +16,14 @@ def login_required(func):
 
     @wraps(func)
     def decorated_func(*args, **kwargs):
+        token = bearer_token(request.headers)
+        if token is not None:
+            if "token" not in g:  # Unless already loaded for the rate limits
+                try:
+                    g.token = load_token(token)
+                except InvalidToken as error:
+                    raise API_Error(str(error), 401)
+            return func(*args, **kwargs)
         if session.get("user_id") is None:  # Check if user is logged in
             flash("Please login first!", "warning")
             session["next"] = request.url
@@ -22,11 +32,42 @@ def login_required(func):
 
     return decorated_func
 
+def current_user_id():
+    """Id of the logged in user: the user of the request's bearer token if it has one, else the user of the session
+
+    Returns:
+        int: Id of the user, or None if nobody is logged in
+    """
+    token = g.get("token")
+    if token is not None:
+        return token["user_id"]
+    return session.get("user_id")
+
+
+def request_user_id():
+    """Id of the user making the request, before login_required has run: the user of a valid bearer token, else the
+    user of the session. Loads the token into g.token, as login_required would
+
+    Returns:
+        int: Id of the user, or None if the request is anonymous or its token cannot be used
+    """
+    token = bearer_token(request.headers)
+    if token is None:
+        return session.get("user_id")
+    try:
+        g.token = load_token(token)
+    except InvalidToken:
+        return None
+    return g.token["user_id"]
+
+
 class API_Error(Exception):
-    def __init__(self, message, status_code=400):
+    def __init__(self, message, status_code=400, fields=None, headers=None):
         super().__init__()
         self.message = message
         self.status_code = status_code
+        self.fields = fields  # Error of each invalid field, for validation errors
+        self.headers = headers
 
 @app.template_filter("render_date")
 def render_date(date, format="%H:%M / %d-%m-%Y"):
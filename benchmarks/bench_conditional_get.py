@@ -0,0 +1,54 @@
+"""
+Times polling GET /api/history/<id> (the first --per-page entries, as a dashboard would) for users with --rows
+entries, downloading the page every time (full) and revalidating it with the ETag of the previous response (etag),
+which is answered with a 304 while the history is unchanged. Also reports the size of the body a full poll sends.
+"""
+from benchmarks.bench_endpoints import make_entries, write_config
+from benchmarks.common import measure, parser, report, use_config
+import datetime as dt
+import tempfile
+
+
+def main():
+    args = parser(__doc__)
+    args.add_argument("--rows", type=int, nargs="+", default=[1000, 100000], help="Number of entries of each user")
+    args.add_argument("--per-page", type=int, default=100, help="Entries per polled page")
+    args.set_defaults(repeat=200, warmup=10)
+    args = args.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_config(write_config(directory))
+        from application import app, db
+        from application.models import Entry, User
+        from application.stats import rebuild_user_stats
+
+        client = app.test_client()
+        results = {}
+        for n_rows in args.rows:
+            user = User(email=f"poll{n_rows}@example.com", password_hash="x" * 64, created=dt.datetime.utcnow())
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+            db.session.execute(Entry.__table__.insert(), list(make_entries(user_id, n_rows, seed=n_rows)))
+            db.session.commit()
+            rebuild_user_stats(user_id)  # Also moves the user to a new generation, as a write would
+            with client.session_transaction() as sess:
+                sess["user_id"] = user_id
+            url = f"/api/history/{user_id}?per_page={args.per_page}"
+            first = client.get(url)
+            etag = first.headers["ETag"]
+
+            def poll(headers, status):
+                response = client.get(url, headers=headers)
+                assert response.status_code == status
+
+            results[n_rows] = {
+                "body_bytes": len(first.get_data()),
+                "full": measure(lambda: poll({}, 200), args.repeat, args.warmup),
+                "etag": measure(lambda: poll({"If-None-Match": etag}, 304), args.repeat, args.warmup),
+            }
+    report("conditional_get", {"per_page": args.per_page, **results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
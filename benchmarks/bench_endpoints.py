@@ -0,0 +1,207 @@
+"""
+Measures the latency and throughput of the hot endpoints through the Flask test client, against an isolated
+SQLite database file populated with users of different history sizes.
+
+Endpoints that do not depend on the history (/api/predict, /predict, /api/login) are measured once. The history
+endpoints (/history, /api/history/<id> GET and POST) are measured for a user of each of the --history-sizes.
+"""
+from benchmarks.common import measure, parser, report, use_config
+import datetime as dt
+import json
+import os
+import random
+import tempfile
+import time
+
+PASSWORD = "Benchmark1234!"
+
+LISTING = {
+    "beds": 1,
+    "bathrooms": 1,
+    "accomodates": 2,
+    "minimum_nights": 3,
+    "room_type": "Private room",
+    "neighborhood": "Novena",
+    "wifi": True,
+    "elevator": False,
+    "pool": False,
+    "actual_price": 115,
+}
+
+
+def write_config(directory, **settings):
+    """Config using a database file in directory, along with any extra settings"""
+    path = os.path.join(directory, "bench_endpoints.cfg")
+    with open(path, "w") as f:
+        f.write('SECRET_KEY = "benchmark"\n')
+        f.write(f'SQLALCHEMY_DATABASE_URI = "sqlite:///{os.path.join(directory, "bench.db")}"\n')
+        f.write("SQLALCHEMY_TRACK_MODIFICATIONS = False\n")
+        f.write("WTF_CSRF_ENABLED = False\n")
+        for key, value in settings.items():
+            f.write(f"{key} = {value!r}\n")
+    return path
+
+
+def make_entries(user_id, n_rows, seed=0):
+    """Random history entries for a user, spread over the past year"""
+    from application import NEIGHBORHOODS, ROOM_TYPES
+
+    rng = random.Random(seed)
+    room_types = sorted(ROOM_TYPES)
+    now = dt.datetime.utcnow()
+    for idx in range(n_rows):
+        beds = rng.randint(0, 6)
+        prediction = rng.uniform(30, 500)
+        actual_price = rng.choice([None, rng.uniform(30, 500)])
+        yield {
+            "user_id": user_id,
+            "beds": beds,
+            "bathrooms": rng.choice([0.5, 1.0, 1.5, 2.0, 3.0]),
+            "accomodates": beds + rng.randint(0, 4),
+            "minimum_nights": rng.randint(1, 90),
+            "room_type": rng.choice(room_types),
+            "neighborhood": rng.choice(NEIGHBORHOODS),
+            "wifi": rng.random() < 0.9,
+            "elevator": rng.random() < 0.5,
+            "pool": rng.random() < 0.2,
+            "actual_price": actual_price,
+            "link": f"https://www.airbnb.com/rooms/{idx}",
+            "prediction": prediction,
+            "difference": None if actual_price is None else actual_price - prediction,
+            "created": now - dt.timedelta(seconds=idx * 30),
+            "model_version": None,
+        }
+
+
+def populate(history_sizes, chunk_size=50000):
+    """Create the login user, and one user per history size
+
+    Returns:
+        tuple: Id of the login user, and {history size: user id}
+    """
+    from application import db
+    from application.models import Entry, User
+    from werkzeug.security import generate_password_hash
+
+    def add_user(email, password):
+        user = User(email=email, password_hash=generate_password_hash(password), created=dt.datetime.utcnow())
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+    login_id = add_user("login@example.com", PASSWORD)
+    users = {}
+    for size in history_sizes:
+        user_id = add_user(f"history_{size}@example.com", PASSWORD)
+        start = time.perf_counter()
+        chunk = []
+        for row in make_entries(user_id, size, seed=size):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                db.session.execute(Entry.__table__.insert(), chunk)
+                chunk = []
+        if chunk:
+            db.session.execute(Entry.__table__.insert(), chunk)
+        db.session.commit()
+        print(f"Inserted {size} entries in {time.perf_counter() - start:.1f}s", flush=True)
+        users[size] = user_id
+    return login_id, users
+
+
+def login(client, user_id):
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+
+
+def check(response, status=200):
+    if response.status_code != status:
+        raise RuntimeError(f"Expected {status}, got {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+
+def bench_predictions(client, repeat, warmup):
+    from application.inference import prediction_cache
+
+    body = json.dumps(LISTING)
+
+    def api_predict():
+        check(client.post("/api/predict", data=body, content_type="application/json"))
+
+    def api_predict_uncached():
+        prediction_cache.clear()
+        api_predict()
+
+    form = {key: value for key, value in LISTING.items() if value is not False}
+    form.update({"link": "https://www.airbnb.com/rooms/1", "wifi": "y"})
+
+    def predict_form():
+        check(client.post("/predict", data=form))
+
+    return {
+        "api_predict_cached": measure(api_predict, repeat, warmup),
+        "api_predict_uncached": measure(api_predict_uncached, repeat, warmup),
+        "predict_form": measure(predict_form, repeat, warmup),
+    }
+
+
+def bench_login(client, repeat, warmup):
+    body = json.dumps({"email": "login@example.com", "password": PASSWORD, "remember_me": False})
+
+    def api_login():
+        check(client.post("/api/login", data=body, content_type="application/json"))
+
+    return {"api_login": measure(api_login, repeat, warmup)}
+
+
+def bench_history(client, user_id, size, repeat, warmup):
+    from application import app
+
+    login(client, user_id)
+    per_page = app.config.get("HISTORY_API_PER_PAGE", 100)
+    entry = dict(LISTING, link="https://www.airbnb.com/rooms/1", prediction=100.0, difference=15.0)
+    body = json.dumps(entry)
+    return {
+        "history_page": measure(lambda: check(client.get("/history")), repeat, warmup),
+        "history_page_sorted": measure(
+            lambda: check(client.get("/history?col_sort=prediction&dir=asc&per_page=20")), repeat, warmup
+        ),
+        "api_history_get": measure(
+            lambda: check(client.get(f"/api/history/{user_id}")), repeat, warmup, items=min(size, per_page)
+        ),
+        "api_history_post": measure(
+            lambda: check(client.post(f"/api/history/{user_id}", data=body, content_type="application/json")),
+            repeat,
+            warmup,
+        ),
+    }
+
+
+def main():
+    args = parser(__doc__)
+    args.add_argument(
+        "--history-sizes", type=int, nargs="+", default=[1000, 100000, 1000000], help="Number of history entries per user"
+    )
+    args.add_argument("--login-repeat", type=int, default=20, help="Number of timed logins, as password hashing is slow")
+    args.add_argument("--history-write-mode", choices=["sync", "async"], default="sync", help="HISTORY_WRITE_MODE of /predict")
+    args = args.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_config(write_config(directory, HISTORY_WRITE_MODE=args.history_write_mode))
+        from application import app
+
+        login_id, users = populate(args.history_sizes)
+        client = app.test_client()
+        results = bench_login(client, args.login_repeat, min(args.warmup, 2))
+        login(client, login_id)
+        results.update(bench_predictions(client, args.repeat, args.warmup))
+        for size, user_id in users.items():
+            results[f"history_{size}"] = bench_history(client, user_id, size, args.repeat, args.warmup)
+    report(
+        "endpoints",
+        {"history_sizes": args.history_sizes, "history_write_mode": args.history_write_mode, **results},
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
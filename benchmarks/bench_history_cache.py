@@ -0,0 +1,65 @@
+"""
+Times GET /history for users with --rows entries, with every page rendered from the history (uncached: the fragment
+cache disabled, as before application/history_cache.py) and with the rendered table served from the fragment cache
+(cached), for each of --per-page. Also times a view right after a write to the user's history (after_write), which
+has to render the page again.
+"""
+from benchmarks.bench_endpoints import make_entries, write_config
+from benchmarks.common import measure, parser, report, use_config
+import datetime as dt
+import tempfile
+
+
+def main():
+    args = parser(__doc__)
+    args.add_argument("--rows", type=int, nargs="+", default=[1000, 100000], help="Number of entries of each user")
+    args.add_argument("--per-page", type=int, nargs="+", default=[5, 40], help="Entries per page")
+    args.set_defaults(repeat=200, warmup=10)
+    args = args.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_config(write_config(directory))
+        from application import app, db
+        from application.history_cache import fragment_cache
+        from application.models import Entry, User, add_entry
+        from application.stats import rebuild_user_stats
+
+        client = app.test_client()
+        maxsize = fragment_cache.maxsize
+        results = {}
+        for n_rows in args.rows:
+            user = User(email=f"cache{n_rows}@example.com", password_hash="x" * 64, created=dt.datetime.utcnow())
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+            db.session.execute(Entry.__table__.insert(), list(make_entries(user_id, n_rows, seed=n_rows)))
+            db.session.commit()
+            rebuild_user_stats(user_id)
+            with client.session_transaction() as sess:
+                sess["user_id"] = user_id
+            entry = next(make_entries(user_id, 1))
+
+            def view(url):
+                response = client.get(url)
+                assert response.status_code == 200
+
+            def write_and_view(url):
+                add_entry(Entry(**entry))
+                view(url)
+
+            results[n_rows] = {}
+            for per_page in args.per_page:
+                url = f"/history?per_page={per_page}"
+                fragment_cache.maxsize = 0
+                uncached = measure(lambda: view(url), args.repeat, args.warmup)
+                fragment_cache.maxsize = maxsize
+                results[n_rows][per_page] = {
+                    "uncached": uncached,
+                    "cached": measure(lambda: view(url), args.repeat, args.warmup),
+                    "after_write": measure(lambda: write_and_view(url), args.repeat, args.warmup),
+                }
+    report("history_cache", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Compares the memory and latency of exporting a user's whole history by loading it into one json document
+(as /api/history/<id> did before it was paginated) against the streaming /api/history/<id>/export endpoint.
+
+Memory is the peak traced by tracemalloc while the export is produced and consumed, so it only counts Python
+allocations, not SQLite's page cache.
+"""
+from benchmarks.bench_endpoints import make_entries, write_config
+from benchmarks.common import parser, report, use_config
+import datetime as dt
+import tempfile
+import time
+import tracemalloc
+
+
+def consume(export):
+    """Consume an export, returning its time to first byte, total time and size"""
+    start = time.perf_counter()
+    first_byte = None
+    size = 0
+    for chunk in export():
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        size += len(chunk)
+    return first_byte, time.perf_counter() - start, size
+
+
+def profile(export):
+    """Time to first byte, total time and peak traced memory of an export. Memory is measured in a separate run, as tracing slows everything down
+
+    Args:
+        export (Callable): Function returning an iterable of chunks
+    """
+    first_byte, total, size = consume(export)
+    tracemalloc.start()
+    consume(export)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "first_byte_ms": first_byte * 1e3,
+        "total_ms": total * 1e3,
+        "peak_mb": peak / 2 ** 20,
+        "bytes": size,
+    }
+
+
+def main():
+    args = parser(__doc__)
+    args.add_argument("--history-sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = args.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_config(write_config(directory))
+        from application import app, db
+        from application.models import Entry, User, get_history
+        from flask import json
+
+        client = app.test_client()
+        results = {}
+        for size in args.history_sizes:
+            user = User(email=f"export{size}@example.com", password_hash="x" * 64, created=dt.datetime.utcnow())
+            db.session.add(user)
+            db.session.commit()
+            db.session.execute(Entry.__table__.insert(), list(make_entries(user.id, size, seed=size)))
+            db.session.commit()
+            with client.session_transaction() as session:
+                session["user_id"] = user.id
+
+            def load_all():
+                # What /api/history/<id> used to do: load every entry, then build one json document
+                with app.test_request_context():
+                    entries = get_history(user.id)
+                    columns = Entry.__table__.columns.keys()
+                    body = json.dumps([{column: getattr(entry, column) for column in columns} for entry in entries])
+                    db.session.expunge_all()
+                return [body]
+
+            def stream(export_format):
+                return lambda: client.get(
+                    f"/api/history/{user.id}/export?format={export_format}", buffered=False
+                ).response
+
+            results[size] = {
+                "load_all_json": profile(load_all),
+                "stream_ndjson": profile(stream("ndjson")),
+                "stream_csv": profile(stream("csv")),
+            }
+    report("history_export", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
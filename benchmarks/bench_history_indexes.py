@@ -0,0 +1,136 @@
+"""
+Shows the query plans and timings of get_history before and after the (user_id, column) indexes of the history table.
+
+Populates a temporary SQLite database file with --users users of --rows entries each, drops the history indexes to
+get the old schema, then creates them again through migrations.upgrade_database, as on an existing database.
+Also times inserting and deleting batches of --batch-size entries with no history index, with the indexes of the
+models (models.SORTABLE_COLUMNS), and with an index on every column of the history, as when the history could be sorted by
+any column, to show what each index costs writes.
+"""
+from benchmarks.bench_endpoints import make_entries, write_config
+from benchmarks.common import measure, parser, report, summarize, use_config
+import datetime as dt
+import tempfile
+import time
+
+
+def query_plan(db, query):
+    """SQLite's plan for a query, one step per line"""
+    from sqlalchemy import text
+
+    sql = str(query.statement.compile(db.engine, compile_kwargs={"literal_binds": True}))
+    return [row[-1] for row in db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+
+
+def bench_queries(db, user_id, columns, repeat, warmup):
+    from application.models import Entry, get_history
+    from sqlalchemy.sql.expression import column
+
+    results = {}
+    for col_sort in columns:
+        query = (
+            db.session.query(Entry)
+            .filter_by(user_id=user_id)
+            .order_by(column(col_sort).desc())
+            .limit(5)
+        )
+        results[col_sort] = {
+            "plan": query_plan(db, query),
+            "first_page": measure(lambda: get_history(user_id, 1, 5, col_sort, True), repeat, warmup),
+            "last_page": measure(
+                lambda: get_history(user_id, 10, 5, col_sort, False), repeat, warmup
+            ),
+        }
+    return results
+
+
+def bench_writes(db, user_id, batch_size, repeat, warmup):
+    """Time inserting a batch of entries and deleting it again, with the indexes currently on the history"""
+    from application.models import Entry
+
+    table = Entry.__table__
+    batch = list(make_entries(user_id, batch_size, seed=batch_size))
+
+    def insert():
+        db.session.execute(table.insert(), batch)
+        db.session.commit()
+
+    def delete():
+        db.session.execute(table.delete().where(table.c.id > last_id))
+        db.session.commit()
+
+    last_id = db.session.execute(db.select(db.func.max(table.c.id))).scalar()
+    inserts, deletes = [], []
+    for idx in range(warmup + repeat):
+        start = time.perf_counter()
+        insert()
+        inserted = time.perf_counter()
+        delete()
+        if idx >= warmup:
+            inserts.append(inserted - start)
+            deletes.append(time.perf_counter() - inserted)
+    return {"insert": summarize(inserts, batch_size), "delete": summarize(deletes, batch_size)}
+
+
+def main():
+    args = parser(__doc__)
+    args.add_argument("--users", type=int, default=4, help="Number of users sharing the history table")
+    args.add_argument("--rows", type=int, default=100000, help="Number of history entries per user")
+    args.add_argument(
+        "--columns", nargs="+", default=["created", "prediction", "neighborhood"], help="Columns to sort the history by, including one the app does not sort by, to show a sort without an index"
+    )
+    args.add_argument("--batch-size", type=int, default=100, help="Number of entries per inserted and deleted batch")
+    args = args.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_config(write_config(directory))
+        from application import db
+        from application.migrations import upgrade_database
+        from application.models import Entry, User
+        from sqlalchemy import text
+
+        for idx in range(args.users):
+            user = User(email=f"user{idx}@example.com", password_hash="x" * 64, created=dt.datetime.utcnow())
+            db.session.add(user)
+            db.session.commit()
+            db.session.execute(Entry.__table__.insert(), list(make_entries(user.id, args.rows, seed=idx)))
+            db.session.commit()
+        user_id = user.id
+
+        # Back to the schema without indexes, as in a database created before they were added
+        for index in Entry.__table__.indexes:
+            db.session.execute(text(f'DROP INDEX IF EXISTS "{index.name}"'))
+        db.session.commit()
+        db.session.execute(text("ANALYZE"))
+        before = bench_queries(db, user_id, args.columns, args.repeat, args.warmup)
+        writes = {"no_index": bench_writes(db, user_id, args.batch_size, args.repeat, args.warmup)}
+
+        created = upgrade_database()
+        db.session.execute(text("ANALYZE"))
+        after = bench_queries(db, user_id, args.columns, args.repeat, args.warmup)
+        writes["indexed_columns"] = bench_writes(db, user_id, args.batch_size, args.repeat, args.warmup)
+
+        # An index on every column, as the history had when it could be sorted by any of them
+        for column in [column.name for column in Entry.__table__.columns if column.name not in ("id", "user_id")]:
+            db.session.execute(
+                text(f'CREATE INDEX IF NOT EXISTS "ix_history_user_id_{column}" ON history (user_id, "{column}")')
+            )
+        db.session.commit()
+        writes["every_column"] = bench_writes(db, user_id, args.batch_size, args.repeat, args.warmup)
+
+    report(
+        "history_indexes",
+        {
+            "users": args.users,
+            "rows_per_user": args.rows,
+            "indexes_created": created,
+            "before": before,
+            "after": after,
+            "writes": writes,
+        },
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
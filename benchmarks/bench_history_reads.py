@@ -0,0 +1,81 @@
+"""
+Compares reading history entries as ORM objects (Entry) against reading them as rows through SQLAlchemy Core
+(models.history_select), in rows per second, for the two ways the history is used:
+- api: every column, copied into the dicts returned by /api/history/<id>
+- page: the columns shown by history.html, each read once as the template does
+
+Every case reads the first --rows entries of a user with that many entries, in the order of the history page.
+"""
+from benchmarks.bench_endpoints import make_entries, write_config
+from benchmarks.common import measure, parser, report, use_config
+import datetime as dt
+import tempfile
+
+
+def main():
+    args = parser(__doc__)
+    args.add_argument("--rows", type=int, nargs="+", default=[10000, 100000], help="Number of entries read per call")
+    args.set_defaults(repeat=10, warmup=2)
+    args = args.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_config(write_config(directory))
+        from application import db
+        from application.models import Entry, User, history_select
+        from application.routes import HISTORY_PAGE_COLUMNS
+
+        columns = Entry.__table__.columns.keys()
+        keys = ["entry_id" if key == "id" else key for key in columns]
+        results = {}
+        for n_rows in args.rows:
+            user = User(email=f"reads{n_rows}@example.com", password_hash="x" * 64, created=dt.datetime.utcnow())
+            db.session.add(user)
+            db.session.commit()
+            db.session.execute(Entry.__table__.insert(), list(make_entries(user.id, n_rows, seed=n_rows)))
+            db.session.commit()
+
+            def orm_entries():
+                entries = (
+                    db.session.query(Entry).filter_by(user_id=user.id).order_by(Entry.created.desc()).limit(n_rows).all()
+                )
+                db.session.expunge_all()  # As the session is cleared at the end of each request
+                return entries
+
+            def core_rows(columns=None):
+                return db.session.execute(
+                    history_select(user.id, columns).order_by(Entry.created.desc()).limit(n_rows)
+                ).fetchall()
+
+            def orm_api():
+                return [
+                    {key: getattr(entry, column) for key, column in zip(keys, columns)} for entry in orm_entries()
+                ]
+
+            def core_api():
+                return [dict(zip(keys, row)) for row in core_rows()]
+
+            def orm_page():
+                for entry in orm_entries():
+                    for column in HISTORY_PAGE_COLUMNS:
+                        getattr(entry, column)
+
+            def core_page():
+                for row in core_rows(HISTORY_PAGE_COLUMNS):
+                    for column in HISTORY_PAGE_COLUMNS:
+                        getattr(row, column)
+
+            assert orm_api() == core_api()
+            results[n_rows] = {
+                name: measure(func, args.repeat, args.warmup, items=n_rows)
+                for name, func in (
+                    ("orm_api", orm_api),
+                    ("core_api", core_api),
+                    ("orm_page", orm_page),
+                    ("core_page", core_page),
+                )
+            }
+    report("history_reads", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
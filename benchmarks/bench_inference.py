@@ -0,0 +1,66 @@
+"""
+Compares the inference paths of the model, for batch sizes from a single listing to large batches:
+- pipeline: ai_model.predict on a DataFrame (the original path)
+- encoder+sklearn: FeatureEncoder inputs, predicted by the sklearn forest
+- encoder+flat: FeatureEncoder inputs, predicted by the FlatForest
+"""
+from benchmarks.common import use_config, parser, measure, report
+
+use_config()
+
+from application import ai_model, NEIGHBORHOODS, ROOM_TYPES  # noqa: E402
+from application.encoder import FeatureEncoder  # noqa: E402
+from application.forest import FlatForest  # noqa: E402
+from application.inference import FEATURE_COLUMNS, make_model_input  # noqa: E402
+import numpy as np  # noqa: E402
+
+
+def make_rows(n, seed=0):
+    rng = np.random.RandomState(seed)
+    room_types = sorted(ROOM_TYPES)
+    return [
+        {
+            "beds": int(rng.randint(0, 6)),
+            "bathrooms": float(rng.choice([0.5, 1, 1.5, 2, 3])),
+            "accomodates": int(rng.randint(1, 10)),
+            "minimum_nights": int(rng.choice([1, 2, 3, 7, 30, 90])),
+            "room_type": room_types[rng.randint(len(room_types))],
+            "neighborhood": NEIGHBORHOODS[rng.randint(len(NEIGHBORHOODS))],
+            "wifi": bool(rng.rand() > 0.2),
+            "elevator": bool(rng.rand() > 0.5),
+            "pool": bool(rng.rand() > 0.7),
+        }
+        for _ in range(n)
+    ]
+
+
+def main():
+    args = parser(__doc__)
+    args.add_argument("--sizes", type=int, nargs="+", default=[1, 16, 64, 256, 1024])
+    args = args.parse_args()
+
+    encoder = FeatureEncoder.from_pipeline(ai_model[:-1], FEATURE_COLUMNS)
+    forest = FlatForest.from_model(ai_model)
+    results = []
+    for size in args.sizes:
+        rows = make_rows(size)
+        X = encoder.transform(rows)
+        assert np.array_equal(forest.predict(X), ai_model.predict(make_model_input(rows)))
+        repeat = max(5, args.repeat // max(1, size // 64))
+        cases = {
+            "pipeline": lambda: ai_model.predict(make_model_input(rows)),
+            "encoder+sklearn": lambda: ai_model[-1].predict(encoder.transform(rows)),
+            "encoder+flat": lambda: forest.predict(encoder.transform(rows)),
+        }
+        for name, func in cases.items():
+            result = measure(func, repeat=repeat, warmup=args.warmup, items=size)
+            results.append({"case": name, "batch_size": size, **result})
+    report(
+        "inference",
+        {"trees": forest.n_trees, "nodes": len(forest.value), "cases": results},
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Compares worker startup time and memory when every worker unpickles its own copy of the model (joblib)
+against workers memory-mapping the forest from the model's sidecar (mmap, MODEL_MMAP = True).
+
+Starts --workers processes per mode, each importing `application` like a web worker would, and keeps them
+all alive while measuring their memory. PSS (proportional set size) splits shared pages between the
+processes mapping them, so its total is the real memory cost of the workers. Linux only.
+"""
+from benchmarks.common import parser, report
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import application
+boot = time.perf_counter() - start
+from application.model_store import load_model
+start = time.perf_counter()
+load_model(application.model_path, mmap=application.app.config.get("MODEL_MMAP", False))
+reload = time.perf_counter() - start
+
+def memory():
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[1].isdigit():
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {"rss_mb": fields.get("Rss"), "pss_mb": fields.get("Pss")}
+
+print(json.dumps({"boot_s": boot, "reload_s": reload, **memory()}), flush=True)
+sys.stdin.readline()  # Wait until every worker has loaded, so that shared pages are counted once
+print(json.dumps(memory()), flush=True)
+"""
+
+
+def write_config(directory, mmap):
+    path = os.path.join(directory, f"bench_{'mmap' if mmap else 'joblib'}.cfg")
+    with open(path, "w") as f:
+        f.write('SECRET_KEY = "benchmark"\n')
+        f.write('SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"\n')
+        f.write("SQLALCHEMY_TRACK_MODIFICATIONS = False\n")
+        f.write(f"MODEL_MMAP = {mmap}\n")
+    return path
+
+
+def read_result(worker):
+    # Skip anything the app prints while starting up
+    for line in worker.stdout:
+        if line.startswith("{"):
+            return json.loads(line)
+    raise RuntimeError("Worker exited without reporting its results")
+
+
+def run_workers(config, n_workers):
+    env = dict(os.environ, TESTING=config)
+    env.pop("DEVELOPMENT", None)
+    workers = [
+        subprocess.Popen(
+            [sys.executable, "-c", CHILD],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            env=env,
+        )
+        for _ in range(n_workers)
+    ]
+    loaded = [read_result(worker) for worker in workers]
+    for worker in workers:
+        worker.stdin.write("\n")
+        worker.stdin.flush()
+    measured = [read_result(worker) for worker in workers]
+    for worker in workers:
+        worker.wait()
+    return {
+        "workers": n_workers,
+        "boot_s_mean": statistics.mean(w["boot_s"] for w in loaded),
+        "model_reload_s_mean": statistics.mean(w["reload_s"] for w in loaded),
+        "rss_mb_total": sum(w["rss_mb"] for w in measured),
+        "pss_mb_total": sum(w["pss_mb"] for w in measured),
+        "pss_mb_per_worker": statistics.mean(w["pss_mb"] for w in measured),
+    }
+
+
+def main():
+    args = parser(__doc__)
+    args.add_argument("--workers", type=int, default=4)
+    args = args.parse_args()
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for mode, mmap in (("joblib", False), ("mmap", True)):
+            config = write_config(directory, mmap)
+            run_workers(config, 1)  # Warm up the page cache, and export the sidecar if needed
+            results[mode] = run_workers(config, args.workers)
+    report("model_loading", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Measures logins and predictions served at the same time, to show how password hashing competes with inference.
+
+For --duration seconds, --login-threads threads log in through /api/login while --predict-threads threads post
+uncached listings to /api/predict, each thread with a test client of its own, against a database file. This runs
+once with predictions alone, then once per --workers: 0 hashes passwords in the request threads (as before the
+hashing pool), and any other number of workers hashes them in a pool of that many threads (application/passwords.py).
+Reports the latency percentiles and throughput of logins and predictions, and the logins rejected by a full pool.
+"""
+from benchmarks.bench_endpoints import LISTING, PASSWORD, write_config
+from benchmarks.common import parser, report, summarize, use_config
+import datetime as dt
+import itertools
+import json
+import tempfile
+import threading
+import time
+
+
+def run(app, login_threads, predict_threads, duration):
+    """Run the login and prediction threads for duration seconds
+
+    Returns:
+        dict: Summaries of the login and prediction latencies, and the number of rejected logins
+    """
+    timings = {"login": [], "predict": []}
+    rejected = []
+    stop = threading.Event()
+    # Every listing is new, so that predictions are not served from the cache
+    nights = itertools.count(1000)
+    login_body = json.dumps({"email": "login@example.com", "password": PASSWORD, "remember_me": False})
+
+    def log_in():
+        client = app.test_client()
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = client.post("/api/login", data=login_body, content_type="application/json")
+            if response.status_code == 503:
+                rejected.append(1)
+                continue
+            assert response.status_code == 200, response.get_data(as_text=True)
+            timings["login"].append(time.perf_counter() - start)
+
+    def predict():
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["user_id"] = 1
+        while not stop.is_set():
+            body = json.dumps(dict(LISTING, minimum_nights=next(nights)))
+            start = time.perf_counter()
+            response = client.post("/api/predict", data=body, content_type="application/json")
+            assert response.status_code == 200, response.get_data(as_text=True)
+            timings["predict"].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=log_in) for _ in range(login_threads)]
+    threads += [threading.Thread(target=predict) for _ in range(predict_threads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    results = {kind: summarize(values) for kind, values in timings.items() if values}
+    # Throughput over the whole run, rather than per thread
+    for kind, values in timings.items():
+        if values:
+            results[kind]["throughput"] = len(values) / duration
+    results["rejected_logins"] = len(rejected)
+    return results
+
+
+def main():
+    args = parser(__doc__)
+    args.add_argument("--duration", type=float, default=10.0, help="Seconds each case runs for")
+    args.add_argument("--login-threads", type=int, default=8, help="Number of threads logging in")
+    args.add_argument("--predict-threads", type=int, default=2, help="Number of threads posting predictions")
+    args.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2], help="Sizes of the hashing pool to compare, 0 for no pool")
+    args.add_argument("--method", default="pbkdf2:sha256:260000", help="PASSWORD_HASH_METHOD")
+    args = args.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_config(write_config(directory, PASSWORD_HASH_METHOD=args.method))
+        from application import app, db
+        from application.models import User
+        import application.passwords as passwords
+        import application.routes as routes
+
+        hasher = passwords.PasswordHasher(method=args.method, workers=0)
+        db.session.add(User(email="login@example.com", password_hash=hasher.hash(PASSWORD), created=dt.datetime.utcnow()))
+        db.session.commit()
+
+        run(app, 0, args.predict_threads, min(args.duration, 2.0))  # Warm up, e.g. the model
+        results = {"predictions_only": run(app, 0, args.predict_threads, args.duration)}
+        for workers in args.workers:
+            routes.password_hasher = passwords.PasswordHasher(method=args.method, workers=workers)
+            try:
+                results[f"workers_{workers}"] = run(app, args.login_threads, args.predict_threads, args.duration)
+            finally:
+                routes.password_hasher.shutdown()
+    report(
+        "password_hashing",
+        {"login_threads": args.login_threads, "predict_threads": args.predict_threads, "method": args.method, **results},
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
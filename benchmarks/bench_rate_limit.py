@@ -0,0 +1,57 @@
+"""
+Measures the cost of a rate limit check (ratelimit.RateLimiter.check, with an IP and a user limit) with --clients
+buckets already in use, to show it does not grow with the number of clients, and the cost of sweeping them once they
+are idle. Also runs the checks from --threads threads at once, to show the striped locks do not serialize them.
+"""
+from benchmarks.common import measure, parser, report, summarize, use_config
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+
+def main():
+    args = parser(__doc__)
+    args.add_argument("--clients", type=int, nargs="+", default=[1000, 100000, 1000000], help="Number of buckets in use")
+    args.add_argument("--threads", type=int, default=8, help="Number of threads checking at once")
+    args.set_defaults(repeat=100000, warmup=1000)
+    args = args.parse_args()
+
+    use_config()
+    from application.ratelimit import RateLimiter, TokenBuckets
+
+    limits = {"ip": {"rate": 1e9, "burst": 1e9}, "user": {"rate": 1e9, "burst": 1e9}}
+    results = {}
+    for n_clients in args.clients:
+        clock = [time.monotonic()]
+        limiter = RateLimiter(TokenBuckets(sweep_interval=float("inf"), clock=lambda: clock[0]))
+        for idx in range(n_clients):
+            limiter.check("api_predict", limits, idx, f"10.{idx >> 16 & 255}.{idx >> 8 & 255}.{idx & 255}")
+        client = iter(range(10 ** 9))
+
+        def check():
+            idx = next(client) % n_clients
+            limiter.check("api_predict", limits, idx, f"10.{idx >> 16 & 255}.{idx >> 8 & 255}.{idx & 255}")
+
+        results[n_clients] = {"check": measure(check, args.repeat, args.warmup)}
+
+        def check_many(_):
+            start = time.perf_counter()
+            for _ in range(args.repeat // args.threads):
+                check()
+            return time.perf_counter() - start
+
+        with ThreadPoolExecutor(args.threads) as pool:
+            start = time.perf_counter()
+            list(pool.map(check_many, range(args.threads)))
+            elapsed = time.perf_counter() - start
+        results[n_clients]["threads_throughput"] = args.repeat // args.threads * args.threads / elapsed
+
+        # Every bucket is full again once it has been idle for burst / rate seconds
+        clock[0] += 2
+        start = time.perf_counter()
+        dropped = limiter.buckets.sweep()
+        results[n_clients]["sweep"] = summarize([time.perf_counter() - start], items=dropped)
+    report("rate_limit", {"threads": args.threads, **results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
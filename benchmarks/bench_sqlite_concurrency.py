@@ -0,0 +1,158 @@
+"""
+Compares the default and production SQLite storage profiles (SQLITE_PROFILE) under a mixed load of history reads
+and writes from several worker processes, as when the app is served by a pre-forking server.
+
+Each of the --processes workers imports `application` and runs --threads threads for --seconds, each thread either
+adding an entry with POST /api/history/<id> (with probability --write-ratio) or reading the first page of
+GET /api/history/<id>. Failed requests are mostly "database is locked" errors, turned into 500s by the app.
+"""
+from benchmarks.bench_endpoints import LISTING, write_config
+from benchmarks.common import parser, report, summarize
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+CHILD = """
+import json, random, sys, threading, time
+role, seconds, n_threads, write_ratio, n_users, history_size = sys.argv[1], float(sys.argv[2]), int(sys.argv[3]), float(sys.argv[4]), int(sys.argv[5]), int(sys.argv[6])
+from application import app, db
+
+if role == "setup":
+    from benchmarks.bench_endpoints import make_entries
+    from application.models import Entry, User
+    import datetime as dt
+    for idx in range(n_users):
+        user = User(email=f"concurrency{idx}@example.com", password_hash="x" * 64, created=dt.datetime.utcnow())
+        db.session.add(user)
+        db.session.commit()
+        db.session.execute(Entry.__table__.insert(), list(make_entries(user.id, history_size, seed=idx)))
+        db.session.commit()
+    print(json.dumps({"journal_mode": db.session.execute("PRAGMA journal_mode").scalar()}), flush=True)
+    sys.exit()
+
+body = json.dumps(json.loads(sys.stdin.readline()))
+user_ids = list(range(1, n_users + 1))
+results = {"read": [], "write": []}
+failures = {"read": 0, "write": 0}
+lock = threading.Lock()
+
+def run(seed):
+    rng = random.Random(seed)
+    client = app.test_client()
+    timings = {"read": [], "write": []}
+    failed = {"read": 0, "write": 0}
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        user_id = rng.choice(user_ids)
+        with client.session_transaction() as session:
+            session["user_id"] = user_id
+        kind = "write" if rng.random() < write_ratio else "read"
+        start = time.perf_counter()
+        if kind == "write":
+            response = client.post(f"/api/history/{user_id}", data=body, content_type="application/json")
+        else:
+            response = client.get(f"/api/history/{user_id}?per_page=20")
+        elapsed = time.perf_counter() - start
+        if response.status_code == 200:
+            timings[kind].append(elapsed)
+        else:
+            failed[kind] += 1
+    with lock:
+        for kind in timings:
+            results[kind].extend(timings[kind])
+            failures[kind] += failed[kind]
+
+print(json.dumps({"ready": True}), flush=True)
+sys.stdin.readline()  # Start every worker at the same time
+threads = [threading.Thread(target=run, args=(idx,)) for idx in range(n_threads)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+print(json.dumps({"timings": results, "failures": failures}), flush=True)
+"""
+
+
+def read_result(worker):
+    # Skip anything the app prints while starting up
+    for line in worker.stdout:
+        if line.startswith("{"):
+            return json.loads(line)
+    raise RuntimeError("Worker exited without reporting its results")
+
+
+def run_profile(profile, args, entry):
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, TESTING=write_config(directory, SQLITE_PROFILE=profile))
+        env.pop("DEVELOPMENT", None)
+        argv = [str(value) for value in (args.seconds, args.threads, args.write_ratio, args.users, args.history_size)]
+
+        def start(role):
+            return subprocess.Popen(
+                [sys.executable, "-c", CHILD, role, *argv],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+                env=env,
+            )
+
+        setup = start("setup")
+        journal_mode = read_result(setup)["journal_mode"]
+        setup.wait()
+
+        workers = [start("worker") for _ in range(args.processes)]
+        for worker in workers:
+            worker.stdin.write(json.dumps(entry) + "\n")
+            worker.stdin.flush()
+            read_result(worker)
+        for worker in workers:
+            worker.stdin.write("\n")
+            worker.stdin.flush()
+        measured = [read_result(worker) for worker in workers]
+        for worker in workers:
+            worker.wait()
+
+    results = {"journal_mode": journal_mode}
+    for kind in ("read", "write"):
+        timings = sorted(timing for worker in measured for timing in worker["timings"][kind])
+        failed = sum(worker["failures"][kind] for worker in measured)
+        summary = summarize(timings) if timings else {}
+        # Completed requests per second across every worker, rather than the inverse of the mean latency
+        summary["throughput"] = len(timings) / args.seconds
+        summary["failed"] = failed
+        summary["failed_ratio"] = failed / max(1, failed + len(timings))
+        results[kind] = summary
+    return results
+
+
+def main():
+    args = parser(__doc__)
+    args.add_argument("--processes", type=int, default=4, help="Number of worker processes")
+    args.add_argument("--threads", type=int, default=4, help="Number of threads per worker process")
+    args.add_argument("--seconds", type=float, default=10.0, help="Duration of the load, per profile")
+    args.add_argument("--write-ratio", type=float, default=0.2, help="Share of requests that add an entry")
+    args.add_argument("--users", type=int, default=4, help="Number of users whose history is read and written")
+    args.add_argument("--history-size", type=int, default=10000, help="Number of entries per user before the load starts")
+    args.add_argument("--profiles", nargs="+", default=["default", "production"], help="Storage profiles to compare")
+    args = args.parse_args()
+
+    entry = dict(LISTING, link="https://www.airbnb.com/rooms/1", prediction=100.0, difference=15.0)
+    results = {profile: run_profile(profile, args, entry) for profile in args.profiles}
+    report(
+        "sqlite_concurrency",
+        {
+            "processes": args.processes,
+            "threads": args.threads,
+            "seconds": args.seconds,
+            "write_ratio": args.write_ratio,
+            **results,
+        },
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Compares reading a user's summary from the user_stats tables (stats.get_user_stats) against computing it by scanning
+the history on every request (scan: the aggregates of stats.rebuild_user_stats, restricted to the user, and the median
+from the sorted differences), for users with --rows entries. The summary is read with its median cached, as between
+writes (summary), and after a write, when the median is read from the history again (summary_uncached). Also reports the cost the summaries add to writes:
+inserting a batch of --batch-size entries with and without update_user_stats, and add_entry of a single entry.
+"""
+from benchmarks.bench_endpoints import make_entries, write_config
+from benchmarks.common import measure, parser, report, use_config
+import datetime as dt
+import tempfile
+
+
+def main():
+    args = parser(__doc__)
+    args.add_argument("--rows", type=int, nargs="+", default=[1000, 100000], help="Number of entries of each user")
+    args.add_argument("--batch-size", type=int, default=100, help="Number of entries per inserted batch")
+    args.set_defaults(repeat=50, warmup=5)
+    args = args.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_config(write_config(directory))
+        from application import db
+        from application.models import Entry, User, add_entry
+        from application.stats import BREAKDOWNS, _expected, get_user_stats, median_cache, rebuild_user_stats, update_user_stats
+
+        def make_user(email):
+            user = User(email=email, password_hash="x" * 64, created=dt.datetime.utcnow())
+            db.session.add(user)
+            db.session.commit()
+            return user.id
+
+        def scan(user_id):
+            """Summary computed from the history, as it would be without the user_stats tables"""
+            selects = _expected(user_id)
+            _, entries, count, total, abs_total = db.session.execute(selects[None]).one()
+            differences = sorted(
+                db.session.execute(
+                    db.select(Entry.difference).where(Entry.user_id == user_id, Entry.difference.isnot(None))
+                ).scalars()
+            )
+            middle = len(differences) // 2
+            summary = {
+                "entries": entries,
+                "mean_difference": total / count if count else None,
+                "mean_absolute_difference": abs_total / count if count else None,
+                "median_difference": (
+                    None if not differences
+                    else differences[middle] if len(differences) % 2
+                    else (differences[middle - 1] + differences[middle]) / 2
+                ),
+            }
+            for name in BREAKDOWNS:
+                summary[name] = {
+                    row[2]: {"entries": row[3], "mean_difference": row[5] / row[4] if row[4] else None}
+                    for row in db.session.execute(selects[name])
+                }
+            return summary
+
+        results = {}
+        for n_rows in args.rows:
+            user_id = make_user(f"stats{n_rows}@example.com")
+            db.session.execute(Entry.__table__.insert(), list(make_entries(user_id, n_rows, seed=n_rows)))
+            db.session.commit()
+            rebuild_user_stats(user_id)
+            summary = get_user_stats(user_id)
+            assert summary["entries"] == scan(user_id)["entries"] == n_rows
+            assert summary["median_difference"] == scan(user_id)["median_difference"]
+            results[n_rows] = {
+                "scan": measure(lambda: scan(user_id), args.repeat, args.warmup),
+                "summary": measure(lambda: get_user_stats(user_id), args.repeat, args.warmup),
+                "summary_uncached": measure(
+                    lambda: median_cache.clear() or get_user_stats(user_id), args.repeat, args.warmup
+                ),
+            }
+
+        user_id = make_user("stats_writes@example.com")
+        batch = list(make_entries(user_id, args.batch_size))
+        table = Entry.__table__
+
+        def insert(with_stats):
+            db.session.execute(table.insert(), batch)
+            if with_stats:
+                update_user_stats(batch)
+            db.session.commit()
+
+        def add_one(with_stats):
+            entry = Entry(**batch[0])
+            if with_stats:
+                add_entry(entry)
+            else:
+                db.session.add(entry)
+                db.session.commit()
+
+        results["writes"] = {
+            "batch": measure(lambda: insert(False), args.repeat, args.warmup, items=args.batch_size),
+            "batch_with_stats": measure(lambda: insert(True), args.repeat, args.warmup, items=args.batch_size),
+            "entry": measure(lambda: add_one(False), args.repeat, args.warmup),
+            "entry_with_stats": measure(lambda: add_one(True), args.repeat, args.warmup),
+        }
+    report("user_stats", {"batch_size": args.batch_size, **results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Compares validating listings and history entries with the compiled schemas of application/schema.py against the
+checks they replaced: the assert blocks of predict() and parse_prediction_input (membership tested against the
+sorted NEIGHBORHOODS list), the @validates hooks of Entry, and the NumberRange validators of the Prediction form.
+The replaced checks are copied below, as they were before the schemas.
+
+Cases:
+- listing: one valid listing, as sent to /api/predict
+- entry: the fields of one valid history entry, as checked when they are set on an Entry
+- entry_build: building an Entry from a validated row, through the hooks (Entry(**row)) and without them (Entry.from_row)
+- batch: --batch-size listings, a tenth of them invalid, as sent to /api/predict/batch
+- predict_form: the whole /predict stack (form parsing and validation, listing checks, building the Entry)
+"""
+from benchmarks.common import measure, parser, report, use_config
+import datetime as dt
+
+LISTING = {
+    "beds": 1,
+    "bathrooms": 1.5,
+    "accomodates": 2,
+    "minimum_nights": 3,
+    "room_type": "Private room",
+    "neighborhood": "Woodlands",  # Near the end of the sorted list of neighborhoods
+    "wifi": True,
+    "elevator": False,
+    "pool": False,
+    "actual_price": 115.0,
+}
+
+
+def legacy_parse(data, NEIGHBORHOODS, ROOM_TYPES):
+    """parse_prediction_input before the schemas"""
+    beds = int(data["beds"])
+    bathrooms = float(data["bathrooms"])
+    accomodates = int(data["accomodates"])
+    minimum_nights = data["minimum_nights"]
+    room_type = data["room_type"]
+    neighborhood = data["neighborhood"]
+    wifi = data["wifi"]
+    elevator = data["elevator"]
+    pool = data["pool"]
+    actual_price = data["actual_price"]
+    assert beds >= 0, "Beds must be greater than or equal to zero"
+    assert bathrooms >= 0, "Bathrooms must be greater than or equal to zero"
+    assert accomodates >= 0, "Accomodates must be greater than zero"
+    assert accomodates >= beds, "Accomodates must be greater than or equal to number of beds"
+    assert minimum_nights >= 0, "MinimumNights must be greater than or equal to zero"
+    assert room_type in ROOM_TYPES, "Room type is invalid"
+    assert neighborhood in NEIGHBORHOODS, "Neighborhood is invalid"
+    assert type(wifi) is bool, "Wifi must be a boolean"
+    assert type(elevator) is bool, "Elevator must be a boolean"
+    assert type(pool) is bool, "Pool must be a boolean"
+    assert type(actual_price) in {type(None), float, int}, "Actual price should be a number or None"
+    if actual_price is not None:
+        assert actual_price > 0, "Actual price should be greater than 0"
+    return {
+        "beds": beds,
+        "bathrooms": bathrooms,
+        "accomodates": accomodates,
+        "minimum_nights": minimum_nights,
+        "room_type": room_type,
+        "neighborhood": neighborhood,
+        "wifi": wifi,
+        "elevator": elevator,
+        "pool": pool,
+        "actual_price": actual_price,
+    }
+
+
+def legacy_hooks(NEIGHBORHOODS, ROOM_TYPES):
+    """The @validates hooks of Entry before the schemas, keyed by column"""
+
+    def number(key, value, types, minimum, strict, message):
+        assert type(value) in types, message
+        if value is not None:
+            assert value > minimum if strict else value >= minimum, message
+        return value
+
+    def category(key, value, choices, message):
+        assert type(value) is str, "Data type should be a string"
+        assert value in choices, message
+        return value
+
+    def kind(key, value, types, message):
+        assert type(value) in types, message
+        return value
+
+    return {
+        "beds": lambda key, value: number(key, value, {int}, 0, False, "Beds"),
+        "bathrooms": lambda key, value: number(key, value, {int, float}, 0, False, "Bathrooms"),
+        "accomodates": lambda key, value: number(key, value, {int}, 0, True, "Accomodates"),
+        "minimum_nights": lambda key, value: number(key, value, {int}, 0, False, "Minimum nights"),
+        "wifi": lambda key, value: kind(key, value, {bool}, "Wifi"),
+        "elevator": lambda key, value: kind(key, value, {bool}, "Elevator"),
+        "pool": lambda key, value: kind(key, value, {bool}, "Pool"),
+        "neighborhood": lambda key, value: category(key, value, NEIGHBORHOODS, "Neighborhood"),
+        "room_type": lambda key, value: category(key, value, ROOM_TYPES, "Room Type"),
+        "actual_price": lambda key, value: number(key, value, {type(None), int, float}, 0, True, "Actual price"),
+        "prediction": lambda key, value: number(key, value, {float, int}, 0, True, "Prediction"),
+        "created": lambda key, value: kind(key, value, {dt.datetime}, "Created"),
+        "link": lambda key, value: kind(key, value, {type(None), str}, "Link"),
+        "difference": lambda key, value: kind(key, value, {int, float, type(None)}, "Difference"),
+        "model_version": lambda key, value: kind(key, value, {type(None), str}, "Model version"),
+    }
+
+
+def main():
+    args = parser(__doc__)
+    args.add_argument("--batch-size", type=int, default=1000, help="Number of listings per batch")
+    args = args.parse_args()
+
+    use_config()
+    from application import NEIGHBORHOODS, ROOM_TYPES, app
+    from application.forms import Prediction
+    from application.models import Entry
+    from application.schema import ENTRY_SCHEMA, LISTING_SCHEMA
+    from flask_wtf import FlaskForm
+    from wtforms import BooleanField, FloatField, IntegerField, SelectField
+    from wtforms.fields.html5 import URLField
+    from wtforms.validators import InputRequired, NumberRange, Optional, URL, ValidationError
+
+    class LegacyPrediction(FlaskForm):
+        beds = IntegerField("Number of Beds", validators=[InputRequired(), NumberRange(min=0)])
+        bathrooms = FloatField("Number of Bathrooms", validators=[InputRequired(), NumberRange(min=0)])
+        accomodates = IntegerField("Accomodates", validators=[InputRequired(), NumberRange(min=0)])
+        minimum_nights = IntegerField("Minimum Nights", validators=[InputRequired(), NumberRange(min=0)])
+        room_type = SelectField("Room Type", validators=[InputRequired()], choices=ROOM_TYPES)
+        neighborhood = SelectField("Neighborhood", validators=[InputRequired()], choices=NEIGHBORHOODS)
+        wifi = BooleanField("Wifi", default=True)
+        elevator = BooleanField("Elevator Access?", default=False)
+        pool = BooleanField("Pool?", default=False)
+        actual_price = FloatField("Actual Listing Price in SGD (Optional)", validators=[Optional(), NumberRange(min=0)])
+        link = URLField("Link to Listing (Optional)", validators=[Optional(), URL()])
+
+        def validate_accomodates(form, field):
+            if field.data < form.beds.data:
+                raise ValidationError("Accomodates should be greater than or equal to the number of beds")
+
+    hooks = legacy_hooks(NEIGHBORHOODS, ROOM_TYPES)
+    entry = dict(LISTING, link=None, prediction=100.0, difference=15.0, created=dt.datetime.utcnow(), model_version="v1")
+    batch = [dict(LISTING, beds=-1) if idx % 10 == 0 else LISTING for idx in range(args.batch_size)]
+
+    def legacy_batch():
+        valid = []
+        for row in batch:
+            try:
+                valid.append(legacy_parse(row, NEIGHBORHOODS, ROOM_TYPES))
+            except Exception:
+                pass
+        return valid
+
+    form = {key: value for key, value in LISTING.items() if value is not False}
+    form.update({"wifi": "y", "link": "https://www.airbnb.com/rooms/1"})
+
+    def legacy_predict_form():
+        with app.test_request_context("/predict", method="POST", data=form):
+            pred_form = LegacyPrediction(meta={"csrf": False})
+            assert pred_form.validate()
+            data = {key: pred_form[key].data for key in LISTING}
+            listing = legacy_parse(data, NEIGHBORHOODS, ROOM_TYPES)
+            Entry(**listing, link=pred_form.link.data, prediction=100.0, created=dt.datetime.utcnow(), difference=15.0)
+
+    def predict_form():
+        with app.test_request_context("/predict", method="POST", data=form):
+            pred_form = Prediction(meta={"csrf": False})
+            assert pred_form.validate()
+            Entry.from_row(
+                dict(pred_form.listing, link=pred_form.link.data, prediction=100.0, created=dt.datetime.utcnow(), difference=15.0)
+            )
+
+    def legacy_entry():
+        return {key: hooks[key](key, value) for key, value in entry.items()}
+
+    assert len(legacy_batch()) == len(LISTING_SCHEMA.validate_many(batch)[0])
+    assert legacy_entry() == ENTRY_SCHEMA.check(entry)
+    repeat, warmup = args.repeat * 10, args.warmup
+    results = {
+        "listing": {
+            "legacy": measure(lambda: legacy_parse(LISTING, NEIGHBORHOODS, ROOM_TYPES), repeat, warmup),
+            "schema": measure(lambda: LISTING_SCHEMA.check(LISTING), repeat, warmup),
+        },
+        "entry": {
+            "legacy": measure(legacy_entry, repeat, warmup),
+            "schema": measure(lambda: ENTRY_SCHEMA.check(entry), repeat, warmup),
+        },
+        "entry_build": {
+            "hooks": measure(lambda: Entry(**entry), repeat, warmup),
+            "from_row": measure(lambda: Entry.from_row(entry), repeat, warmup),
+        },
+        "batch": {
+            "legacy": measure(legacy_batch, args.repeat, warmup, items=args.batch_size),
+            "schema": measure(lambda: LISTING_SCHEMA.validate_many(batch), args.repeat, warmup, items=args.batch_size),
+        },
+        "predict_form": {
+            "legacy": measure(legacy_predict_form, args.repeat, warmup),
+            "schema": measure(predict_form, args.repeat, warmup),
+        },
+    }
+    report("validation", {"batch_size": args.batch_size, **results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Benchmarks are run as modules from the root of the repository (the model is loaded from a path relative to it), e.g.
+    python -m benchmarks.bench_inference --output bench_output.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+
+def use_config(config="test_config.cfg"):
+    """Select the app config before `application` is imported. Defaults to the test config, which uses an in-memory database"""
+    os.environ.pop("DEVELOPMENT", None)
+    os.environ["TESTING"] = config
+
+
+def parser(description):
+    """Argument parser with the options shared by every benchmark"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--output", help="Write the results as json to this file")
+    parser.add_argument("--repeat", type=int, default=200, help="Number of timed calls per case")
+    parser.add_argument("--warmup", type=int, default=10, help="Number of untimed calls per case")
+    return parser
+
+
+def measure(func, repeat=200, warmup=10, items=1):
+    """Time repeated calls of func
+
+    Args:
+        func (Callable): Function to time, called without arguments
+        repeat (int, optional): Number of timed calls. Defaults to 200.
+        warmup (int, optional): Number of untimed calls made first. Defaults to 10.
+        items (int, optional): Number of items (rows, requests...) processed per call, for the throughput. Defaults to 1.
+
+    Returns:
+        dict: Latency percentiles in milliseconds, and throughput in items per second
+    """
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return summarize(timings, items)
+
+
+def summarize(timings, items=1):
+    """Summarize a list of timings (in seconds)"""
+    timings = sorted(timings)
+    total = sum(timings)
+    return {
+        "calls": len(timings),
+        "mean_ms": statistics.mean(timings) * 1e3,
+        "p50_ms": percentile(timings, 50) * 1e3,
+        "p95_ms": percentile(timings, 95) * 1e3,
+        "p99_ms": percentile(timings, 99) * 1e3,
+        "max_ms": timings[-1] * 1e3,
+        "throughput": len(timings) * items / total if total > 0 else None,
+    }
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def report(name, results, output=None):
+    """Print the results of a benchmark, and save them as json so that runs on different commits can be compared"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = None
+    document = {
+        "benchmark": name,
+        "commit": commit,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    text = json.dumps(document, indent=2, default=str)
+    print(text)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+    return document
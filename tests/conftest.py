@@ -1,12 +1,30 @@
 import pytest
 from app import app as flask_app
-from application import db
-from application.models import User
-from datetime import datetime as dt
+from application import db, NEIGHBORHOODS, ROOM_TYPES
+from application.models import Entry, User
+from application.stats import rebuild_user_stats
+from datetime import datetime as dt, timedelta
 from werkzeug.security import generate_password_hash
 from flask import session
+import itertools
 import json
 
+PAGED_ENTRIES = 23
+
+ENTRY_LISTING = {
+    "beds": 1,
+    "bathrooms": 1.0,
+    "accomodates": 2,
+    "minimum_nights": 3,
+    "room_type": "Private room",
+    "neighborhood": "Novena",
+    "wifi": True,
+    "elevator": False,
+    "pool": False,
+    "link": None,
+    "prediction": 100.0,
+}
+
 
 @pytest.fixture
 def app():
@@ -50,4 +68,130 @@ def fake_login(client, request):
         try:
             sess["user_id"] = request.param
         except:
-            sess["user_id"] = 1
\ No newline at end of file
+            sess["user_id"] = 1
+
+
+@pytest.fixture
+def all_listings():
+    """Builds every combination of categorical inputs, cycling through the given numerical inputs"""
+
+    def build(numerical):
+        combinations = itertools.product(
+            NEIGHBORHOODS, sorted(ROOM_TYPES), [True, False], [True, False], [True, False]
+        )
+        return [
+            {
+                "beds": numerical[idx % len(numerical)][0],
+                "bathrooms": numerical[idx % len(numerical)][1],
+                "accomodates": numerical[idx % len(numerical)][2],
+                "minimum_nights": numerical[idx % len(numerical)][3],
+                "neighborhood": neighborhood,
+                "room_type": room_type,
+                "wifi": wifi,
+                "elevator": elevator,
+                "pool": pool,
+            }
+            for idx, (neighborhood, room_type, wifi, elevator, pool) in enumerate(combinations)
+        ]
+
+    return build
+
+
+@pytest.fixture
+def paged_user(client):
+    """User with a history full of ties and NULLs, logged in. Removed afterwards, so that other tests see the usual users"""
+    user = User(email="pager@example.com", password_hash="x" * 64, created=dt.utcnow())
+    db.session.add(user)
+    db.session.commit()
+    start = dt(2021, 1, 1)
+    for idx in range(PAGED_ENTRIES):
+        db.session.add(
+            Entry(
+                user_id=user.id,
+                beds=idx % 3,
+                bathrooms=1.0,
+                accomodates=4,
+                minimum_nights=1,
+                room_type="Private room",
+                neighborhood="Novena",
+                wifi=idx % 2 == 0,
+                elevator=False,
+                pool=False,
+                actual_price=None if idx % 4 == 0 else float(100 + idx % 5),
+                link=None,
+                prediction=float(100 + idx % 7),
+                difference=None,
+                created=start + timedelta(hours=idx // 2),
+            )
+        )
+    db.session.commit()
+    rebuild_user_stats(user.id)  # The entries are added directly, without add_entry
+    with client.session_transaction() as sess:
+        sess["user_id"] = user.id
+    yield user.id
+    with client.session_transaction() as sess:
+        sess.pop("user_id", None)
+    db.session.query(Entry).filter_by(user_id=user.id).delete()
+    db.session.delete(user)
+    db.session.commit()
+    rebuild_user_stats(user.id)
+
+
+@pytest.fixture
+def n_paged_entries():
+    return PAGED_ENTRIES
+
+
+@pytest.fixture
+def expected_order():
+    """Builds the ids of a user's entries in the order SQLite sorts (col_sort, id): NULLs first in ascending order"""
+
+    def build(user_id, col_sort, desc):
+        entries = db.session.query(Entry).filter_by(user_id=user_id).all()
+        entries.sort(
+            key=lambda entry: (getattr(entry, col_sort) is not None, getattr(entry, col_sort) or 0, entry.id)
+        )
+        ids = [entry.id for entry in entries]
+        return ids[::-1] if desc else ids
+
+    return build
+
+
+@pytest.fixture
+def entry_listing():
+    """Columns of a history entry apart from its user, price and creation time"""
+    return dict(ENTRY_LISTING)
+
+
+@pytest.fixture
+def make_entry():
+    """Builds an entry of a user, with an actual price set from its difference with the prediction"""
+
+    def build(user_id, difference, **fields):
+        actual_price = None if difference is None else 100.0 + difference
+        return Entry(
+            **dict(ENTRY_LISTING, **fields),
+            user_id=user_id,
+            actual_price=actual_price,
+            difference=difference,
+            created=dt.utcnow(),
+        )
+
+    return build
+
+
+@pytest.fixture
+def stats_user(client):
+    """User without entries, logged in. Removed with its history and summary afterwards"""
+    user = User(email="stats@example.com", password_hash="x" * 64, created=dt.utcnow())
+    db.session.add(user)
+    db.session.commit()
+    with client.session_transaction() as sess:
+        sess["user_id"] = user.id
+    yield user.id
+    with client.session_transaction() as sess:
+        sess.pop("user_id", None)
+    db.session.query(Entry).filter_by(user_id=user.id).delete()
+    db.session.delete(user)
+    db.session.commit()
+    rebuild_user_stats(user.id)
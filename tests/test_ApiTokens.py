@@ -0,0 +1,156 @@
+from application import app, db
+from application.models import User
+from application.passwords import password_hasher
+from application.tokens import TokenDenylist, denylist, issue_token
+from itsdangerous import URLSafeTimedSerializer
+from sqlalchemy import event
+import time
+import pytest
+import json
+
+EMAIL, PASSWORD = "user_1@example.com", "Password1234!"
+
+
+@pytest.fixture
+def token_user(populate_users):
+    """Id of a user and a token issued to them through the API. Revoked tokens are forgotten afterwards"""
+    user_id = db.session.query(User).filter_by(email=EMAIL).one().id
+    yield user_id
+    denylist.clear()
+
+
+def request_token(client, email=EMAIL, password=PASSWORD):
+    data = {"email": email, "password": password}
+    response = client.post("/api/tokens", data=json.dumps(data), content_type="application/json")
+    return response, json.loads(response.get_data(as_text=True))
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+# Range Testing
+def test_issue_token(client, token_user, capsys):
+    with capsys.disabled():
+        response, body = request_token(client)
+        assert response.status_code == 200
+        assert body["user_id"] == token_user
+        assert body["token_type"] == "Bearer"
+        assert body["expires_in"] == app.config.get("API_TOKEN_MAX_AGE", 3600)
+
+        # Accepted in place of a session, by a client that never logged in
+        other_client = app.test_client()
+        response = other_client.get(f"/api/history/{token_user}/stats", headers=bearer(body["token"]))
+        assert response.status_code == 200
+
+
+def test_token_without_database_or_hash(client, token_user, monkeypatch, capsys):
+    with capsys.disabled():
+        token = issue_token(token_user)
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        def no_hashing(*args):
+            raise AssertionError("Tokens are checked without hashing a password")
+
+        monkeypatch.setattr(password_hasher, "verify", no_hashing)
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            response = client.delete("/api/tokens", headers=bearer(token))
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        assert response.status_code == 200
+        assert statements == []
+
+
+# Consistency Testing
+def test_revoke_token(client, token_user, capsys):
+    with capsys.disabled():
+        token, other_token = issue_token(token_user), issue_token(token_user)
+        response = client.delete("/api/tokens", headers=bearer(token))
+        body = json.loads(response.get_data(as_text=True))
+        assert response.status_code == 200
+        assert body == {"user_id": token_user, "revoked": True}
+
+        response = client.get(f"/api/history/{token_user}/stats", headers=bearer(token))
+        assert response.status_code == 401
+        assert json.loads(response.get_data(as_text=True))["message"] == "Token has been revoked"
+        # Other tokens of the user are still accepted
+        assert client.get(f"/api/history/{token_user}/stats", headers=bearer(other_token)).status_code == 200
+
+
+def test_denylist_ttl(capsys):
+    with capsys.disabled():
+        revoked = TokenDenylist()
+        revoked.add("expired", time.time() - 1)  # Refused anyway, as it has expired
+        revoked.add("soon", time.time() + 0.2)
+        revoked.add("later", time.time() + 60)
+        assert "expired" not in revoked and len(revoked) == 2
+        assert "soon" in revoked and "later" in revoked
+
+        time.sleep(0.3)
+        assert "soon" not in revoked
+        revoked.add("another", time.time() + 60)
+        assert len(revoked) == 2  # "soon" was dropped
+        assert revoked.revoked == 4
+
+
+def test_token_user_checked(client, token_user, capsys):
+    with capsys.disabled():
+        response = client.get(f"/api/history/{token_user + 1}", headers=bearer(issue_token(token_user)))
+        assert response.status_code == 403
+
+
+# Expected Failure Testing
+@pytest.mark.parametrize(
+    "email,password,status",
+    [(EMAIL, "Wrong1234!", 403), ("nobody@example.com", PASSWORD, 404), (None, PASSWORD, 400), (EMAIL, None, 400)],
+)
+def test_issue_token_rejected(client, token_user, email, password, status, capsys):
+    with capsys.disabled():
+        response, body = request_token(client, email, password)
+        assert response.status_code == status
+        assert "token" not in body
+
+
+def test_expired_token(client, token_user, monkeypatch, capsys):
+    with capsys.disabled():
+        token = issue_token(token_user)
+        monkeypatch.setitem(app.config, "API_TOKEN_MAX_AGE", -1)
+        response = client.get(f"/api/history/{token_user}", headers=bearer(token))
+        assert response.status_code == 401
+        assert json.loads(response.get_data(as_text=True))["message"] == "Token has expired"
+
+
+@pytest.mark.parametrize(
+    "secret_key, salt, payload",
+    [
+        (None, None, None),
+        ("another key", "rentier-api-token", {"user_id": 1, "token_id": "x"}),
+        (None, "another salt", {"user_id": 1, "token_id": "x"}),
+        (None, "rentier-api-token", [1, "x"]),
+    ],
+    ids=["malformed", "other_key", "other_salt", "not_a_dict"],
+)
+def test_invalid_token(client, secret_key, salt, payload, capsys):
+    with capsys.disabled():
+        # Signed tokens embed the time they were made at, so they are made here rather than being the parameters
+        if payload is None:
+            token = "not-a-token"
+        else:
+            token = URLSafeTimedSerializer(secret_key or app.config["SECRET_KEY"], salt=salt).dumps(payload)
+        response = client.get("/api/history/1", headers=bearer(token))
+        assert response.status_code == 401
+        assert json.loads(response.get_data(as_text=True))["message"] == "Token is invalid"
+
+
+def test_revoke_without_token(client, token_user, capsys):
+    with capsys.disabled():
+        with client.session_transaction() as sess:
+            sess["user_id"] = token_user
+        response = client.delete("/api/tokens")
+        assert response.status_code == 400
+        with client.session_transaction() as sess:
+            sess.pop("user_id", None)
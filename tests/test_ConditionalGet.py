@@ -0,0 +1,141 @@
+from application import db
+from application.models import Entry, add_entry, delete_entry, get_history_page
+from sqlalchemy import event
+import pytest
+
+
+def get_statements(client, url, **headers):
+    """Get a url, returning the response with the statements it ran, apart from reading the user's generation"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        response = client.get(url, headers=headers)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    return response, [statement for statement in statements if "history_versions" not in statement]
+
+
+def urls(user_id):
+    return [f"/api/history/{user_id}", f"/api/history/{user_id}?per_page=1&col_sort=prediction", "/history"]
+
+
+# Range Testing
+@pytest.mark.parametrize("url_idx", range(3))
+def test_not_modified(client, stats_user, make_entry, url_idx, capsys):
+    with capsys.disabled():
+        add_entry(make_entry(stats_user, 5.0))
+        url = urls(stats_user)[url_idx]
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.headers["ETag"].startswith("W/")
+        assert response.last_modified is not None
+        assert response.cache_control.private and response.cache_control.no_cache
+
+        response, statements = get_statements(client, url, **{"If-None-Match": response.headers["ETag"]})
+        assert response.status_code == 304
+        assert response.get_data() == b""
+        assert statements == []  # Answered without reading the rows
+        assert "ETag" in response.headers
+
+
+# Consistency Testing
+@pytest.mark.parametrize("url_idx", range(3))
+def test_writes_change_etag(client, stats_user, make_entry, url_idx, capsys):
+    with capsys.disabled():
+        entry_id = add_entry(make_entry(stats_user, 5.0))
+        url = urls(stats_user)[url_idx]
+        etags = [client.get(url).headers["ETag"]]
+        add_entry(make_entry(stats_user, 1.0))
+        response = client.get(url, headers={"If-None-Match": etags[-1]})
+        assert response.status_code == 200
+        etags.append(response.headers["ETag"])
+        delete_entry(db.session.get(Entry, entry_id))
+        response = client.get(url, headers={"If-None-Match": etags[-1]})
+        assert response.status_code == 200
+        etags.append(response.headers["ETag"])
+        assert len(set(etags)) == 3
+
+
+def test_same_second_write(client, stats_user, make_entry, capsys):
+    with capsys.disabled():
+        add_entry(make_entry(stats_user, 5.0, neighborhood="Bedok"))
+        url = f"/api/history/{stats_user}"
+        last_modified = client.get(url).headers["Last-Modified"]
+        # Usually made in the same second, so the Last-Modified alone cannot tell the two versions apart
+        add_entry(make_entry(stats_user, 1.0, neighborhood="Tuas"))
+        response = client.get(url, headers={"If-Modified-Since": last_modified})
+        assert response.status_code == 200
+        assert {entry["neighborhood"] for entry in response.get_json()} == {"Bedok", "Tuas"}
+        # Without an ETag, even a current copy is sent again
+        last_modified = response.headers["Last-Modified"]
+        assert client.get(url, headers={"If-Modified-Since": last_modified}).status_code == 200
+
+
+def test_flashed_message_sent(client, stats_user, make_entry, capsys):
+    with capsys.disabled():
+        add_entry(make_entry(stats_user, 5.0))
+        etag = client.get("/history").headers["ETag"]
+        with client.session_transaction() as sess:
+            sess["_flashes"] = [("success", "Entry deleted")]
+        response = client.get("/history", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert "Entry deleted" in response.get_data(as_text=True)
+
+
+@pytest.mark.parametrize("prefix", ["/api/history/{user_id}", "/history"])
+def test_views_etag(client, paged_user, prefix, capsys):
+    with capsys.disabled():
+        prefix = prefix.format(user_id=paged_user)
+        cursor = get_history_page(paged_user, 5, "created", True).next_cursor
+        queries = [
+            "per_page=5",
+            "per_page=6",
+            "per_page=5&col_sort=prediction",
+            "per_page=5&dir=asc",
+            "per_page=5&page=2",
+            f"per_page=5&cursor={cursor}",
+        ]
+        etags = [client.get(f"{prefix}?{query}").headers["ETag"] for query in queries]
+        assert len(set(etags)) == len(queries)
+        # The copy of a view only validates that view
+        for idx, query in enumerate(queries):
+            for etag_idx, etag in enumerate(etags):
+                response = client.get(f"{prefix}?{query}", headers={"If-None-Match": etag})
+                assert response.status_code == (304 if etag_idx == idx else 200)
+        # A cursor is ignored on numbered pages, so it does not make another view of them
+        response = client.get(f"{prefix}?per_page=5&page=2&cursor={cursor}", headers={"If-None-Match": etags[4]})
+        assert response.status_code == 304
+
+
+# Expected Failure Testing
+def test_other_user_etag(client, stats_user, populate_users, capsys):
+    with capsys.disabled():
+        etag = client.get(f"/api/history/{stats_user}").headers["ETag"]
+        # Access is checked before the version
+        assert client.get(f"/api/history/{stats_user + 1}", headers={"If-None-Match": etag}).status_code == 403
+        with client.session_transaction() as sess:
+            sess["user_id"] = stats_user - 1
+        assert client.get("/history", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_invalid_request_not_modified(client, stats_user, capsys):
+    with capsys.disabled():
+        etag = client.get(f"/api/history/{stats_user}").headers["ETag"]
+        url = f"/api/history/{stats_user}?col_sort=user_id"
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 400
+
+
+@pytest.mark.parametrize("prefix", ["/api/history/{user_id}", "/history"])
+def test_invalid_cursor_not_modified(client, paged_user, prefix, capsys):
+    with capsys.disabled():
+        prefix = prefix.format(user_id=paged_user)
+        cursor = get_history_page(paged_user, 5, "created", True).next_cursor
+        etag = client.get(f"{prefix}?per_page=5&cursor={cursor}").headers["ETag"]
+        # The cursor is checked before the version, even when the ETag matches
+        assert client.get(f"{prefix}?per_page=5&cursor={cursor}x", headers={"If-None-Match": etag}).status_code == 400
+        url = f"{prefix}?per_page=5&dir=asc&cursor={cursor}"
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 400
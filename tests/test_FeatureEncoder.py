@@ -0,0 +1,31 @@
+from application import ai_model
+from application.encoder import FeatureEncoder
+from application.inference import FEATURE_COLUMNS, current_model, make_model_input
+import numpy as np
+import pytest
+
+
+def test_encoder_compiled(capsys):
+    with capsys.disabled():
+        assert current_model().encoder is not None, "The encoder should be able to compile the loaded model"
+
+
+@pytest.mark.parametrize(
+    "numerical",
+    [
+        [(1, 1.5, 6, 1), (1, 1, 1, 81), (3, 1, 6, 90), (0, 0, 1, 0)],  # Common values
+        [(2, 2.7, 13, 3650), (7, 0.3, 400, 1), (15, 12.5, 30, 99999)],  # Values outside the precomputed tables
+    ],
+)
+def test_encoder_parity(numerical, all_listings, capsys):
+    with capsys.disabled():
+        rows = all_listings(numerical)
+        compiled = FeatureEncoder.from_pipeline(ai_model[:-1], FEATURE_COLUMNS)
+        X = compiled.transform(rows)
+        expected = ai_model[:-1].transform(make_model_input(rows))
+        if hasattr(expected, "toarray"):
+            expected = expected.toarray()
+
+        # Encoded inputs and predictions should be bit-identical to the pipeline
+        assert np.array_equal(X, np.asarray(expected, dtype=np.float64))
+        assert np.array_equal(ai_model[-1].predict(X), ai_model.predict(make_model_input(rows)))
@@ -0,0 +1,57 @@
+from application import ai_model
+from application.forest import FlatForest, UnsupportedModel, CHUNK_SIZE
+from application.inference import make_model_input
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope="module")
+def flat_forest():
+    return FlatForest.from_model(ai_model)
+
+
+@pytest.mark.parametrize(
+    "numerical",
+    [
+        [(1, 1.5, 6, 1), (1, 1, 1, 81), (3, 1, 6, 90), (0, 0, 1, 0)],
+        [(2, 2.7, 13, 3650), (7, 0.3, 400, 1), (15, 12.5, 30, 99999)],
+    ],
+)
+def test_flat_forest_parity(flat_forest, numerical, all_listings, capsys):
+    with capsys.disabled():
+        rows = all_listings(numerical)
+        X = ai_model[:-1].transform(make_model_input(rows))
+        # Predictions should be identical to the pipeline, including the inverse target transform
+        assert np.array_equal(flat_forest.predict(X), ai_model.predict(make_model_input(rows)))
+
+
+@pytest.mark.parametrize("n_rows", [1, 7, CHUNK_SIZE + 3])
+def test_flat_forest_batch_sizes(flat_forest, n_rows, capsys):
+    with capsys.disabled():
+        rng = np.random.RandomState(n_rows)
+        X = rng.rand(n_rows, flat_forest.n_features) * 4
+        assert np.array_equal(flat_forest.predict(X), ai_model[-1].predict(X))
+
+
+def test_flat_forest_plain_forest(capsys):
+    with capsys.disabled():
+        rng = np.random.RandomState(0)
+        X, y = rng.rand(200, 5), rng.rand(200)
+        model = RandomForestRegressor(n_estimators=10, random_state=0).fit(X, y)
+        flat = FlatForest.from_model(model)
+        assert flat.inverse_func == "identity"
+        assert np.array_equal(flat.predict(X), model.predict(X))
+        assert np.array_equal(flat.apply(X), model.apply(X.astype(np.float32)) + flat.roots)
+
+
+@pytest.mark.xfail(reason="Not a forest", raises=UnsupportedModel, strict=True)
+def test_flat_forest_unsupported(capsys):
+    rng = np.random.RandomState(0)
+    FlatForest.from_model(LinearRegression().fit(rng.rand(20, 2), rng.rand(20)))
+
+
+@pytest.mark.xfail(reason="Wrong number of features", raises=ValueError, strict=True)
+def test_flat_forest_wrong_shape(flat_forest):
+    flat_forest.predict(np.zeros((2, flat_forest.n_features + 1)))
@@ -0,0 +1,84 @@
+from application import db
+from application.models import Entry
+import pytest
+import json
+
+ENTRY = {
+    "beds": 2,
+    "bathrooms": 1,
+    "accomodates": 3,
+    "minimum_nights": 90,
+    "room_type": "Shared room",
+    "neighborhood": "Marine Parade",
+    "wifi": True,
+    "elevator": True,
+    "pool": False,
+    "actual_price": None,
+    "link": None,
+    "prediction": 95.09,
+    "difference": None,
+}
+
+
+def post_bulk(client, user_id, data):
+    response = client.post(
+        f"/api/history/{user_id}/bulk", data=json.dumps(data), content_type="application/json"
+    )
+    return response, json.loads(response.get_data(as_text=True))
+
+
+def test_bulk_insert(client, paged_user, n_paged_entries, capsys):
+    with capsys.disabled():
+        data = [
+            ENTRY,
+            dict(ENTRY, beds=3, accomodates=4, actual_price=120, difference=24.91, model_version="v2"),
+            dict(ENTRY, neighborhood="Atlantis"),  # Invalid neighborhood
+            {key: value for key, value in ENTRY.items() if key != "prediction"},  # Missing field
+            "not an entry",
+            dict(ENTRY, accomodates=0),  # Rejected by the same rules as single entries
+            dict(ENTRY, prediction=200),
+        ]
+        response, body = post_bulk(client, paged_user, data)
+
+        assert response.status_code == 200
+        assert body["inserted"] == 3
+        assert body["errors"] == 4
+        ids = [result.get("id") for result in body["results"]]
+        assert all(ids[idx] is not None for idx in (0, 1, 6))
+        assert ids[0] < ids[1] < ids[6]
+        assert body["results"][3]["message"] == "Missing field prediction"
+        assert all("message" in body["results"][idx] for idx in (2, 3, 4, 5))
+
+        # Rows are stored under the returned ids, with every field
+        for entry_id, expected in zip((ids[0], ids[1], ids[6]), (data[0], data[1], data[6])):
+            entry = db.session.get(Entry, entry_id)
+            assert entry.user_id == paged_user
+            for key, value in expected.items():
+                assert getattr(entry, key) == value
+            assert entry.created is not None
+        assert db.session.query(Entry).filter_by(user_id=paged_user).count() == n_paged_entries + 3
+
+
+def test_bulk_insert_only_invalid(client, paged_user, n_paged_entries, capsys):
+    with capsys.disabled():
+        response, body = post_bulk(client, paged_user, [dict(ENTRY, wifi="yes")])
+        assert response.status_code == 200
+        assert body["inserted"] == 0
+        assert db.session.query(Entry).filter_by(user_id=paged_user).count() == n_paged_entries
+
+
+@pytest.mark.usefixtures("fake_login")
+@pytest.mark.parametrize(
+    "user_id, data, status",
+    [
+        (1, ENTRY, 400),  # Not an array
+        (1, [ENTRY] * 4, 413),  # Too many entries
+        (2, [ENTRY], 403),  # Someone else's history
+    ],
+)
+def test_bulk_insert_errors(app, client, user_id, data, status, monkeypatch, capsys):
+    with capsys.disabled():
+        monkeypatch.setitem(app.config, "HISTORY_BULK_MAX_ROWS", 3)
+        response, body = post_bulk(client, user_id, data)
+        assert response.status_code == status
+        assert "message" in body
@@ -0,0 +1,119 @@
+from application import db
+from application.history_cache import fragment_cache, history_version
+from application.metrics import metrics
+from application.models import Entry, User, add_entries, add_entry, delete_entry
+from application.stats import rebuild_user_stats
+from sqlalchemy import event
+from datetime import datetime as dt
+import pytest
+
+
+def history_statements(client, url):
+    """Get a history page, returning it with the statements it ran, apart from reading the user's generation"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    return response.get_data(as_text=True), [statement for statement in statements if "history_versions" not in statement]
+
+
+@pytest.fixture
+def row(entry_listing):
+    """Builds a row of the history table, for add_entries"""
+
+    def build(user_id, **fields):
+        return dict(entry_listing, **fields, user_id=user_id, actual_price=None, difference=None, created=dt.utcnow())
+
+    return build
+
+
+# Range Testing
+def test_page_cached(client, stats_user, make_entry, capsys):
+    with capsys.disabled():
+        for difference in (5.0, -3.0):
+            add_entry(make_entry(stats_user, difference))
+        hits = fragment_cache.hits
+        first, statements = history_statements(client, "/history")
+        assert statements  # Rendered from the history
+        second, statements = history_statements(client, "/history")
+        assert statements == []  # Served from the cache, without reading the history or the summary
+        assert second == first and fragment_cache.hits == hits + 1
+        assert "rentier_history_cache_hits_total" in metrics.render()
+
+
+@pytest.mark.parametrize(
+    "url",
+    ["/history?per_page=10", "/history?col_sort=prediction", "/history?dir=asc", "/history?page=1", "/history?page=2&per_page=5"],
+)
+def test_pages_keyed_separately(client, stats_user, row, url, capsys):
+    with capsys.disabled():
+        add_entries([row(stats_user) for _ in range(7)])
+        history_statements(client, "/history")
+        # Another page, sort or page size is rendered on its own
+        _, statements = history_statements(client, url)
+        assert statements
+        _, statements = history_statements(client, url)
+        assert statements == []
+
+
+# Consistency Testing
+def test_writes_invalidate(client, stats_user, make_entry, row, capsys):
+    with capsys.disabled():
+        entry_id = add_entry(make_entry(stats_user, 5.0, neighborhood="Bedok"))
+        page, _ = history_statements(client, "/history")
+        assert "Bedok" in page
+
+        add_entry(make_entry(stats_user, 1.0, neighborhood="Tuas"))
+        page, statements = history_statements(client, "/history")
+        assert statements and "Tuas" in page
+
+        add_entries([row(stats_user, neighborhood="Yishun")])
+        page, _ = history_statements(client, "/history")
+        assert "Yishun" in page
+
+        delete_entry(db.session.get(Entry, entry_id))
+        page, _ = history_statements(client, "/history")
+        assert "Bedok" not in page
+
+
+def test_other_users_stay_cached(client, stats_user, make_entry, populate_users, capsys):
+    with capsys.disabled():
+        add_entry(make_entry(stats_user, 5.0))
+        history_statements(client, "/history")
+        other_id = db.session.query(User).filter_by(email="user_2@example.com").one().id
+        version = history_version(stats_user)
+        add_entry(make_entry(other_id, 1.0))
+        assert history_version(stats_user) == version
+        _, statements = history_statements(client, "/history")
+        assert statements == []
+        db.session.query(Entry).filter_by(user_id=other_id).delete()
+        db.session.commit()
+        rebuild_user_stats(other_id)
+
+
+def test_rebuild_invalidates(client, stats_user, make_entry, capsys):
+    with capsys.disabled():
+        add_entry(make_entry(stats_user, 5.0))
+        history_statements(client, "/history")
+        generation, _ = history_version(stats_user)
+        rebuild_user_stats()
+        assert history_version(stats_user)[0] == generation + 1
+        _, statements = history_statements(client, "/history")
+        assert statements
+
+
+# Expected Failure Testing
+@pytest.mark.parametrize("url", ["/history?col_sort=user_id", "/history?col_sort=beds", "/history?cursor=not-a-cursor"])
+def test_errors_not_cached(client, stats_user, url, capsys):
+    with capsys.disabled():
+        size = len(fragment_cache)
+        assert client.get(url).status_code == 400
+        assert client.get(url).status_code == 400
+        assert len(fragment_cache) == size
@@ -0,0 +1,170 @@
+from application import db
+from application.models import Entry, add_entry, delete_entry, get_history
+from application.stats import count_entries
+from sqlalchemy import event
+import threading
+import subprocess
+import sqlite3
+import sys
+import os
+import pytest
+
+# Run in a separate process against a database file, as the test database is in memory. Each thread has a connection
+# of its own, so the threads contend for the database's locks as separate processes would
+WORKER = """
+import random, sys, threading
+from app import app
+from application import db
+from application.models import Entry, User, add_entries, add_entry, delete_entry
+from datetime import datetime as dt
+from werkzeug.exceptions import HTTPException
+
+threads, operations = int(sys.argv[1]), int(sys.argv[2])
+LISTING = dict(
+    beds=1, bathrooms=1.0, accomodates=2, minimum_nights=3, room_type="Private room", wifi=True, elevator=False,
+    pool=False, link=None, prediction=100.0, actual_price=None,
+)
+
+
+def row(user_id, rng):
+    difference = rng.choice([None, rng.uniform(-50, 50)])
+    neighborhood = rng.choice(["Novena", "Bedok", "Orchard"])
+    return dict(LISTING, user_id=user_id, neighborhood=neighborhood, difference=difference, created=dt.utcnow())
+
+
+def work(user_id, rng, failures):
+    for _ in range(operations):
+        with app.test_request_context():
+            try:
+                action = rng.random()
+                if action < 0.4:
+                    add_entry(Entry(**row(user_id, rng)))
+                elif action < 0.5:
+                    add_entries([row(user_id, rng) for _ in range(rng.randint(1, 5))], return_ids=False)
+                else:
+                    # Deletes pick among the oldest entries, so that workers often delete the same entry
+                    entries = db.session.query(Entry).filter_by(user_id=user_id).order_by(Entry.id).limit(4).all()
+                    if entries:
+                        delete_entry(rng.choice(entries))
+            except HTTPException:
+                failures.append(1)
+
+
+with app.test_request_context():
+    user = User(email="counter@example.com", password_hash="x" * 64, created=dt.utcnow())
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+    add_entries([row(user_id, random.Random(0)) for _ in range(20)], return_ids=False)
+failures = []
+workers = [threading.Thread(target=work, args=(user_id, random.Random(idx), failures)) for idx in range(threads)]
+for worker in workers:
+    worker.start()
+for worker in workers:
+    worker.join()
+print(len(failures))
+"""
+
+
+def run_workers(tmp_path, profile, threads=8, operations=25):
+    config = tmp_path / "counter.cfg"
+    config.write_text(
+        'SECRET_KEY = "counter"\n'
+        f'SQLALCHEMY_DATABASE_URI = "sqlite:///{tmp_path / "counter.db"}"\n'
+        "SQLALCHEMY_TRACK_MODIFICATIONS = False\n"
+        f'SQLITE_PROFILE = "{profile}"\n'
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", WORKER, str(threads), str(operations)],
+        cwd=root,
+        env=dict(os.environ, TESTING=str(config)),
+        capture_output=True,
+        text=True,
+        timeout=300,
+    )
+    assert result.returncode == 0, result.stderr
+    return tmp_path / "counter.db", int(result.stdout.strip().splitlines()[-1])
+
+
+def count_statements():
+    """Statements counting the history, recorded while the context is open"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if "count(" in statement.lower() and "history" in statement.lower():
+            statements.append(statement)
+
+    class Recorder:
+        def __enter__(self):
+            event.listen(db.engine, "before_cursor_execute", record)
+            return statements
+
+        def __exit__(self, *args):
+            event.remove(db.engine, "before_cursor_execute", record)
+
+    return Recorder()
+
+
+# Consistency Testing
+def test_pages_use_count(stats_user, make_entry, capsys):
+    with capsys.disabled():
+        entries = [make_entry(stats_user, float(idx)) for idx in range(7)]
+        for entry in entries:
+            add_entry(entry)
+        with count_statements() as statements:
+            history = get_history(stats_user, 2, 3)
+        assert statements == []
+        assert history.total == 7 and history.pages == 3
+        assert len(history.items) == 3
+
+        delete_entry(entries[0])
+        delete_entry(entries[1])
+        history = get_history(stats_user, 1, 3)
+        assert history.total == count_entries(stats_user) == 5
+        assert history.pages == 2
+
+
+def test_concurrent_delete_counted_once(app, stats_user, make_entry, capsys):
+    with capsys.disabled():
+        add_entry(make_entry(stats_user, 1.0))
+        add_entry(make_entry(stats_user, 2.0))
+        entry_id = db.session.query(Entry).filter_by(user_id=stats_user).order_by(Entry.id).first().id
+        loaded, deleted = threading.Event(), threading.Event()
+        results = []
+
+        def other_request():
+            # Loads the entry in a session of its own, and deletes it once this request has deleted it
+            with app.test_request_context():
+                entry = db.session.get(Entry, entry_id)
+                loaded.set()
+                deleted.wait(timeout=10)
+                results.append(delete_entry(entry))
+
+        thread = threading.Thread(target=other_request)
+        thread.start()
+        assert loaded.wait(timeout=10)
+        delete_entry(db.session.get(Entry, entry_id))
+        deleted.set()
+        thread.join(timeout=10)
+        assert results == [entry_id]
+        assert count_entries(stats_user) == db.session.query(Entry).filter_by(user_id=stats_user).count() == 1
+
+
+@pytest.mark.parametrize("profile", ["default", "production"])
+def test_concurrent_writers(tmp_path, profile, capsys):
+    with capsys.disabled():
+        path, failures = run_workers(tmp_path, profile)
+        with sqlite3.connect(path) as connection:
+            user_id, count = connection.execute(
+                "SELECT users.id, user_stats.entries FROM users JOIN user_stats ON user_stats.user_id = users.id"
+            ).fetchone()
+            (total,) = connection.execute("SELECT COUNT(*) FROM history WHERE user_id = ?", (user_id,)).fetchone()
+            breakdowns = connection.execute(
+                "SELECT breakdown, SUM(entries) FROM user_stats_breakdown WHERE user_id = ? GROUP BY breakdown",
+                (user_id,),
+            ).fetchall()
+        assert count == total
+        assert dict(breakdowns) == {"neighborhood": total, "room_type": total}
+        # Writes that failed (e.g. on a lock timeout) are rolled back along with their summary update
+        assert failures < 8 * 25 // 10
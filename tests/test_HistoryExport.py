@@ -0,0 +1,59 @@
+from application.export import FIELDS
+from application.models import iter_history
+import pytest
+import json
+import csv
+import io
+
+
+@pytest.mark.parametrize("chunk_size", [1000, 5, 1])
+def test_export_ndjson(app, client, paged_user, n_paged_entries, expected_order, chunk_size, monkeypatch, capsys):
+    with capsys.disabled():
+        monkeypatch.setitem(app.config, "HISTORY_EXPORT_CHUNK_SIZE", chunk_size)
+        response = client.get(f"/api/history/{paged_user}/export")
+        assert response.status_code == 200
+        assert response.is_streamed
+        assert response.mimetype == "application/x-ndjson"
+        assert f"history_{paged_user}.ndjson" in response.headers["Content-Disposition"]
+
+        entries = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert len(entries) == n_paged_entries
+        assert [entry["entry_id"] for entry in entries] == expected_order(paged_user, "created", True)
+        assert all(list(entry.keys()) == FIELDS for entry in entries)
+
+
+@pytest.mark.parametrize("col_sort, desc", [("prediction", False), ("actual_price", True)])
+def test_export_csv(client, paged_user, expected_order, col_sort, desc, capsys):
+    with capsys.disabled():
+        response = client.get(
+            f"/api/history/{paged_user}/export?format=csv&col_sort={col_sort}&dir={'desc' if desc else 'asc'}"
+        )
+        assert response.status_code == 200
+        assert response.mimetype == "text/csv"
+
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+        assert [int(row["entry_id"]) for row in rows] == expected_order(paged_user, col_sort, desc)
+
+
+def test_iter_history_chunks(paged_user, n_paged_entries, expected_order, capsys):
+    with capsys.disabled():
+        # Chunks seek past each other, so every entry is read exactly once whatever the chunk size
+        for chunk_size in (1, 4, n_paged_entries, n_paged_entries + 1):
+            ids = [row.id for row in iter_history(paged_user, "actual_price", False, chunk_size)]
+            assert ids == expected_order(paged_user, "actual_price", False)
+
+
+@pytest.mark.usefixtures("fake_login")
+@pytest.mark.parametrize(
+    "url, status",
+    [
+        ("/api/history/1/export?format=xml", 400),
+        ("/api/history/1/export?col_sort=password_hash", 400),
+        ("/api/history/2/export", 403),  # Someone else's history
+    ],
+)
+def test_export_errors(client, url, status, capsys):
+    with capsys.disabled():
+        response = client.get(url)
+        assert response.status_code == status
+        assert "message" in json.loads(response.get_data(as_text=True))
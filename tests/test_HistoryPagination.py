@@ -0,0 +1,160 @@
+from application import db
+from application.models import Entry, get_history, get_history_page
+from application.pagination import InvalidCursor, encode_cursor
+from datetime import datetime as dt
+from urllib.parse import urlsplit
+from werkzeug.exceptions import NotFound
+import pytest
+import json
+import re
+
+
+@pytest.mark.parametrize(
+    "col_sort, desc, per_page",
+    [
+        ("created", True, 5),
+        ("created", False, 4),
+        ("prediction", True, 5),
+        ("actual_price", True, 3),
+        ("actual_price", False, 6),
+        ("difference", False, 23),  # Every entry has a NULL difference
+        ("prediction", False, 50),
+    ],
+)
+def test_keyset_pages(paged_user, expected_order, col_sort, desc, per_page, capsys):
+    with capsys.disabled():
+        expected = expected_order(paged_user, col_sort, desc)
+
+        # Walking forward visits every entry once, in order
+        pages = [get_history_page(paged_user, per_page, col_sort, desc)]
+        assert not pages[0].has_prev
+        while pages[-1].has_next:
+            pages.append(get_history_page(paged_user, per_page, col_sort, desc, pages[-1].next_cursor))
+        assert [entry.id for page in pages for entry in page.items] == expected
+        assert all(len(page.items) == per_page for page in pages[:-1])
+
+        # Walking backward from the last page gives back the same pages
+        page = pages[-1]
+        for previous in reversed(pages[:-1]):
+            page = get_history_page(paged_user, per_page, col_sort, desc, page.prev_cursor)
+            assert [entry.id for entry in page.items] == [entry.id for entry in previous.items]
+        assert not page.has_prev
+
+
+def test_api_pagination(client, paged_user, n_paged_entries, expected_order, capsys):
+    with capsys.disabled():
+        ids = []
+        url = f"/api/history/{paged_user}?per_page=10&col_sort=prediction&dir=asc"
+        while url is not None:
+            response = client.get(url)
+            assert response.status_code == 200
+            ids += [entry["entry_id"] for entry in json.loads(response.get_data(as_text=True))]
+            links = dict(
+                (rel, target)
+                for target, rel in re.findall(r'<([^>]+)>; rel="(\w+)"', response.headers.get("Link", ""))
+            )
+            url = None
+            if "next" in links:
+                parts = urlsplit(links["next"])
+                url = f"{parts.path}?{parts.query}"
+        assert ids == expected_order(paged_user, "prediction", False)
+
+        # Page sizes are bounded
+        response = client.get(f"/api/history/{paged_user}?per_page=100000")
+        assert len(json.loads(response.get_data(as_text=True))) == n_paged_entries
+
+        # Numbered pages still work
+        response = client.get(f"/api/history/{paged_user}?page=3&per_page=10")
+        assert [entry["entry_id"] for entry in json.loads(response.get_data(as_text=True))] == expected_order(
+            paged_user, "created", True
+        )[20:]
+
+
+def test_projected_rows(client, paged_user, n_paged_entries, capsys):
+    with capsys.disabled():
+        entries = {entry.id: entry for entry in db.session.query(Entry).filter_by(user_id=paged_user)}
+        columns = ["beds", "prediction", "link"]
+        # The cursors need the id and sort column, which are selected even when not asked for
+        page = get_history_page(paged_user, 10, "actual_price", False, columns=columns)
+        numbered = get_history(paged_user, 2, 10, "actual_price", False, columns=columns)
+        assert list(page.items[0]._mapping) == columns + ["id", "actual_price"]
+        assert list(numbered.items[0]._mapping) == columns
+        assert numbered.total == n_paged_entries and numbered.pages == 3
+        for row in page.items:
+            assert not isinstance(row, Entry)
+            entry = entries[row.id]
+            assert (row.beds, row.prediction, row.link, row.actual_price) == (
+                entry.beds,
+                entry.prediction,
+                entry.link,
+                entry.actual_price,
+            )
+
+        # The API returns the same values as the entries, under the same keys as before
+        response = client.get(f"/api/history/{paged_user}?per_page=100")
+        for record in json.loads(response.get_data(as_text=True)):
+            entry = entries[record.pop("entry_id")]
+            assert record.pop("created") == entry.created.strftime("%a, %d %b %Y %H:%M:%S GMT")
+            assert record == {
+                key: getattr(entry, key) for key in Entry.__table__.columns.keys() if key not in ("id", "created")
+            }
+
+
+def test_history_view_pagination(client, paged_user, capsys):
+    with capsys.disabled():
+        first = client.get("/history?per_page=5")
+        assert first.status_code == 200
+        cursor = re.search(r"cursor=([\w.\-]+)", first.get_data(as_text=True)).group(1)
+        assert client.get(f"/history?per_page=5&cursor={cursor}").status_code == 200
+        assert client.get("/history?page=2&per_page=5").status_code == 200
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "cursor=not-a-cursor",
+        "col_sort=prediction&cursor=" + "{created_cursor}",  # Cursor made for another sort order
+        "col_sort=password_hash",
+        "col_sort=beds",  # Not indexed, so not sortable
+    ],
+)
+def test_invalid_pagination(client, paged_user, query, capsys):
+    with capsys.disabled():
+        query = query.format(created_cursor=encode_cursor("created", True, dt(2021, 1, 1), 1))
+        response = client.get(f"/api/history/{paged_user}?{query}")
+        assert response.status_code == 400
+        assert client.get(f"/history?{query}").status_code == 400
+
+
+@pytest.mark.parametrize("page", [0, -1, 4, 100])
+def test_missing_page(client, paged_user, page, capsys):
+    with capsys.disabled():
+        # Pages that do not exist are 404s, rather than being turned into errors by the query's handler
+        with pytest.raises(NotFound):
+            get_history(paged_user, page, 10)
+        # The history page checks the page number first, like the API
+        assert client.get(f"/history?page={page}&per_page=10").status_code == (404 if page > 0 else 400)
+
+
+@pytest.mark.parametrize("page", ["abc", "1.5", ""])
+def test_invalid_page(client, paged_user, page, capsys):
+    with capsys.disabled():
+        assert client.get(f"/history?page={page}").status_code == 400
+        assert client.get(f"/api/history/{paged_user}?page={page}").status_code == 400
+
+
+@pytest.mark.parametrize("page, status", [("abc", 400), (0, 400), (-1, 400), (4, 404), (100, 404)])
+def test_api_missing_page(client, paged_user, page, status, capsys):
+    with capsys.disabled():
+        response = client.get(f"/api/history/{paged_user}?page={page}&per_page=10")
+        assert response.status_code == status
+        assert "message" in response.get_json()
+
+
+def test_cursor_sort_order(paged_user, capsys):
+    with capsys.disabled():
+        cursor = get_history_page(paged_user, 5, "created", True).next_cursor
+        with pytest.raises(InvalidCursor):
+            get_history_page(paged_user, 5, "created", False, cursor)
+        with pytest.raises(ValueError):
+            get_history_page(paged_user, 5, "password_hash", True)
@@ -0,0 +1,169 @@
+from application import db
+from application.history_writer import HistoryWriter, history_writer, write_rows
+from application.models import Entry
+from sqlalchemy.exc import OperationalError
+import threading
+import pytest
+
+
+def test_writer_batches(capsys):
+    with capsys.disabled():
+        release = threading.Event()
+        batches = []
+
+        def write_fn(rows):
+            release.wait(5)  # Hold the first batch, so that the other rows queue up behind it
+            batches.append(list(rows))
+
+        writer = HistoryWriter(write_fn, max_queue=100, max_batch=16)
+        for row in range(50):
+            writer.submit(row)
+        release.set()
+        assert writer.flush(timeout=5)
+
+        # Every row is written once, in order, in batches no larger than max_batch
+        assert [row for batch in batches for row in batch] == list(range(50))
+        assert max(len(batch) for batch in batches) <= 16
+        assert len(batches) < 50, "Queued rows should have been committed together"
+        stats = writer.stats()
+        assert stats["queued"] == 0
+        assert stats["written"] == 50
+        assert stats["batches"] == len(batches)
+        assert sum(size * count for size, count in stats["batch_sizes"].items()) == 50
+
+
+def test_writer_overflow(capsys):
+    with capsys.disabled():
+        release = threading.Event()
+        written = []
+
+        def write_fn(rows):
+            if threading.current_thread().name == "history-writer":
+                release.wait(5)
+            written.extend(rows)
+
+        writer = HistoryWriter(write_fn, max_queue=2, max_batch=1)
+        for row in range(6):
+            writer.submit(row)
+        # The writer holds one row and the queue two, so the others were written by the caller
+        assert writer.stats()["overflows"] >= 3
+        release.set()
+        assert writer.flush(timeout=5)
+        assert sorted(written) == list(range(6))
+
+
+def test_writer_retry(capsys):
+    with capsys.disabled():
+        written = []
+        failed = []
+
+        def write_fn(rows):
+            if not failed:
+                failed.append(list(rows))
+                raise ValueError("Database is locked")
+            written.extend(rows)
+
+        writer = HistoryWriter(write_fn, max_batch=16, retry_delay=0.001)
+        for row in range(5):
+            writer.submit(row)
+        assert writer.flush(timeout=5)
+
+        # The batch that failed once is committed by a retry
+        assert sorted(written) == list(range(5))
+        stats = writer.stats()
+        assert stats["retries"] == 1
+        assert stats["failures"] == stats["dropped"] == 0
+        assert stats["written"] == 5
+
+
+def test_writer_retry_stored(paged_user, n_paged_entries, capsys):
+    with capsys.disabled():
+        calls = []
+
+        def write_fn(rows):
+            calls.append(len(rows))
+            if len(calls) == 1:
+                raise OperationalError("INSERT INTO history", {}, Exception("database is locked"))
+            write_rows(rows)
+
+        entry = db.session.query(Entry).filter_by(user_id=paged_user).first()
+        row = {column.name: getattr(entry, column.name) for column in Entry.__table__.columns if column.name != "id"}
+        writer = HistoryWriter(write_fn, retry_delay=0.001)
+        writer.submit(dict(row, link="https://www.airbnb.com/rooms/1"))
+        writer.submit(dict(row, link="https://www.airbnb.com/rooms/2"))
+        assert writer.flush(timeout=5)
+        links = [entry.link for entry in db.session.query(Entry).filter_by(user_id=paged_user)]
+        assert len(links) == n_paged_entries + 2
+        assert {"https://www.airbnb.com/rooms/1", "https://www.airbnb.com/rooms/2"} <= set(links)
+
+
+def test_writer_failure(capsys):
+    with capsys.disabled():
+        written = []
+
+        def write_fn(rows):
+            if 0 in rows:
+                raise ValueError("Database is locked")
+            written.extend(rows)
+
+        writer = HistoryWriter(write_fn, max_batch=1, retries=2, retry_delay=0.001)
+        writer.submit(0)
+        writer.submit(1)
+        assert writer.flush(timeout=5)
+
+        # The row that kept failing is reported as lost, and the writer keeps going
+        stats = writer.stats()
+        assert stats["retries"] == 2
+        assert stats["failures"] == 1
+        assert stats["dropped"] == 1
+        assert "Database is locked" in stats["last_error"]
+        assert stats["written"] == 1
+
+
+def test_writer_failure_split(capsys):
+    with capsys.disabled():
+        release = threading.Event()
+        written = []
+
+        def write_fn(rows):
+            release.wait(5)
+            if 3 in rows:
+                raise ValueError("Row rejected")
+            written.extend(rows)
+
+        writer = HistoryWriter(write_fn, max_batch=16, retries=1, retry_delay=0.001)
+        for row in range(6):
+            writer.submit(row)
+        release.set()
+        assert writer.flush(timeout=5)
+
+        # A batch that keeps failing is committed one row at a time, losing only the row that is rejected
+        assert sorted(written) == [0, 1, 2, 4, 5]
+        assert writer.stats()["dropped"] == 1
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_predict_write_mode(app, client, paged_user, n_paged_entries, mode, monkeypatch, capsys):
+    with capsys.disabled():
+        monkeypatch.setitem(app.config, "HISTORY_WRITE_MODE", mode)
+        monkeypatch.setitem(app.config, "WTF_CSRF_ENABLED", False)
+        form = {
+            "beds": 2,
+            "bathrooms": 1,
+            "accomodates": 3,
+            "minimum_nights": 7,
+            "room_type": "Shared room",
+            "neighborhood": "Marine Parade",
+            "wifi": "y",
+            "actual_price": 90,
+            "link": "https://www.airbnb.com/rooms/123",
+        }
+        response = client.post("/predict", data=form)
+        assert response.status_code == 200
+        assert history_writer.flush(timeout=5)
+
+        entries = db.session.query(Entry).filter_by(user_id=paged_user).order_by(Entry.id.desc()).all()
+        assert len(entries) == n_paged_entries + 1
+        assert entries[0].minimum_nights == 7
+        assert entries[0].link == "https://www.airbnb.com/rooms/123"
+        assert entries[0].model_version is not None
@@ -0,0 +1,88 @@
+from application.executor import InferenceUnavailable, ProcessInferenceExecutor
+from application.inference import WARMUP_ROW, current_model, predict_rows, prediction_cache
+import application.inference as inference
+import os
+import threading
+import time
+import pytest
+import json
+
+
+def test_executor_predictions(capsys):
+    with capsys.disabled():
+        rows = [WARMUP_ROW, dict(WARMUP_ROW, beds=2, accomodates=4, pool=True)]
+        executor = ProcessInferenceExecutor(workers=1, timeout=120)
+        try:
+            predictions, version = executor.predict(rows)
+        finally:
+            executor.shutdown()
+
+        # The child loads the same model, so it predicts exactly what this process does
+        assert predictions == predict_rows(rows)
+        assert version == current_model().version
+
+
+def test_executor_backpressure(capsys):
+    with capsys.disabled():
+        executor = ProcessInferenceExecutor(workers=1, max_pending=1, timeout=30, initializer=None)
+        try:
+            executor.call(time.sleep, 0)  # Start the child before filling the queue
+            busy = threading.Thread(target=executor.call, args=(time.sleep, 1))
+            busy.start()
+            time.sleep(0.1)
+            with pytest.raises(InferenceUnavailable) as error:
+                executor.call(time.sleep, 0)
+            assert error.value.code == 503
+            assert executor.rejected == 1
+            busy.join()
+
+            # The slot is freed once the running call completes
+            assert executor.call(abs, -1) == 1
+        finally:
+            executor.shutdown()
+
+
+def test_executor_timeout(capsys):
+    with capsys.disabled():
+        executor = ProcessInferenceExecutor(workers=1, timeout=0.2, initializer=None)
+        try:
+            with pytest.raises(InferenceUnavailable):
+                executor.call(time.sleep, 2)
+            assert executor.timeouts == 1
+        finally:
+            executor.shutdown()
+
+
+def test_executor_child_died(capsys):
+    with capsys.disabled():
+        executor = ProcessInferenceExecutor(workers=1, timeout=30, initializer=None)
+        try:
+            with pytest.raises(InferenceUnavailable) as error:
+                executor.call(os._exit, 1)  # As if the child was killed
+            assert error.value.code == 503
+            assert executor.broken == 1
+
+            # The next call runs in a new pool
+            assert executor.call(abs, -1) == 1
+            assert executor.broken == 1
+        finally:
+            executor.shutdown()
+
+
+@pytest.mark.usefixtures("fake_login")
+def test_predict_api_unavailable(app, client, monkeypatch, capsys):
+    with capsys.disabled():
+        def full(rows):
+            raise InferenceUnavailable("Too many predictions are pending. Please try again later.")
+
+        prediction_cache.clear()
+        monkeypatch.setattr(inference.process_executor, "predict", full)
+        monkeypatch.setitem(app.config, "INFERENCE_EXECUTOR", "process")
+        data = dict(WARMUP_ROW, actual_price=None)
+        response = client.post(
+            "/api/predict", data=json.dumps(data), content_type="application/json"
+        )
+        response_body = json.loads(response.get_data(as_text=True))
+
+        assert response.status_code == 503
+        assert response_body["message"] == "Too many predictions are pending. Please try again later."
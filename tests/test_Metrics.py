@@ -0,0 +1,96 @@
+from application.metrics import MetricsRegistry, Summary, STAGE_METRIC
+import time
+import pytest
+
+
+def test_summary_quantiles(capsys):
+    with capsys.disabled():
+        summary = Summary(window=100)
+        for value in range(1, 201):
+            summary.observe(float(value))
+        snapshot = summary.snapshot()
+
+        # Count and sum cover every sample, quantiles only the window of recent ones
+        assert snapshot["count"] == 200
+        assert snapshot["sum"] == sum(range(1, 201))
+        assert snapshot["quantiles"][0.5] == 151
+        assert snapshot["quantiles"][0.99] == 200
+
+
+def test_render(capsys):
+    with capsys.disabled():
+        registry = MetricsRegistry()
+        registry.observe(STAGE_METRIC, 0.5, stage="predict.inference")
+        registry.observe(STAGE_METRIC, 1.5, stage="predict.inference")
+        registry.register_collector(
+            lambda: [("rentier_things_total", "counter", "Things", {"kind": 'a"b'}, 3)]
+        )
+        text = registry.render()
+
+        assert f"# TYPE {STAGE_METRIC} summary" in text
+        assert f'{STAGE_METRIC}{{stage="predict.inference",quantile="0.5"}} 1.5' in text
+        assert f'{STAGE_METRIC}_count{{stage="predict.inference"}} 2' in text
+        assert f'{STAGE_METRIC}_sum{{stage="predict.inference"}} 2.0' in text
+        assert "# TYPE rentier_things_total counter" in text
+        assert 'rentier_things_total{kind="a\\"b"} 3.0' in text
+
+
+def test_render_histogram(capsys):
+    with capsys.disabled():
+        registry = MetricsRegistry()
+        histogram = {"buckets": [(1, 2), (4, 5), (float("inf"), 6)], "sum": 17, "count": 6}
+        registry.register_collector(lambda: [("rentier_sizes", "histogram", "Sizes", {}, histogram)])
+        text = registry.render()
+
+        assert "# TYPE rentier_sizes histogram" in text
+        assert 'rentier_sizes_bucket{le="1"} 2.0' in text
+        assert 'rentier_sizes_bucket{le="+Inf"} 6.0' in text
+        assert "rentier_sizes_sum 17.0" in text
+        assert "rentier_sizes_count 6.0" in text
+
+
+def test_timer_overhead(capsys):
+    with capsys.disabled():
+        registry = MetricsRegistry()
+        n = 10000
+        start = time.perf_counter()
+        for _ in range(n):
+            with registry.stage("test.overhead"):
+                pass
+        per_call = (time.perf_counter() - start) / n
+        assert registry.summary(STAGE_METRIC, stage="test.overhead").count == n
+        assert per_call < 50e-6, "Timers should be cheap enough to leave on"
+
+
+def test_disabled(capsys):
+    with capsys.disabled():
+        registry = MetricsRegistry(enabled=False)
+        with registry.stage("test.disabled"):
+            pass
+        registry.observe(STAGE_METRIC, 1.0, stage="test.disabled")
+        assert registry.render() == "\n"
+
+
+@pytest.mark.usefixtures("fake_login")
+def test_metrics_endpoint(client, capsys):
+    with capsys.disabled():
+        client.get("/history")
+        response = client.get("/metrics")
+        text = response.get_data(as_text=True)
+
+        assert response.status_code == 200
+        assert response.mimetype == "text/plain"
+        assert f'{STAGE_METRIC}_count{{stage="history.query"}}' in text
+        assert 'rentier_request_duration_seconds_count{endpoint="history",method="GET"}' in text
+        assert "rentier_prediction_cache_hits_total" in text
+        assert "rentier_model_info{version=" in text
+
+
+@pytest.mark.parametrize("headers,status", [({}, 401), ({"Authorization": "Bearer wrong"}, 401), ({"Authorization": "Bearer scrape-me"}, 200)])
+def test_metrics_token(client, monkeypatch, headers, status, capsys):
+    with capsys.disabled():
+        monkeypatch.setitem(client.application.config, "METRICS_TOKEN", "scrape-me")
+        response = client.get("/metrics", headers=headers)
+        assert response.status_code == status
+        if status == 401:
+            assert "rentier_" not in response.get_data(as_text=True)
@@ -0,0 +1,106 @@
+from application.batching import MicroBatcher
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import threading
+import time
+import pytest
+
+
+def double_rows(rows):
+    return [row * 2 for row in rows]
+
+
+@pytest.mark.parametrize("n_requests, max_batch_size", [(1, 64), (50, 64), (200, 16)])
+def test_microbatcher_results(n_requests, max_batch_size, capsys):
+    with capsys.disabled():
+        calls = []
+
+        def predict_fn(rows):
+            calls.append(len(rows))
+            return double_rows(rows)
+
+        batcher = MicroBatcher(predict_fn, max_batch_size=max_batch_size, max_wait_ms=20)
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            results = list(pool.map(batcher.predict, range(n_requests)))
+
+        # Each caller gets back its own result
+        assert results == double_rows(range(n_requests))
+
+        # Batches never exceed the maximum size, and counters add up
+        assert max(calls) <= max_batch_size
+        stats = batcher.stats()
+        assert stats["requests"] == n_requests
+        assert stats["batches"] == len(calls)
+        assert sum(size * count for size, count in stats["batch_sizes"].items()) == n_requests
+        assert stats["queue_delay_max"] >= stats["queue_delay_mean"] >= 0
+
+
+def test_microbatcher_coalesces(capsys):
+    with capsys.disabled():
+        release = threading.Event()
+        calls = []
+
+        def predict_fn(rows):
+            release.wait(5)  # Hold the first batch, so that the other requests queue up behind it
+            calls.append(len(rows))
+            return double_rows(rows)
+
+        batcher = MicroBatcher(predict_fn, max_batch_size=64, max_wait_ms=1)
+        futures = [batcher.submit(0)]
+        futures += [batcher.submit(i) for i in range(1, 33)]
+        release.set()
+        assert [future.result(5) for future in futures] == double_rows(range(33))
+        assert len(calls) < 33, "Queued requests should have been predicted together"
+
+
+def test_microbatcher_histogram(capsys):
+    with capsys.disabled():
+        release = threading.Event()
+
+        def predict_fn(rows):
+            release.wait(5)
+            return double_rows(rows)
+
+        batcher = MicroBatcher(predict_fn, max_batch_size=12, max_wait_ms=1)
+        futures = [batcher.submit(0)]
+        futures += [batcher.submit(i) for i in range(1, 11)]
+        release.set()
+        [future.result(5) for future in futures]
+        histogram = batcher.batch_size_histogram()
+        assert [bound for bound, _ in histogram["buckets"]] == [1, 2, 4, 8, 12, float("inf")]
+        counts = [count for _, count in histogram["buckets"]]
+        assert counts == sorted(counts) and counts[-1] == histogram["count"] == batcher.batches
+        assert histogram["sum"] == 11
+
+
+def test_microbatcher_timeout(capsys):
+    with capsys.disabled():
+        release = threading.Event()
+        calls = []
+
+        def predict_fn(rows):
+            calls.append(list(rows))
+            release.wait(5)  # Stuck until released
+            return double_rows(rows)
+
+        batcher = MicroBatcher(predict_fn, max_wait_ms=1)
+        first = batcher.submit(1)
+        while not calls:  # The first batch is being predicted, so the next row waits in the queue
+            time.sleep(0.001)
+        with pytest.raises(TimeoutError):
+            batcher.predict(2, timeout=0.05)
+        release.set()
+        assert first.result(5) == 2
+        assert batcher.predict(3, timeout=5) == 6
+        # The row that timed out while queued was dropped instead of predicted
+        assert [row for rows in calls for row in rows] == [1, 3]
+        assert batcher.stats()["timeouts"] == 1
+
+
+def test_microbatcher_errors(capsys):
+    with capsys.disabled():
+        def predict_fn(rows):
+            raise ValueError("Model failed")
+
+        batcher = MicroBatcher(predict_fn)
+        with pytest.raises(ValueError):
+            batcher.predict(1, timeout=5)
@@ -0,0 +1,65 @@
+from application import db
+from application.migrations import upgrade_database
+from application.models import Entry, SORTABLE_COLUMNS, add_entry
+from application.stats import check_user_stats, get_user_stats, user_stats, user_stats_breakdown
+from sqlalchemy import inspect, text
+import pytest
+
+
+def history_indexes():
+    return {index["name"] for index in inspect(db.engine).get_indexes("history")}
+
+
+def test_history_indexes(capsys):
+    with capsys.disabled():
+        # Every column the history can be sorted by has an index, and no other column does
+        expected = {f"ix_history_user_id_{column}" for column in SORTABLE_COLUMNS}
+        assert "user_id" not in SORTABLE_COLUMNS
+        assert {name for name in history_indexes() if name.startswith("ix_history_user_id_")} == expected
+
+
+@pytest.mark.parametrize("col_sort", ["created", "prediction", "difference"])
+def test_missing_index_created(col_sort, capsys):
+    with capsys.disabled():
+        name = f"ix_history_user_id_{col_sort}"
+        db.session.execute(text(f'DROP INDEX "{name}"'))
+        db.session.commit()
+        assert name not in history_indexes()
+
+        # Recreated on an existing database, and used to sort a user's history
+        assert name in upgrade_database()
+        assert name in history_indexes()
+        plan = db.session.execute(
+            text(f"EXPLAIN QUERY PLAN SELECT * FROM history WHERE user_id = 1 ORDER BY {col_sort} DESC")
+        ).fetchall()
+        assert any(name in row[-1] for row in plan)
+
+        # Nothing left to do on the next start
+        assert upgrade_database() == []
+
+
+def test_obsolete_index_dropped(capsys):
+    with capsys.disabled():
+        # An index on a column the history is no longer sorted by, as in a database created before
+        db.session.execute(text('CREATE INDEX "ix_history_user_id_link" ON history (user_id, link)'))
+        db.session.commit()
+        assert upgrade_database() == ["-ix_history_user_id_link"]
+        assert "ix_history_user_id_link" not in history_indexes()
+        assert "link" not in SORTABLE_COLUMNS
+
+
+def test_missing_stats_computed(stats_user, make_entry, capsys):
+    with capsys.disabled():
+        add_entry(make_entry(stats_user, 6.0))
+        add_entry(make_entry(stats_user, -2.0))
+        # As on a database whose history was written before the summaries existed
+        db.session.execute(user_stats.delete())
+        db.session.execute(user_stats_breakdown.delete())
+        db.session.commit()
+        assert get_user_stats(stats_user)["entries"] == 0
+
+        assert "user_stats" in upgrade_database()
+        assert check_user_stats() == []
+        assert get_user_stats(stats_user)["entries"] == 2
+        assert get_user_stats(stats_user)["median_difference"] == 2.0
+        assert upgrade_database() == []
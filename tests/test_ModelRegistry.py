@@ -0,0 +1,170 @@
+from application import ai_model
+from application.inference import registry, prediction_cache
+from application.registry import (
+    LoadedModel,
+    ModelRegistry,
+    activate,
+    publish,
+    read_manifest,
+)
+import joblib
+import json
+import os
+import pytest
+import threading
+
+
+@pytest.fixture
+def registry_dir(tmp_path):
+    model_path = tmp_path / "model.joblib"
+    model_path.write_bytes(b"model")
+    return str(tmp_path / "registry"), str(model_path)
+
+
+def test_publish(registry_dir, capsys):
+    with capsys.disabled():
+        directory, model_path = registry_dir
+        publish(directory, model_path, "1")
+        publish(directory, model_path, "2", activate=False)
+        manifest = read_manifest(directory)
+        assert manifest["current"] == "1"
+        assert set(manifest["versions"]) == {"1", "2"}
+        activate(directory, "2")
+        assert read_manifest(directory)["current"] == "2"
+
+
+@pytest.mark.xfail(reason="Version already published", raises=ValueError, strict=True)
+def test_publish_duplicate(registry_dir):
+    directory, model_path = registry_dir
+    publish(directory, model_path, "1")
+    publish(directory, model_path, "1")
+
+
+def test_registry_swap(registry_dir, capsys):
+    with capsys.disabled():
+        directory, model_path = registry_dir
+        loading = threading.Event()
+        release = threading.Event()
+
+        def load(version, path):
+            loading.set()
+            release.wait(5)
+            return LoadedModel(version, model=path)
+
+        models = ModelRegistry(LoadedModel("1", model=None), directory=directory, load=load)
+        assert models.check() is None  # Nothing published yet
+        publish(directory, model_path, "2")
+        thread = models.check()
+        assert loading.wait(5)
+        # Requests keep being served by the old version while the new one loads
+        assert models.current.version == "1"
+        assert models.check() is None, "Version 2 is already being loaded"
+        release.set()
+        thread.join(5)
+        assert models.current.version == "2"
+        assert models.swaps == 1
+
+
+def test_registry_failed_load(registry_dir, capsys):
+    with capsys.disabled():
+        directory, model_path = registry_dir
+
+        def load(version, path):
+            raise ValueError("Corrupt artifact")
+
+        models = ModelRegistry(LoadedModel("1", model=None), directory=directory, load=load)
+        publish(directory, model_path, "2")
+        models.check().join(5)
+        assert models.current.version == "1"
+        assert models.failures == 1
+        assert "Corrupt artifact" in models.last_error
+
+        # Polling again does not retry the broken version
+        assert models.check() is None
+        assert models.failures == 1
+
+        # Until its artifact is replaced
+        artifact = os.path.join(directory, "2.joblib")
+        stat = os.stat(artifact)
+        os.utime(artifact, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        models.check().join(5)
+        assert models.failures == 2
+
+
+def test_registry_broken_manifest(registry_dir, capsys):
+    with capsys.disabled():
+        directory, model_path = registry_dir
+        models = ModelRegistry(
+            LoadedModel("1", model=None), directory=directory, load=lambda version, path: LoadedModel(version, model=path)
+        )
+        os.makedirs(directory)
+        manifest_path = os.path.join(directory, "manifest.json")
+        with open(manifest_path, "w") as f:
+            f.write("{not json")
+
+        # The same broken manifest is counted once, however many times it is polled
+        for _ in range(3):
+            models.poll()
+        assert models.failures == 1
+        assert models.last_error is not None
+
+        # A different broken manifest is another failure
+        with open(manifest_path, "w") as f:
+            json.dump({"current": "3", "versions": {}}, f)
+        stat = os.stat(manifest_path)
+        os.utime(manifest_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        models.poll()
+        models.poll()
+        assert models.failures == 2
+
+        # Once fixed, the manifest is read as before
+        with open(manifest_path, "w") as f:
+            json.dump({"current": None, "versions": {}}, f)
+        models.poll()
+        assert models.failures == 2
+
+        # And breaking it again is a new failure
+        with open(manifest_path, "w") as f:
+            f.write("{not json")
+        stat = os.stat(manifest_path)
+        os.utime(manifest_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10 ** 9))
+        models.poll()
+        models.poll()
+        assert models.failures == 3
+
+
+@pytest.mark.usefixtures("fake_login")
+def test_registry_predict_api(client, tmp_path, capsys):
+    with capsys.disabled():
+        model_path = str(tmp_path / "model.joblib")
+        joblib.dump(ai_model, model_path)
+        directory = str(tmp_path / "registry")
+        publish(directory, model_path, "test-version")
+        data = {
+            "beds": 1,
+            "bathrooms": 1,
+            "accomodates": 1,
+            "minimum_nights": 81,
+            "room_type": "Private room",
+            "neighborhood": "Novena",
+            "wifi": True,
+            "elevator": False,
+            "pool": False,
+            "actual_price": 115,
+        }
+        original = registry.current
+        before = json.loads(
+            client.post("/api/predict", data=json.dumps(data), content_type="application/json").get_data(as_text=True)
+        )
+        try:
+            registry.directory = directory
+            registry.check().join(30)
+            response = client.post("/api/predict", data=json.dumps(data), content_type="application/json")
+            response_body = json.loads(response.get_data(as_text=True))
+            assert response.status_code == 200
+            assert response_body["model_version"] == "test-version"
+            assert response_body["prediction"] == pytest.approx(before["prediction"])
+            assert prediction_cache.stats()["invalidations"] >= 1
+        finally:
+            registry.directory = None
+            registry.current = original
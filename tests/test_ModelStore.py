@@ -0,0 +1,46 @@
+from application import ai_model
+from application.inference import make_model_input
+from application.model_store import (
+    MappedModel,
+    load_model,
+    sidecar_is_fresh,
+    sidecar_path,
+)
+import joblib
+import numpy as np
+import os
+import pytest
+
+
+@pytest.fixture(scope="module")
+def model_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("model") / "model.joblib")
+    joblib.dump(ai_model, path)
+    return path
+
+
+def test_mmap_load(model_path, all_listings, capsys):
+    with capsys.disabled():
+        assert not sidecar_is_fresh(model_path)
+        model = load_model(model_path, mmap=True)
+        assert sidecar_is_fresh(model_path)
+        assert isinstance(model, MappedModel)
+        # The forest is read from memory-mapped files rather than copied into each process
+        assert isinstance(model.forest.value, np.memmap)
+        assert isinstance(model.forest.children, np.memmap)
+
+        rows = all_listings([(1, 1.5, 6, 1), (1, 1, 1, 81), (2, 2.7, 13, 3650)])
+        X = make_model_input(rows)
+        assert np.array_equal(model.predict(X), ai_model.predict(X))
+
+
+def test_mmap_stale_sidecar(model_path, capsys):
+    with capsys.disabled():
+        load_model(model_path, mmap=True)
+        # Replacing the model should make the sidecar stale, and loading again should export it anew
+        joblib.dump(ai_model, model_path)
+        os.utime(model_path, ns=(0, 0))
+        assert not sidecar_is_fresh(model_path)
+        load_model(model_path, mmap=True)
+        assert sidecar_is_fresh(model_path)
+        assert os.path.isdir(sidecar_path(model_path))
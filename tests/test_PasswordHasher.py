@@ -0,0 +1,148 @@
+from application import db
+from application.metrics import metrics
+from application.models import User
+from application.passwords import HashingUnavailable, PasswordHasher, hash_method, password_hasher
+from datetime import datetime as dt
+from werkzeug.security import generate_password_hash
+import application.passwords as passwords
+import threading
+import time
+import pytest
+import json
+
+PASSWORD = "Password1234!"
+
+
+@pytest.fixture
+def legacy_user():
+    """User whose password was hashed with fewer iterations than the current method. Removed afterwards"""
+    user = User(
+        email="legacy@example.com",
+        password_hash=generate_password_hash(PASSWORD, "pbkdf2:sha256:1000"),
+        created=dt.utcnow(),
+    )
+    db.session.add(user)
+    db.session.commit()
+    yield user.id
+    db.session.query(User).filter_by(email="legacy@example.com").delete()
+    db.session.commit()
+
+
+def stored_hash(user_id):
+    return db.session.get(User, user_id).password_hash
+
+
+def login(client, password=PASSWORD):
+    data = {"email": "legacy@example.com", "password": password, "remember_me": False}
+    response = client.post("/api/login", data=json.dumps(data), content_type="application/json")
+    return response, json.loads(response.get_data(as_text=True))
+
+
+# Range Testing
+@pytest.mark.parametrize("workers", [0, 2])
+def test_hash_and_verify(workers, capsys):
+    with capsys.disabled():
+        hasher = PasswordHasher(method="pbkdf2:sha256:2000", salt_length=8, workers=workers)
+        try:
+            password_hash = hasher.hash(PASSWORD)
+            assert hash_method(password_hash) == "pbkdf2:sha256:2000"
+            assert hasher.verify(password_hash, PASSWORD) == (True, None)
+            assert hasher.verify(password_hash, "wrong") == (False, None)
+        finally:
+            hasher.shutdown()
+
+
+@pytest.mark.parametrize(
+    "method,stored,outdated",
+    [
+        ("pbkdf2:sha256:260000", "pbkdf2:sha256", False),  # Default iterations of werkzeug
+        ("pbkdf2:sha256:260000", "pbkdf2:sha256:260000", False),
+        ("pbkdf2:sha256:260000", "pbkdf2:sha256:150000", True),
+        ("pbkdf2:sha512:260000", "pbkdf2:sha256:260000", True),
+        ("pbkdf2:sha256:260000", "sha256", True),
+    ],
+)
+def test_needs_rehash(method, stored, outdated, capsys):
+    with capsys.disabled():
+        hasher = PasswordHasher(method=method, workers=0)
+        assert hasher.needs_rehash(generate_password_hash(PASSWORD, stored, 8)) == outdated
+
+
+# Consistency Testing
+def test_rehash_on_login(client, legacy_user, capsys):
+    with capsys.disabled():
+        rehashed = password_hasher.rehashed
+        response, body = login(client)
+        assert response.status_code == 200
+        assert hash_method(stored_hash(legacy_user)) == password_hasher.method
+        assert password_hasher.rehashed == rehashed + 1
+
+        # The new hash checks the same password, and is not rehashed again
+        response, body = login(client)
+        assert response.status_code == 200
+        assert password_hasher.rehashed == rehashed + 1
+
+
+def test_wrong_password_not_rehashed(client, legacy_user, capsys):
+    with capsys.disabled():
+        old_hash = stored_hash(legacy_user)
+        response, body = login(client, "Wrong1234!")
+        assert response.status_code == 403
+        assert stored_hash(legacy_user) == old_hash
+
+
+def test_hash_metrics(capsys):
+    with capsys.disabled():
+        hasher = PasswordHasher(method="pbkdf2:sha256:2000", workers=1)
+        try:
+            before = metrics.summary(passwords.HASH_METRIC, operation="hash").count
+            hasher.hash(PASSWORD)
+            assert metrics.summary(passwords.HASH_METRIC, operation="hash").count == before + 1
+            assert metrics.summary(passwords.QUEUE_METRIC, operation="hash").count >= 1
+        finally:
+            hasher.shutdown()
+        rendered = metrics.render()
+        assert "rentier_password_hash_seconds_count" in rendered
+        assert "rentier_password_rejected_total" in rendered
+
+
+# Expected Failure Testing
+def test_hasher_backpressure(capsys):
+    with capsys.disabled():
+        hasher = PasswordHasher(workers=1, max_pending=1, timeout=30)
+        try:
+            busy = threading.Thread(target=hasher.call, args=("hash", time.sleep, 0.5))
+            busy.start()
+            time.sleep(0.1)
+            with pytest.raises(HashingUnavailable) as error:
+                hasher.call("hash", time.sleep, 0)
+            assert error.value.code == 503
+            assert hasher.rejected == 1
+            busy.join()
+
+            # The slot is freed once the running call completes
+            assert hasher.call("hash", abs, -1) == 1
+        finally:
+            hasher.shutdown()
+
+
+def test_hasher_timeout(capsys):
+    with capsys.disabled():
+        hasher = PasswordHasher(workers=1, timeout=0.1)
+        try:
+            with pytest.raises(HashingUnavailable):
+                hasher.call("hash", time.sleep, 1)
+            assert hasher.timeouts == 1
+        finally:
+            hasher.shutdown()
+
+
+def test_login_api_unavailable(client, legacy_user, monkeypatch, capsys):
+    with capsys.disabled():
+        def full(password_hash, password):
+            raise HashingUnavailable("Too many logins are pending. Please try again later.")
+
+        monkeypatch.setattr(password_hasher, "verify", full)
+        response, body = login(client)
+        assert response.status_code == 503
+        assert body["message"] == "Too many logins are pending. Please try again later."
@@ -1,5 +1,6 @@
 import pytest
 import json
+from application.inference import prediction_cache
 
 
 @pytest.mark.usefixtures("fake_login")
@@ -204,3 +205,126 @@ def test_predict_api_rangetests(client, entrylist, capsys):
     test_predict_api(
         client, entrylist, capsys
     ) 
+
+
+# Batch Prediction
+@pytest.mark.usefixtures("fake_login")
+def test_predict_batch_api(client, capsys):
+    with capsys.disabled():
+        listings = [
+            {
+                "beds": 1,
+                "bathrooms": 1.5,
+                "accomodates": 6,
+                "minimum_nights": 1,
+                "room_type": "Entire home/apt",
+                "neighborhood": "Kallang",
+                "wifi": True,
+                "elevator": True,
+                "pool": True,
+                "actual_price": 183,
+            },
+            {
+                "beds": 1,
+                "bathrooms": 1,
+                "accomodates": 1,
+                "minimum_nights": 81,
+                "room_type": "Private room",
+                "neighborhood": "Novena",
+                "wifi": True,
+                "elevator": False,
+                "pool": False,
+                "actual_price": None,
+            },
+        ]
+        response = client.post(
+            "/api/predict/batch",
+            data=json.dumps(listings),
+            content_type="application/json",
+        )
+        response_body = json.loads(response.get_data(as_text=True))
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        assert response_body["errors"] == 0
+        assert len(response_body["results"]) == len(listings)
+
+        # Batched predictions should be the same as predicting each listing on its own
+        for listing, result in zip(listings, response_body["results"]):
+            response = client.post(
+                "/api/predict", data=json.dumps(listing), content_type="application/json"
+            )
+            single = json.loads(response.get_data(as_text=True))
+            assert result["prediction"] == pytest.approx(single["prediction"])
+            assert result["difference"] == pytest.approx(single["difference"])
+
+
+@pytest.mark.usefixtures("fake_login")
+def test_predict_batch_api_row_errors(client, capsys):
+    with capsys.disabled():
+        valid = {
+            "beds": 2,
+            "bathrooms": 1,
+            "accomodates": 2,
+            "minimum_nights": 90,
+            "room_type": "Private room",
+            "neighborhood": "Bukit Timah",
+            "wifi": True,
+            "elevator": True,
+            "pool": True,
+            "actual_price": None,
+        }
+        listings = [
+            valid,
+            dict(valid, beds=-2),  # Beds cannot have negative numbers
+            dict(valid, neighborhood="Polytechnic"),  # Invalid neighborhood
+            "not a listing",
+        ]
+        response = client.post(
+            "/api/predict/batch",
+            data=json.dumps(listings),
+            content_type="application/json",
+        )
+        response_body = json.loads(response.get_data(as_text=True))
+
+        assert response.status_code == 200
+        assert response_body["errors"] == 3
+        assert response_body["results"][0]["prediction"] > 0
+        for result in response_body["results"][1:]:
+            assert "prediction" not in result
+            assert result["message"]
+
+
+# Micro-batching should not change the predictions
+@pytest.mark.usefixtures("fake_login")
+def test_predict_api_microbatch(app, client, capsys):
+    with capsys.disabled():
+        data = {
+            "beds": 1,
+            "bathrooms": 1,
+            "accomodates": 1,
+            "minimum_nights": 81,
+            "room_type": "Private room",
+            "neighborhood": "Novena",
+            "wifi": True,
+            "elevator": False,
+            "pool": False,
+            "actual_price": 115,
+        }
+        expected = json.loads(
+            client.post(
+                "/api/predict", data=json.dumps(data), content_type="application/json"
+            ).get_data(as_text=True)
+        )
+        prediction_cache.clear()  # Make sure the prediction goes through the micro-batcher
+        app.config["MICROBATCH_ENABLED"] = True
+        try:
+            response = client.post(
+                "/api/predict", data=json.dumps(data), content_type="application/json"
+            )
+        finally:
+            app.config["MICROBATCH_ENABLED"] = False
+        response_body = json.loads(response.get_data(as_text=True))
+
+        assert response.status_code == 200
+        assert response_body["prediction"] == pytest.approx(expected["prediction"])
@@ -0,0 +1,92 @@
+from application.cache import LRUCache, MISSING
+from application.inference import cache_key, predict_one, predict_rows, prediction_cache
+import pytest
+import time
+
+
+def test_cache_lru_eviction(capsys):
+    with capsys.disabled():
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1  # "b" is now the least recently used
+        cache.set("c", 3)
+        assert cache.get("b") is MISSING
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        stats = cache.stats()
+        assert stats["size"] == 2
+        assert stats["evictions"] == 1
+        assert stats["hits"] == 3
+        assert stats["misses"] == 1
+
+
+def test_cache_ttl(capsys):
+    with capsys.disabled():
+        cache = LRUCache(maxsize=8, ttl=0.05)
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+        time.sleep(0.1)
+        assert cache.get("a") is MISSING
+        assert cache.stats()["expirations"] == 1
+
+
+def test_cache_generation(capsys):
+    with capsys.disabled():
+        old_model, new_model = object(), object()
+        cache = LRUCache(maxsize=8)
+        cache.set("a", 1, generation=old_model)
+        assert cache.get("a", generation=old_model) == 1
+        # A different model invalidates everything computed by the old one
+        assert cache.get("a", generation=new_model) is MISSING
+        assert cache.stats()["invalidations"] == 1
+
+
+def test_cache_disabled(capsys):
+    with capsys.disabled():
+        cache = LRUCache(maxsize=0)
+        cache.set("a", 1)
+        assert cache.get("a") is MISSING
+
+
+@pytest.mark.parametrize(
+    "row, equivalent",
+    [
+        (
+            {
+                "beds": 1,
+                "bathrooms": 1,
+                "accomodates": 2,
+                "minimum_nights": 3,
+                "room_type": "Private room",
+                "neighborhood": "Novena",
+                "wifi": True,
+                "elevator": False,
+                "pool": False,
+            },
+            {
+                "beds": 1.0,
+                "bathrooms": 1.0,
+                "accomodates": 2,
+                "minimum_nights": 3.0,
+                "room_type": "Private room",
+                "neighborhood": "Novena",
+                "wifi": True,
+                "elevator": False,
+                "pool": False,
+                "actual_price": 100,  # Not a model feature, so should not affect the key
+            },
+        )
+    ],
+)
+def test_prediction_cache(row, equivalent, capsys):
+    with capsys.disabled():
+        assert cache_key(row) == cache_key(equivalent)
+        prediction_cache.clear()
+        before = prediction_cache.stats()
+        prediction, version = predict_one(row)
+        assert predict_one(equivalent) == (prediction, version)
+        assert prediction == pytest.approx(predict_rows([row])[0])
+        after = prediction_cache.stats()
+        assert after["misses"] - before["misses"] == 1
+        assert after["hits"] - before["hits"] == 1
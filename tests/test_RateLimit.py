@@ -0,0 +1,156 @@
+from application import db
+from application.metrics import metrics
+from application.models import User
+from application.ratelimit import RateLimiter, TokenBuckets, rate_limiter
+from application.tokens import issue_token
+from concurrent.futures import ThreadPoolExecutor
+import time
+import pytest
+import json
+
+
+class Clock:
+    """Clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def limits(app, monkeypatch):
+    """Sets the rate limits of the app for a test, starting from empty buckets"""
+    rate_limiter.buckets.clear()
+
+    def set_limits(limits):
+        monkeypatch.setitem(app.config, "RATE_LIMITS", limits)
+
+    yield set_limits
+    rate_limiter.buckets.clear()
+
+
+@pytest.fixture
+def user_ids(populate_users):
+    return [user.id for user in db.session.query(User).order_by(User.id).limit(2)]
+
+
+def login(client, user_id):
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+
+
+# Range Testing
+def test_bucket_refill(capsys):
+    with capsys.disabled():
+        clock = Clock()
+        buckets = TokenBuckets(clock=clock)
+        assert [buckets.take("a", 2, 3) for _ in range(3)] == [0, 0, 0]
+        assert buckets.take("a", 2, 3) == pytest.approx(0.5)  # 1 token at 2 tokens per second
+        assert buckets.take("b", 2, 3) == 0  # Buckets are independent
+
+        clock.now += 0.25
+        assert buckets.take("a", 2, 3) == pytest.approx(0.25)
+        clock.now += 0.25
+        assert buckets.take("a", 2, 3) == 0
+        # Never refilled past the burst
+        clock.now += 60
+        assert [buckets.take("a", 2, 3) for _ in range(4)][-1] > 0
+
+
+def test_idle_buckets_swept(capsys):
+    with capsys.disabled():
+        clock = Clock()
+        buckets = TokenBuckets(sweep_interval=10, clock=clock, background=False)
+        buckets.take("idle", 1, 2)
+        buckets.take("busy", 1, 2)
+        clock.now += 1.5
+        assert buckets.sweep() == 0  # Neither is full yet
+        clock.now += 1
+        buckets.take("busy", 1, 2)
+        assert buckets.sweep() == 1 and len(buckets) == 1
+        # Swept from a request once the interval has passed
+        buckets.take("new", 1, 2)
+        clock.now += 11
+        buckets.take("another", 1, 2)
+        assert len(buckets) == 1 and buckets.evictions == 3
+
+
+def test_background_sweep(capsys):
+    with capsys.disabled():
+        clock = Clock()
+        buckets = TokenBuckets(sweep_interval=10, clock=clock)
+        buckets.take("idle", 1, 2)
+        clock.now += 11
+        buckets.take("new", 1, 2)
+        deadline = time.monotonic() + 5
+        while len(buckets) > 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(buckets) == 1 and buckets.evictions == 1
+
+
+def test_scopes(capsys):
+    with capsys.disabled():
+        limiter = RateLimiter(TokenBuckets(clock=Clock()))
+        limits = {"ip": {"rate": 1, "burst": 3}, "user": {"rate": 1, "burst": 1}}
+        assert limiter.check("api", limits, user_id=1, ip="10.0.0.1") is None
+        assert limiter.check("api", limits, user_id=1, ip="10.0.0.1") == ("user", 1)
+        assert limiter.check("api", limits, user_id=2, ip="10.0.0.1") is None
+        assert limiter.check("api", limits, user_id=3, ip="10.0.0.1") == ("ip", 1)
+        assert limiter.check("api", limits, user_id=3, ip="10.0.0.2") is None
+        assert limiter.check("other", limits, user_id=1, ip="10.0.0.1") is None  # Limits are per endpoint
+        assert limiter.stats()["throttled"] == {("api", "user"): 1, ("api", "ip"): 1}
+
+
+# Consistency Testing
+def test_concurrent_takes(capsys):
+    with capsys.disabled():
+        buckets = TokenBuckets(stripes=4, clock=Clock())
+        with ThreadPoolExecutor(8) as pool:
+            waits = list(pool.map(lambda idx: buckets.take(("api", idx % 2), 1, 100), range(1000)))
+        # The clock does not move, so each bucket gives exactly its burst
+        assert sum(wait == 0 for wait in waits) == 200
+
+
+def test_endpoint_limits(client, limits, user_ids, capsys):
+    with capsys.disabled():
+        limits({"api_user_stats": {"user": {"rate": 0.5, "burst": 2}}})
+        user_id, other_id = user_ids
+        login(client, user_id)
+        assert [client.get(f"/api/history/{user_id}/stats").status_code for _ in range(2)] == [200, 200]
+        response = client.get(f"/api/history/{user_id}/stats")
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "2"
+        assert "Too many requests from this user" in json.loads(response.get_data(as_text=True))["message"]
+
+        # Other users and endpoints are not affected
+        login(client, other_id)
+        assert client.get(f"/api/history/{other_id}/stats").status_code == 200
+        assert client.get(f"/api/history/{other_id}").status_code == 200
+
+        rendered = metrics.render()
+        assert 'rentier_rate_limited_total{endpoint="api_user_stats",scope="user"}' in rendered
+
+
+def test_token_user_limited(client, limits, user_ids, capsys):
+    with capsys.disabled():
+        limits({"api_user_stats": {"user": {"rate": 1, "burst": 1}}})
+        user_id = user_ids[0]
+        headers = {"Authorization": f"Bearer {issue_token(user_id)}"}
+        assert client.get(f"/api/history/{user_id}/stats", headers=headers).status_code == 200
+        # Another token of the same user shares the user's bucket
+        headers = {"Authorization": f"Bearer {issue_token(user_id)}"}
+        assert client.get(f"/api/history/{user_id}/stats", headers=headers).status_code == 429
+
+
+# Expected Failure Testing
+def test_ip_limit_anonymous(client, limits, capsys):
+    with capsys.disabled():
+        limits({"api_issue_token": {"ip": {"rate": 0.1, "burst": 1}}})
+        data = json.dumps({"email": "nobody@example.com", "password": "Password1234!"})
+        assert client.post("/api/tokens", data=data, content_type="application/json").status_code == 404
+        response = client.post("/api/tokens", data=data, content_type="application/json")
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "10"
+        assert "Too many requests from this address" in json.loads(response.get_data(as_text=True))["message"]
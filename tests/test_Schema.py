@@ -0,0 +1,203 @@
+from application import db
+from application.models import Entry
+from application.schema import ENTRY_REQUEST_SCHEMA, ENTRY_SCHEMA, LISTING_SCHEMA, ROW_ERRORS, SchemaError
+import datetime as dt
+import pytest
+import json
+
+LISTING = {
+    "beds": 2,
+    "bathrooms": 1,
+    "accomodates": 3,
+    "minimum_nights": 90,
+    "room_type": "Shared room",
+    "neighborhood": "Marine Parade",
+    "wifi": True,
+    "elevator": True,
+    "pool": False,
+    "actual_price": None,
+}
+
+
+def test_valid_listing(capsys):
+    with capsys.disabled():
+        # Counts are converted as they were by the prediction APIs, and unknown keys are dropped
+        row = LISTING_SCHEMA.check(dict(LISTING, beds="2", bathrooms=1, accomodates=3.0, link="https://www.airbnb.com"))
+        assert row == dict(LISTING, bathrooms=1.0)
+        assert type(row["beds"]) is int and type(row["bathrooms"]) is float
+        assert LISTING_SCHEMA.check(dict(LISTING, actual_price=120))["actual_price"] == 120
+
+
+@pytest.mark.parametrize(
+    "changes, errors",
+    [
+        ({"beds": -1}, {"beds": "Beds must be greater than or equal to zero"}),
+        ({"beds": "two"}, {"beds": "Beds must be an integer"}),
+        ({"neighborhood": "Atlantis", "wifi": "yes"}, {"neighborhood": "Neighborhood is invalid", "wifi": "Wifi must be a boolean"}),
+        ({"room_type": ["Shared room"]}, {"room_type": "Room type is invalid"}),
+        ({"actual_price": 0}, {"actual_price": "Actual price should be greater than 0"}),
+        ({"actual_price": True}, {"actual_price": "Actual price should be a number or None"}),
+        ({"beds": 4}, {"accomodates": "Accomodates must be greater than or equal to number of beds"}),
+        ({"pool": None}, {"pool": "Pool must be a boolean"}),
+        ({"bathrooms": float("nan")}, {"bathrooms": "Bathrooms must be a number"}),
+        ({"bathrooms": "inf"}, {"bathrooms": "Bathrooms must be a number"}),
+        ({"beds": float("nan")}, {"beds": "Beds must be an integer"}),
+        ({"minimum_nights": float("inf")}, {"minimum_nights": "MinimumNights must be an integer"}),
+        ({"actual_price": float("nan")}, {"actual_price": "Actual price should be a number or None"}),
+        ({"actual_price": float("inf")}, {"actual_price": "Actual price should be a number or None"}),
+    ],
+)
+def test_listing_errors(changes, errors, capsys):
+    with capsys.disabled():
+        row, found = LISTING_SCHEMA.validate(dict(LISTING, **changes))
+        assert found == errors
+        with pytest.raises(SchemaError) as error:
+            LISTING_SCHEMA.check(dict(LISTING, **changes))
+        assert error.value.errors == errors
+        assert isinstance(error.value, AssertionError)
+
+
+def test_missing_fields(capsys):
+    with capsys.disabled():
+        _, errors = LISTING_SCHEMA.validate({key: value for key, value in LISTING.items() if key not in ("beds", "pool")})
+        assert errors == {"beds": "Missing field beds", "pool": "Missing field pool"}
+        # Fields with a default can be left out
+        entry = dict(LISTING, link=None, prediction=95, difference=None)
+        assert ENTRY_REQUEST_SCHEMA.check(entry)["model_version"] is None
+        assert ENTRY_REQUEST_SCHEMA.check(entry)["prediction"] == 95.0
+
+
+@pytest.mark.parametrize(
+    "changes",
+    [{"prediction": float("nan")}, {"prediction": "inf"}, {"difference": float("nan")}, {"difference": float("-inf")}],
+)
+def test_entry_not_finite(changes, capsys):
+    with capsys.disabled():
+        entry = dict(dict(LISTING, link=None, prediction=95.0, difference=None), **changes)
+        _, errors = ENTRY_REQUEST_SCHEMA.validate(entry)
+        assert list(errors) == list(changes)
+        with pytest.raises(SchemaError):
+            Entry(**dict(entry, created=dt.datetime.utcnow()))
+
+
+def test_validate_many(capsys):
+    with capsys.disabled():
+        rows = [LISTING, dict(LISTING, beds=-1), "not a listing", dict(LISTING, beds=1)]
+        valid, valid_idx, invalid = LISTING_SCHEMA.validate_many(rows)
+        assert valid_idx == [0, 3]
+        assert valid == [LISTING_SCHEMA.check(rows[0]), LISTING_SCHEMA.check(rows[3])]
+        assert set(invalid) == {1, 2}
+        assert list(invalid[1]) == ["beds"]
+        assert invalid[2] == {ROW_ERRORS: "Listing should be a json object"}
+
+
+def test_entry_hooks(capsys):
+    with capsys.disabled():
+        entry = Entry(**LISTING, link=None, prediction=90.0, difference=None, created=dt.datetime.utcnow())
+        assert entry.neighborhood == "Marine Parade"
+        with pytest.raises(SchemaError) as error:
+            entry.accomodates = 0
+        assert error.value.errors == {"accomodates": "Accomodates must be greater than zero"}
+
+
+def test_entry_from_row(monkeypatch, capsys):
+    with capsys.disabled():
+        row = ENTRY_SCHEMA.check(dict(LISTING, link=None, prediction=90.0, difference=None, created=dt.datetime.utcnow()))
+        checked = []
+        check_field = ENTRY_SCHEMA.check_field
+        monkeypatch.setattr(ENTRY_SCHEMA, "check_field", lambda key, value: checked.append(key) or check_field(key, value))
+        entry = Entry.from_row(row)
+        assert checked == []  # The row was already validated
+        assert {key: getattr(entry, key) for key in row} == row
+        # Columns set afterwards are still checked
+        with pytest.raises(SchemaError):
+            entry.accomodates = 0
+        assert checked == ["accomodates"]
+
+
+def test_entry_rules_follow_listing(capsys):
+    with capsys.disabled():
+        for key, field in LISTING_SCHEMA.fields.items():
+            entry_field = ENTRY_SCHEMA.fields[key]
+            assert (entry_field.minimum, entry_field.exclusive, entry_field.choices, entry_field.nullable) == (
+                field.minimum,
+                field.exclusive,
+                field.choices,
+                field.nullable,
+            )
+            assert entry_field.coerce is None  # Entries are built from listings that were already converted
+        assert ENTRY_SCHEMA.checks == LISTING_SCHEMA.checks
+
+
+@pytest.mark.usefixtures("fake_login")
+def test_api_field_errors(client, capsys):
+    with capsys.disabled():
+        response = client.post(
+            "/api/predict", data=json.dumps(dict(LISTING, beds=-1, neighborhood="Atlantis")), content_type="application/json"
+        )
+        body = json.loads(response.get_data(as_text=True))
+        assert response.status_code == 400
+        assert body["fields"] == {
+            "beds": "Beds must be greater than or equal to zero",
+            "neighborhood": "Neighborhood is invalid",
+        }
+        assert body["message"] == "Beds must be greater than or equal to zero; Neighborhood is invalid"
+
+        response = client.post("/api/predict/batch", data=json.dumps([LISTING, dict(LISTING, wifi=1)]), content_type="application/json")
+        body = json.loads(response.get_data(as_text=True))
+        assert body["errors"] == 1
+        assert body["results"][1]["fields"] == {"wifi": "Wifi must be a boolean"}
+
+
+@pytest.mark.parametrize("changes", [{"bathrooms": float("nan")}, {"actual_price": float("nan")}, {"actual_price": float("inf")}])
+def test_api_not_finite(client, paged_user, changes, capsys):
+    with capsys.disabled():
+        # json.dumps writes NaN and Infinity, which the json decoder of the app accepts
+        response = client.post("/api/predict", data=json.dumps(dict(LISTING, **changes)), content_type="application/json")
+        assert response.status_code == 400
+        assert list(response.get_json()["fields"]) == list(changes)
+        entry = dict(LISTING, link=None, prediction=95.0, difference=None, **changes)
+        response = client.post(f"/api/history/{paged_user}", data=json.dumps(entry), content_type="application/json")
+        assert response.status_code == 400
+        response = client.post(
+            f"/api/history/{paged_user}", data=json.dumps(dict(entry, difference=float("nan"))), content_type="application/json"
+        )
+        assert response.status_code == 400
+
+
+@pytest.mark.parametrize("field", ["bathrooms", "actual_price"])
+def test_form_not_finite(app, client, monkeypatch, paged_user, n_paged_entries, field, capsys):
+    with capsys.disabled():
+        monkeypatch.setitem(app.config, "WTF_CSRF_ENABLED", False)
+        form = dict(LISTING, wifi="y", elevator="y", actual_price="")
+        del form["pool"]
+        for value in ("nan", "inf"):
+            # FloatField parses both
+            response = client.post("/predict", data=dict(form, **{field: value}))
+            assert "Input validation failed" in response.get_data(as_text=True)
+        assert db.session.query(Entry).filter_by(user_id=paged_user).count() == n_paged_entries
+
+
+@pytest.mark.parametrize("beds, accomodates, valid", [(0, 1, True), (0, 0, False), (1, 0, False)])
+def test_boundaries_agree(app, client, monkeypatch, paged_user, beds, accomodates, valid, capsys):
+    with capsys.disabled():
+        monkeypatch.setitem(app.config, "WTF_CSRF_ENABLED", False)
+        listing = dict(LISTING, beds=beds, accomodates=accomodates)
+        form = dict(listing, wifi="y", elevator="y", actual_price="")
+        del form["pool"]
+        # The prediction form, the prediction API and the entries accept the same listings
+        response = client.post("/predict", data=form)
+        assert ("Input validation failed" in response.get_data(as_text=True)) != valid
+        stored = db.session.query(Entry).filter_by(user_id=paged_user, beds=beds, accomodates=accomodates).count()
+        assert stored == (1 if valid else 0)
+        response = client.post("/api/predict", data=json.dumps(listing), content_type="application/json")
+        assert response.status_code == (200 if valid else 400)
+        row, errors = ENTRY_SCHEMA.validate(
+            dict(listing, link=None, prediction=90.0, difference=None, created=dt.datetime.utcnow())
+        )
+        assert (errors == {}) == valid
+        if valid:
+            Entry(**row)
+        else:
+            with pytest.raises(SchemaError):
+                Entry(**dict(listing, link=None, prediction=90.0, difference=None, created=dt.datetime.utcnow()))
@@ -0,0 +1,72 @@
+from application.storage import SQLITE_PROFILES, configure_storage, sqlite_pragmas
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool
+import pytest
+
+
+def make_db(path, **config):
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{path}", SQLALCHEMY_TRACK_MODIFICATIONS=False, **config)
+    db = SQLAlchemy(app)
+    configure_storage(app, db)
+    return app, db
+
+
+def pragma(connection, name):
+    return connection.execute(text(f"PRAGMA {name}")).scalar()
+
+
+def test_production_profile(tmp_path, capsys):
+    with capsys.disabled():
+        app, db = make_db(tmp_path / "prod.db", SQLITE_PROFILE="production", SQLITE_POOL_SIZE=2)
+        with app.app_context():
+            assert isinstance(db.engine.pool, QueuePool)
+            assert db.engine.pool.size() == 2
+
+            # Every connection of the pool gets the PRAGMAs, not only the first one
+            def read_pragmas(_):
+                with db.engine.connect() as connection:
+                    return {name: pragma(connection, name) for name in ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size")}
+
+            with ThreadPoolExecutor(4) as pool:
+                for pragmas in pool.map(read_pragmas, range(8)):
+                    assert pragmas == {
+                        "journal_mode": "wal",
+                        "synchronous": 1,  # NORMAL
+                        "busy_timeout": 5000,
+                        "cache_size": -64000,
+                        "mmap_size": 268435456,
+                    }
+
+
+def test_default_profile(tmp_path, capsys):
+    with capsys.disabled():
+        app, db = make_db(tmp_path / "default.db")
+        with app.app_context():
+            assert not isinstance(db.engine.pool, QueuePool)
+            with db.engine.connect() as connection:
+                assert pragma(connection, "journal_mode") == "delete"
+                assert pragma(connection, "synchronous") == 2  # FULL
+
+
+def test_pragma_overrides(tmp_path, capsys):
+    with capsys.disabled():
+        overrides = {"synchronous": "FULL", "busy_timeout": 250}
+        assert sqlite_pragmas({"SQLITE_PROFILE": "production", "SQLITE_PRAGMAS": overrides}) == {
+            **SQLITE_PROFILES["production"],
+            **overrides,
+        }
+        # Overrides apply to the default profile too
+        app, db = make_db(tmp_path / "overrides.db", SQLITE_PRAGMAS={"busy_timeout": 250})
+        with app.app_context(), db.engine.connect() as connection:
+            assert pragma(connection, "busy_timeout") == 250
+            assert pragma(connection, "journal_mode") == "delete"
+
+
+@pytest.mark.xfail(reason="Unknown storage profile", raises=ValueError, strict=True)
+def test_unknown_profile(capsys):
+    with capsys.disabled():
+        sqlite_pragmas({"SQLITE_PROFILE": "fastest"})
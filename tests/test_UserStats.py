@@ -0,0 +1,185 @@
+from application import app, db
+from application.models import Entry, add_entries, add_entry, delete_entry
+from application.stats import check_user_stats, get_user_stats, rebuild_user_stats, update_user_stats
+from sqlalchemy import event
+from datetime import datetime as dt
+import pytest
+import json
+
+
+# Range Testing
+@pytest.mark.parametrize(
+    "differences,median",
+    [
+        ([None], None),
+        ([5.0], 5.0),
+        ([10.0, -4.0, 2.0], 2.0),
+        ([10.0, -4.0, 2.0, 6.0], 4.0),
+        ([3.0, None, -1.0, None, 7.0], 3.0),
+    ],
+)
+def test_summary(stats_user, make_entry, differences, median, capsys):
+    with capsys.disabled():
+        for difference in differences:
+            add_entry(make_entry(stats_user, difference))
+        stats = get_user_stats(stats_user)
+        known = [difference for difference in differences if difference is not None]
+        assert stats["entries"] == len(differences)
+        if known:
+            assert stats["mean_difference"] == pytest.approx(sum(known) / len(known))
+            assert stats["mean_absolute_difference"] == pytest.approx(sum(map(abs, known)) / len(known))
+        else:
+            assert stats["mean_difference"] is None
+            assert stats["mean_absolute_difference"] is None
+        assert stats["median_difference"] == median
+        assert check_user_stats() == []
+
+
+def test_breakdowns(stats_user, make_entry, capsys):
+    with capsys.disabled():
+        add_entry(make_entry(stats_user, 10.0))
+        add_entry(make_entry(stats_user, -2.0, neighborhood="Bedok"))
+        add_entry(make_entry(stats_user, 4.0, room_type="Entire home/apt"))
+        stats = get_user_stats(stats_user)
+        assert stats["neighborhood"] == {
+            "Novena": {"entries": 2, "mean_difference": 7.0},
+            "Bedok": {"entries": 1, "mean_difference": -2.0},
+        }
+        assert stats["room_type"] == {
+            "Private room": {"entries": 2, "mean_difference": 4.0},
+            "Entire home/apt": {"entries": 1, "mean_difference": 4.0},
+        }
+
+
+def test_empty_summary(stats_user, capsys):
+    with capsys.disabled():
+        assert get_user_stats(stats_user) == {
+            "entries": 0,
+            "mean_difference": None,
+            "mean_absolute_difference": None,
+            "median_difference": None,
+            "neighborhood": {},
+            "room_type": {},
+        }
+
+
+# Consistency Testing
+def test_bulk_updates_summary(stats_user, make_entry, entry_listing, capsys):
+    with capsys.disabled():
+        add_entry(make_entry(stats_user, 1.0))
+        rows = [
+            dict(entry_listing, user_id=stats_user, actual_price=None, difference=difference, created=dt.utcnow())
+            for difference in (3.0, -5.0, None)
+        ]
+        add_entries(rows, return_ids=False)
+        stats = get_user_stats(stats_user)
+        assert stats["entries"] == 4
+        assert stats["mean_difference"] == pytest.approx(-1 / 3)
+        assert stats["median_difference"] == 1.0
+        assert check_user_stats() == []
+
+
+def test_delete_updates_summary(stats_user, make_entry, capsys):
+    with capsys.disabled():
+        first = make_entry(stats_user, 10.0, neighborhood="Bedok")
+        add_entry(first)
+        add_entry(make_entry(stats_user, 20.0))
+        delete_entry(first)
+        stats = get_user_stats(stats_user)
+        assert stats["entries"] == 1
+        assert stats["mean_difference"] == 20.0
+        assert stats["median_difference"] == 20.0
+        # Values left without entries are dropped, as they would be by a rebuild
+        assert list(stats["neighborhood"]) == ["Novena"]
+        assert check_user_stats() == []
+
+        delete_entry(db.session.query(Entry).filter_by(user_id=stats_user).one())
+        assert get_user_stats(stats_user)["entries"] == 0
+        assert check_user_stats() == []
+
+
+def test_stats_api(client, stats_user, make_entry, capsys):
+    with capsys.disabled():
+        add_entry(make_entry(stats_user, 8.0))
+        add_entry(make_entry(stats_user, -2.0))
+        response = client.get(f"/api/history/{stats_user}/stats")
+        body = json.loads(response.get_data(as_text=True))
+        assert response.status_code == 200
+        assert body == get_user_stats(stats_user)
+        assert body["entries"] == 2
+        assert body["median_difference"] == 3.0
+
+
+def test_history_page_summary(client, stats_user, make_entry, capsys):
+    with capsys.disabled():
+        add_entry(make_entry(stats_user, 12.5, neighborhood="Bedok"))
+        response = client.get("/history")
+        page = response.get_data(as_text=True)
+        assert response.status_code == 200
+        assert 'id="history-summary"' in page
+        assert "Bedok" in page
+        assert "12.5" in page
+
+
+def test_rebuild_after_drift(stats_user, make_entry, capsys):
+    with capsys.disabled():
+        add_entry(make_entry(stats_user, 5.0))
+        add_entry(make_entry(stats_user, 9.0, neighborhood="Bedok"))
+        # Deleting with a query bypasses delete_entry, leaving the summary out of date
+        db.session.query(Entry).filter_by(user_id=stats_user, neighborhood="Bedok").delete()
+        db.session.commit()
+        assert check_user_stats() == [stats_user]
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=["rebuild-stats", "--check"])
+        assert result.exit_code == 1
+        assert f"Summary of user {stats_user} is out of date" in result.output
+
+        result = runner.invoke(args=["rebuild-stats"])
+        assert result.exit_code == 0
+        assert check_user_stats() == []
+        assert get_user_stats(stats_user)["entries"] == 1
+        assert get_user_stats(stats_user)["mean_difference"] == 5.0
+        assert runner.invoke(args=["rebuild-stats", "--check"]).exit_code == 0
+
+
+def test_median_cached(stats_user, make_entry, capsys):
+    with capsys.disabled():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        def history_reads():
+            statements.clear()
+            event.listen(db.engine, "before_cursor_execute", record)
+            try:
+                median = get_user_stats(stats_user)["median_difference"]
+            finally:
+                event.remove(db.engine, "before_cursor_execute", record)
+            return median, [statement for statement in statements if "FROM history " in statement + " "]
+
+        add_entry(make_entry(stats_user, 4.0))
+        add_entry(make_entry(stats_user, 8.0))
+        median, reads = history_reads()
+        assert median == 6.0 and len(reads) == 1
+        # Read from the history once per generation of the user's history
+        median, reads = history_reads()
+        assert median == 6.0 and reads == []
+        add_entry(make_entry(stats_user, 1.0))
+        median, reads = history_reads()
+        assert median == 4.0 and len(reads) == 1
+
+
+# Expected Failure Testing
+@pytest.mark.parametrize("other", [0, 10 ** 6])
+def test_stats_api_other_user(client, stats_user, other, capsys):
+    with capsys.disabled():
+        response = client.get(f"/api/history/{stats_user + other + 1}/stats")
+        assert response.status_code == 403
+
+
+@pytest.mark.xfail(reason="Rows without the columns of the summaries are rejected", raises=KeyError, strict=True)
+def test_update_missing_columns(stats_user, capsys):
+    with capsys.disabled():
+        update_user_stats([{"user_id": stats_user, "difference": 1.0}])